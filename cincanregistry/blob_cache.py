@@ -0,0 +1,123 @@
+import hashlib
+import logging
+import os
+import pathlib
+import tempfile
+import threading
+from typing import Union
+
+DIGEST_ALGORITHM = "sha256"
+
+
+class BlobCache:
+    """
+    Persistent, content-addressed store for immutable registry blobs (image configs, meta layers).
+    Blobs are stored by their digest as 'sha256/<first two chars>/<hex>'.
+
+    Total size is bounded; least recently used blobs are evicted first. Modification time of the
+    file is updated on every read to mark the use. Content is verified against digest on read.
+    """
+
+    def __init__(self, location: pathlib.Path, max_size: int):
+        self.logger = logging.getLogger("blobcache")
+        self.location: pathlib.Path = location
+        self.max_size: int = max_size
+        self.lock = threading.Lock()
+        # Total size of stored blobs, calculated on first write
+        self._size: Union[int, None] = None
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def _path(self, digest: str) -> Union[pathlib.Path, None]:
+        """Path for digest, None if digest is not supported"""
+        algorithm, _, hex_digest = digest.partition(":")
+        if algorithm != DIGEST_ALGORITHM or len(hex_digest) != 64 or not all(
+                c in "0123456789abcdef" for c in hex_digest):
+            return None
+        return self.location / algorithm / hex_digest[:2] / hex_digest
+
+    def get(self, digest: str) -> Union[bytes, None]:
+        """Get content of blob by digest, None if not stored or content does not match the digest"""
+        path = self._path(digest)
+        if not path:
+            return None
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        if f"{DIGEST_ALGORITHM}:{hashlib.sha256(data).hexdigest()}" != digest:
+            self.logger.warning(f"Cached blob {digest} is corrupted, removing it.")
+            self._remove(path)
+            self.misses += 1
+            return None
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        self.hits += 1
+        return data
+
+    def put(self, digest: str, data: bytes) -> bool:
+        """Store blob, if content matches the digest. Returns True if stored."""
+        path = self._path(digest)
+        if not path:
+            return False
+        if f"{DIGEST_ALGORITHM}:{hashlib.sha256(data).hexdigest()}" != digest:
+            self.logger.warning(f"Content of blob does not match the digest {digest}, not cached.")
+            return False
+        if len(data) > self.max_size:
+            return False
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write into temporary file first, readers never see partial blob
+        fd, tmp_name = tempfile.mkstemp(dir=str(path.parent), prefix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        existed = path.exists()
+        os.replace(tmp_name, str(path))
+        with self.lock:
+            if self._size is None:
+                self._size = self._calculate_size()
+            elif not existed:
+                self._size += len(data)
+            if self._size > self.max_size:
+                self._evict()
+        return True
+
+    def _calculate_size(self) -> int:
+        return sum(p.stat().st_size for p in self.location.glob(f"{DIGEST_ALGORITHM}/*/*"))
+
+    def _remove(self, path: pathlib.Path):
+        try:
+            size = path.stat().st_size
+            path.unlink()
+        except FileNotFoundError:
+            return
+        with self.lock:
+            if self._size is not None:
+                self._size -= size
+
+    def _evict(self):
+        """Remove least recently used blobs until size is under 90% of the maximum. Lock must be held."""
+        blobs = []
+        for p in self.location.glob(f"{DIGEST_ALGORITHM}/*/*"):
+            try:
+                stat = p.stat()
+            except FileNotFoundError:
+                continue
+            blobs.append((stat.st_mtime, stat.st_size, p))
+        blobs.sort()
+        size = sum(b[1] for b in blobs)
+        target = self.max_size * 0.9
+        removed = 0
+        for _, blob_size, p in blobs:
+            if size <= target:
+                break
+            try:
+                p.unlink()
+            except FileNotFoundError:
+                pass
+            size -= blob_size
+            removed += 1
+        self._size = size
+        self.logger.debug(f"Evicted {removed} blobs from cache, size now {size} bytes.")
@@ -6,13 +6,16 @@ from typing import List, Dict
 import requests
 from requests.exceptions import Timeout, ConnectionError
 
+from ..http_policy import HttpPolicy, PolicySession
+
 NO_VERSION = "Not found"
 __name__ = "checker"
 
 
 class UpstreamChecker(metaclass=ABCMeta):
     def __init__(
-            self, tool_info: dict, token: str = "", timeout=20, version="", extra_info=""
+            self, tool_info: dict, token: str = "", timeout=None, version="", extra_info="",
+            policy: HttpPolicy = None
     ):
         self.uri: str = tool_info.get("uri", "")
         self.repository: str = tool_info.get("repository", "")
@@ -30,7 +33,10 @@ class UpstreamChecker(metaclass=ABCMeta):
         self.extra_info: str = extra_info
         self.token: str = token
         self.logger = logging.getLogger(__name__)
-        self.timeout: int = timeout
+        # Policy is shared by all checkers, for circuit breakers by host
+        self.policy: HttpPolicy = policy or HttpPolicy()
+        self.timeout = timeout if timeout is not None else self.policy.timeout
+        self.session: requests.Session = PolicySession(self.policy)
 
         if not (self.uri or (self.repository and self.tool and self.provider)):
             raise ValueError(
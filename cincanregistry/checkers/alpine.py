@@ -9,7 +9,6 @@ class AlpineChecker(UpstreamChecker):
 
     def __init__(self, tool_info: dict, **kwargs):
         super().__init__(tool_info, **kwargs)
-        self.session = requests.Session()
         self.api = "https://git.alpinelinux.org/aports/plain"
         self.tool = self.tool.strip("/")
         self.repository = self.repository.strip("/")
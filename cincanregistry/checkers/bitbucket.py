@@ -1,11 +1,9 @@
 from ._checker import UpstreamChecker, NO_VERSION
-import requests
 
 
 class BitbucketChecker(UpstreamChecker):
     def __init__(self, tool_info: dict, **kwargs):
         super().__init__(tool_info, **kwargs)
-        self.session = requests.Session()
         self.api = "https://api.bitbucket.org/2.0"
         self.repository = self.repository.strip("/")
         self.tool = self.tool.strip("/")
@@ -9,7 +9,6 @@ class DebianChecker(UpstreamChecker):
 
     def __init__(self, tool_info: dict, **kwargs):
         super().__init__(tool_info, **kwargs)
-        self.session = requests.Session()
         self.api = "https://sources.debian.org/api/src/"
         self.tool = self.tool.strip("/")
 
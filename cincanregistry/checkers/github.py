@@ -19,7 +19,6 @@ class GitHubChecker(UpstreamChecker):
         It is enough to be functional and rise API limit.
         """
         super().__init__(tool_info, **kwargs)
-        self.session = requests.Session()
         self.session.headers.update({"Accept": "application/vnd.github.v3+json"})
         if self.token:
             self.session.headers.update({"Authorization": f"token {self.token}"})
@@ -21,7 +21,9 @@ class GitLabChecker(UpstreamChecker, GitLabUtils):
             url=self.uri,
             namespace=self.repository,
             project=self.tool,
-            token=kwargs.get("token", "")
+            token=kwargs.get("token", ""),
+            session=self.session,
+            timeout=self.timeout,
         )
 
     def _get_version(self, curr_ver: str = ""):
@@ -9,7 +9,6 @@ class PypiChecker(UpstreamChecker):
 
     def __init__(self, tool_info: dict, **kwargs):
         super().__init__(tool_info, **kwargs)
-        self.session = requests.Session()
         self.api = "https://pypi.org/"
         self.repository = self.repository.strip("/")
         self.tool = self.tool.strip("/")
@@ -36,8 +36,26 @@ class Configuration:
             self.values: Dict = {}
         # Override from cmd only if non-default used
         self.registry = Remotes(self.values.get("registry")) if self.values.get("registry") else list(Remotes)[0]
+        # Root URL of the remote registry instead of the public service, e.g. local stand-in server
+        self.registry_url: str = self.values.get("registry_url", "").rstrip("/")
         # Maximum threads at once
         self.max_workers: int = 30
+        # HTTP backend for remote registry requests, 'httpx' (async, HTTP/2) or 'requests' (threads)
+        self.http_backend: str = self.values.get("http_backend", "httpx")
+        # Maximum simultaneous connections with 'httpx' backend
+        self.max_connections: int = self.values.get("max_connections", 100)
+        # Maximum tags of single tool fetched at once
+        self.max_tag_requests: int = self.values.get("max_tag_requests", 10)
+        # Longest pause in seconds when rate limited by registry, and retries of single request
+        self.rate_limit_max_wait: int = self.values.get("rate_limit_max_wait", 120)
+        self.rate_limit_retries: int = self.values.get("rate_limit_retries", 5)
+        # Timeouts in seconds and retries of failed requests, for registries and upstream checkers
+        self.http_connect_timeout: float = self.values.get("http_connect_timeout", 10)
+        self.http_read_timeout: float = self.values.get("http_read_timeout", 30)
+        self.http_retries: int = self.values.get("http_retries", 3)
+        # Consecutive failures before requests to host fail fast, and seconds until it is tried again
+        self.breaker_threshold: int = self.values.get("breaker_threshold", 5)
+        self.breaker_reset: float = self.values.get("breaker_reset", 30)
         # Tokens for different platforms used in version checking and meta file download
         self.tokens: Dict = self.values.get("tokens", {})
         # Lowercase keys to mach upstream checkers
@@ -47,6 +65,31 @@ class Configuration:
             if self.values.get("cache_path") \
             else self.home / "cache"
         self.tool_db = self.cache_location / "tooldb.sqlite"
+        # SQLite connection profile, applied on every open of the database. Foreign keys are always enforced.
+        self.db_journal_mode: str = self.values.get("db_journal_mode", "wal")
+        self.db_synchronous: str = self.values.get("db_synchronous", "normal")
+        self.db_mmap_size: int = self.values.get("db_mmap_size", 1024 * 1024 * 64)  # In bytes
+        self.db_cache_size: int = self.values.get("db_cache_size", -1024 * 16)  # Pages, or KiB when negative
+        self.db_temp_store: str = self.values.get("db_temp_store", "memory")
+        self.db_busy_timeout: int = self.values.get("db_busy_timeout", 5000)  # In milliseconds
+        # Refreshed data is written by single writer thread, committed after this many writes or seconds
+        self.db_write_batch: int = self.values.get("db_write_batch", 100)
+        self.db_write_interval: float = self.values.get("db_write_interval", 1.0)
+        # Retention of version history, applied with 'utils retention' (e.g. by cron after the update)
+        # Newest upstream versions kept of each tool and provider
+        self.retention_upstream_versions: int = self.values.get("retention_upstream_versions", 10)
+        # Days remote versions are kept after their tags are removed, and days tag changes are kept
+        self.retention_removed_tag_days: int = self.values.get("retention_removed_tag_days", 30)
+        self.retention_tag_changes_days: int = self.values.get("retention_tag_changes_days", 365)
+        # Free pages released from database file at once, 0 for all
+        self.retention_vacuum_pages: int = self.values.get("retention_vacuum_pages", 0)
+        # Content-addressed cache for image config and meta layer blobs
+        self.blob_cache: pathlib.Path = self.cache_location / "blobs"
+        self.blob_cache_max_size: int = self.values.get("blob_cache_max_size", 1000 * 1000 * 100)  # In bytes
+        # Bearer tokens of registry auth services, kept until they expire
+        self.token_cache: pathlib.Path = self.cache_location / "tokens.json"
+        # Maximum repositories in single token request
+        self.max_token_scopes: int = self.values.get("max_token_scopes", 20)
         self.cache_lifetime: int = 24  # Cache validity in hours
         # Location for cached Docker Hub manifest information
         self.tool_cache: pathlib.Path = pathlib.Path(self.values.get("registry_cache_path")) if self.values.get(
@@ -62,12 +105,16 @@ class Configuration:
         )
         # Default tag representing latest image
         self.tag = self.values.get("latest-tag", "latest")
+        # Platform of multi-platform images, which version and size are used for the tag
+        self.platform: str = self.values.get("platform", "linux/amd64")
 
         # Default branch in GitLab
         self.branch: str = self.values.get("branch", "master")
         # Name for meta files in GitLab
         self.meta_filename: str = self.values.get("metadata_filename", "meta.json")
         self.meta_max_size: int = 1000 * 5  # In bytes, metafile max size
+        # In bytes, maximum download when meta file is searched from larger layer by streaming
+        self.meta_layer_max_size: int = self.values.get("meta_layer_max_size", 1000 * 1000)
         # Index file in GitLab
         self.index_file: str = self.values.get("index_filename", "index.yml")
         # Disable meta file download from GitLab
@@ -96,6 +143,8 @@ class Configuration:
                       f"(no version information)", file=f)
                 print(f"tools_repo__path: {self.tools_repo_path} # Path for local 'tools'"
                       f" repository (Use metafiles from there)", file=f)
+                print(f"http_backend: {self.http_backend} # 'httpx' (async, HTTP/2) or 'requests' for "
+                      f"registry requests", file=f)
                 # print(f"latest-tag: {self.tag}# Default tag representing latest image", file=f)
 
                 print(f"\n# Configuration related to tool metafiles.", file=f)
@@ -1,26 +1,37 @@
+import asyncio
 import datetime
 import logging
+import queue
+import re
 import sqlite3
+import threading
+import time
 from contextlib import contextmanager
-from typing import List, Union, Any, Tuple, Dict
+from typing import List, Union, Any, Tuple, Dict, NamedTuple, Callable
 
 from . import ToolInfo
 from . import VersionInfo, VersionType
 from .checkers import classmap, UpstreamChecker
 from .configuration import Configuration
-from .utils import format_time, parse_file_time
+from .utils import epoch_time, parse_epoch_time
 
 # sqlite3.register_adapter(datetime.datetime, adapt_datetime)
 TABLE_TOOLS = "tools"
 TABLE_METADATA = "metadata"
 TABLE_VERSION_DATA = "version_data"
 TABLE_META_CONF = "metaconf"
+TABLE_TAG_DIGESTS = "tag_digests"
+TABLE_VALIDATORS = "http_validators"
+TABLE_TAG_CHANGES = "tag_changes"
+TABLE_TAG_PLATFORMS = "tag_platforms"
+TABLE_VERSION_TAGS = "version_tags"
 # TABLE_CHECKER = "checker_extra"
+# Times are stored as integer seconds from epoch, see utils.epoch_time()
 
 c_tool = f'''CREATE TABLE if not exists {TABLE_TOOLS}(
     -- id INTEGER PRIMARY KEY, -- autoincrement could prevent reuse of deleted rows
     name TEXT NOT NULL, -- must be unique with location, we don't have tools with same names
-    updated TEXT NOT NULL,
+    updated INTEGER NOT NULL,
     location TEXT NOT NULL,
     description TEXT NOT NULL ON CONFLICT REPLACE DEFAULT '',
     UNIQUE (name, location)
@@ -39,7 +50,7 @@ c_metadata = f'''CREATE TABLE if not exists {TABLE_METADATA}(
     method TEXT NOT NULL, 
     origin INTEGER NOT NULL ON CONFLICT REPLACE DEFAULT 0, 
     docker_origin INTEGER NOT NULL ON CONFLICT REPLACE DEFAULT 0,
-    updated TEXT NOT NULL, -- not in provided meta file which is parsed from external source
+    updated INTEGER NOT NULL, -- not in provided meta file which is parsed from external source
     FOREIGN KEY (tool_id, tool_location)
         REFERENCES {TABLE_TOOLS} (name, location),
     UNIQUE (uri, repository, tool, provider) ON CONFLICT REPLACE 
@@ -54,11 +65,11 @@ c_version_data = f'''CREATE TABLE if not exists {TABLE_VERSION_DATA}(
     version_type TEXT,
     source TEXT NOT NULL, -- upstream provider, local or remote
     tags TEXT NOT NULL, -- comma separated string
-    updated TEXT NOT NULL,
+    updated INTEGER NOT NULL,
     origin INTEGER NOT NULL,
     size TEXT,
     -- when created in database
-    created TEXT NOT NULL,
+    created INTEGER NOT NULL,
     extra_info TEXT,
     FOREIGN KEY (meta_id)
         REFERENCES {TABLE_METADATA} (meta_id) ON DELETE CASCADE ,
@@ -68,6 +79,147 @@ c_version_data = f'''CREATE TABLE if not exists {TABLE_VERSION_DATA}(
     UNIQUE (tool_id, version, version_type, source) ON CONFLICT REPLACE
 );'''
 
+# Manifest digest of every remote tag, used to skip fetching of unchanged tags
+c_tag_digests = f'''CREATE TABLE if not exists {TABLE_TAG_DIGESTS}(
+    tool_id TEXT NOT NULL,
+    tool_location TEXT NOT NULL,
+    tag TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    updated INTEGER NOT NULL,
+    FOREIGN KEY (tool_id, tool_location)
+        REFERENCES {TABLE_TOOLS} (name, location) ON DELETE CASCADE ,
+    UNIQUE (tool_id, tool_location, tag) ON CONFLICT REPLACE
+);'''
+
+# Log of remote tags added, moved into another manifest or removed, found when tags are reconciled
+c_tag_changes = f'''CREATE TABLE if not exists {TABLE_TAG_CHANGES}(
+    id INTEGER PRIMARY KEY,
+    tool_id TEXT NOT NULL,
+    tool_location TEXT NOT NULL,
+    tag TEXT NOT NULL,
+    change TEXT NOT NULL, -- added, moved or removed
+    digest TEXT NOT NULL ON CONFLICT REPLACE DEFAULT '', -- new digest of the tag, empty when removed
+    changed INTEGER NOT NULL,
+    FOREIGN KEY (tool_id, tool_location)
+        REFERENCES {TABLE_TOOLS} (name, location) ON DELETE CASCADE
+);'''
+
+# Image of every platform in remote tags, multi-platform tags have multiple rows
+c_tag_platforms = f'''CREATE TABLE if not exists {TABLE_TAG_PLATFORMS}(
+    tool_id TEXT NOT NULL,
+    tool_location TEXT NOT NULL,
+    tag TEXT NOT NULL,
+    platform TEXT NOT NULL, -- os/architecture[/variant]
+    digest TEXT NOT NULL ON CONFLICT REPLACE DEFAULT '', -- digest of image manifest
+    version TEXT NOT NULL ON CONFLICT REPLACE DEFAULT '',
+    updated INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    FOREIGN KEY (tool_id, tool_location)
+        REFERENCES {TABLE_TOOLS} (name, location) ON DELETE CASCADE ,
+    UNIQUE (tool_id, tool_location, tag, platform) ON CONFLICT REPLACE
+);'''
+
+# Cache validators (ETag, Last-Modified) of registry listing endpoints, used in conditional requests
+c_validators = f'''CREATE TABLE if not exists {TABLE_VALIDATORS}(
+    endpoint TEXT NOT NULL, -- url with sorted query parameters
+    location TEXT NOT NULL,
+    etag TEXT NOT NULL ON CONFLICT REPLACE DEFAULT '',
+    last_modified TEXT NOT NULL ON CONFLICT REPLACE DEFAULT '',
+    updated INTEGER NOT NULL,
+    UNIQUE (endpoint, location) ON CONFLICT REPLACE
+);'''
+
+# Tags of versions one per row, for tag queries. Comma separated 'tags' column of versions is kept as well.
+c_version_tags = f'''CREATE TABLE if not exists {TABLE_VERSION_TAGS}(
+    version_id INTEGER NOT NULL,
+    tag TEXT NOT NULL,
+    FOREIGN KEY (version_id)
+        REFERENCES {TABLE_VERSION_DATA} (id) ON DELETE CASCADE ,
+    PRIMARY KEY (tag, version_id) ON CONFLICT IGNORE
+) WITHOUT ROWID;'''
+
+# Tags of all existing versions, split from the comma separated column
+s_fill_version_tags = f'''INSERT INTO {TABLE_VERSION_TAGS}(version_id, tag)
+WITH RECURSIVE split(version_id, tag, rest) AS (
+    SELECT id, '', tags || ',' FROM {TABLE_VERSION_DATA}
+    UNION ALL
+    SELECT version_id, substr(rest, 1, instr(rest, ',') - 1), substr(rest, instr(rest, ',') + 1)
+    FROM split WHERE rest <> ''
+)
+SELECT version_id, tag FROM split WHERE tag <> ''
+'''
+
+# Indexes matched to the hot queries, see ToolDatabase.explain_queries()
+c_indexes = [
+    # Tools of registry, and their names as subquery of versions and meta information
+    f"CREATE INDEX IF NOT EXISTS idx_tools_location ON {TABLE_TOOLS}(location, name)",
+    # Versions of tool by type and provider, latest first
+    f"CREATE INDEX IF NOT EXISTS idx_version_data_type ON {TABLE_VERSION_DATA}(tool_id, version_type, source, updated)",
+    # Both lookups of get_meta_id, meta_id is the rowid and included in the index
+    f"CREATE INDEX IF NOT EXISTS idx_metadata_checker ON {TABLE_METADATA}(tool_id, tool, provider, uri, repository)",
+    # Provider is compared case-insensitively in get_meta_information
+    f"CREATE INDEX IF NOT EXISTS idx_metadata_provider ON {TABLE_METADATA}(tool_id, provider COLLATE NOCASE)",
+    # Change history of tool
+    f"CREATE INDEX IF NOT EXISTS idx_tag_changes_tool ON {TABLE_TAG_CHANGES}(tool_id, tool_location)",
+]
+# Tags of version, deleted with the version
+c_version_tags_index = f"CREATE INDEX IF NOT EXISTS idx_version_tags_version ON {TABLE_VERSION_TAGS}(version_id)"
+# Parameters of single statement, SQLite before 3.32 allows at most 999
+MAX_QUERY_PARAMS = 500
+# Version by its unique columns, version can be NULL
+s_version_id = f"SELECT id FROM {TABLE_VERSION_DATA} " \
+               f"WHERE tool_id = ? AND version IS ? AND version_type IS ? AND source = ?"
+
+
+def _create_indexes(db: "ToolDatabase"):
+    for statement in c_indexes:
+        db.cursor.execute(statement)
+
+
+def _create_version_tags(db: "ToolDatabase"):
+    db.cursor.execute(c_version_tags)
+    db.cursor.execute(c_version_tags_index)
+    db.cursor.execute(s_fill_version_tags)
+
+
+def _epoch_timestamps(db: "ToolDatabase"):
+    """Tables with TEXT timestamps are rebuilt with INTEGER columns, ISO8601 values converted into epoch"""
+    tables = [(TABLE_TOOLS, c_tool, ["updated"]), (TABLE_METADATA, c_metadata, ["updated"]),
+              (TABLE_VERSION_DATA, c_version_data, ["updated", "created"]),
+              (TABLE_TAG_DIGESTS, c_tag_digests, ["updated"]), (TABLE_TAG_CHANGES, c_tag_changes, ["changed"]),
+              (TABLE_TAG_PLATFORMS, c_tag_platforms, ["updated"]), (TABLE_VALIDATORS, c_validators, ["updated"])]
+    for table, statement, columns in tables:
+        db.cursor.execute(f"PRAGMA table_info({table})")
+        if all(row["type"] == "INTEGER" for row in db.cursor.fetchall() if row["name"] in columns):
+            continue
+        # Same columns in same order, only types changed. Foreign keys are off, dropping does not cascade.
+        db.cursor.execute(statement.replace(f"CREATE TABLE if not exists {table}(", f"CREATE TABLE {table}_epoch(", 1))
+        db.cursor.execute(f"INSERT INTO {table}_epoch SELECT * FROM {table}")
+        db.cursor.execute(f"DROP TABLE {table}")
+        db.cursor.execute(f"ALTER TABLE {table}_epoch RENAME TO {table}")
+        # Times were stored without timezone, strftime handles them as UTC as epoch_time() does
+        db.cursor.execute(f"UPDATE {table} SET " + ", ".join(
+            f"{c} = CASE WHEN typeof({c}) = 'text' THEN COALESCE(CAST(strftime('%s', {c}) AS INTEGER), 0) ELSE {c} END"
+            for c in columns))
+    # Indexes were dropped with the tables
+    _create_indexes(db)
+
+
+# Schema upgrades, applied in order. 'PRAGMA user_version' of database file is the amount of applied ones.
+MIGRATIONS = [
+    _create_indexes,
+    _create_version_tags,
+    _epoch_timestamps,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+class RetentionReport(NamedTuple):
+    """Rows deleted by retention rules, and bytes released from the database file"""
+    upstream_versions: int
+    remote_versions: int
+    tag_changes: int
+    reclaimed_bytes: int
 
 # c_checker_extra = f'''CREATE TABLE if not exists {TABLE_CHECKER}(
 #     id INTEGER PRIMARY KEY,
@@ -83,8 +235,17 @@ c_version_data = f'''CREATE TABLE if not exists {TABLE_VERSION_DATA}(
 
 
 class ToolDatabase:
-    def __init__(self, config: Configuration):
+    def __init__(self, config: Configuration, read_only: bool = False):
         self.logger = logging.getLogger("database")
+        self.config = config
+        if read_only:
+            # Connection of ConnectionPool: schema is checked by the pool, and the pool closes it from another thread
+            self.db_conn = sqlite3.connect(f"file:{config.tool_db}?mode=rw", uri=True, check_same_thread=False)
+            self.db_conn.row_factory = sqlite3.Row
+            self.cursor = self.db_conn.cursor()
+            self.configure()
+            self.execute("PRAGMA query_only = ON")
+            return
         try:
             self.db_conn = sqlite3.connect(f"file:{config.tool_db}?mode=rw", uri=True, check_same_thread=True)
             self.db_conn.row_factory = sqlite3.Row
@@ -94,16 +255,23 @@ class ToolDatabase:
             self.db_conn = sqlite3.connect(str(config.tool_db), check_same_thread=True)
             self.db_conn.row_factory = sqlite3.Row
             self.cursor = self.db_conn.cursor()
-            self.configure()
-            self.create_tables_if_not_exist()
+            # Free pages are released by retention, must be set before tables are created
+            self.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        self.configure()
         self.create_custom_functions()
         self.create_tables_if_not_exist()
+        self.migrate()
 
     def __del__(self):
+        self.close()
+
+    def close(self):
         if self.cursor:
             self.cursor.close()
+            self.cursor = None
         if self.db_conn:
             self.db_conn.close()
+            self.db_conn = None
 
     def execute(self, command: str, params: Any = None):
         """Wrapper for cursor execute"""
@@ -122,16 +290,100 @@ class ToolDatabase:
             self.cursor.execute(command, params)
 
     def configure(self):
-        # Enable Foreign Keys
-        self.execute("PRAGMA foreign_keys = ON")
-        # Enable multi-read mode
-        self.execute("PRAGMA journal_mode = wal")
+        """Apply connection profile of the configuration, settings are not persistent except journal mode"""
+        profile = {
+            # Enable Foreign Keys
+            "foreign_keys": "ON",
+            # Enable multi-read mode
+            "journal_mode": self.config.db_journal_mode,
+            # Commits are durable from next checkpoint on in WAL mode, database is not corrupted on power loss
+            "synchronous": self.config.db_synchronous,
+            "mmap_size": self.config.db_mmap_size,
+            "cache_size": self.config.db_cache_size,
+            "temp_store": self.config.db_temp_store,
+            "busy_timeout": self.config.db_busy_timeout,
+        }
+        for pragma, value in profile.items():
+            # Values are from configuration file, only plain words and integers are accepted
+            if not re.fullmatch(r"-?\w+", str(value)):
+                self.logger.error(f"Invalid value '{value}' for database setting '{pragma}', using default.")
+                continue
+            self.execute(f"PRAGMA {pragma} = {value}")
 
     def create_tables_if_not_exist(self):
         """Generate all database tables"""
         self.cursor.execute(c_tool)
         self.cursor.execute(c_metadata)
         self.cursor.execute(c_version_data)
+        self.cursor.execute(c_tag_digests)
+        self.cursor.execute(c_validators)
+        self.cursor.execute(c_tag_changes)
+        self.cursor.execute(c_tag_platforms)
+
+    def schema_version(self) -> int:
+        self.execute("PRAGMA user_version")
+        return self.cursor.fetchone()[0]
+
+    def migrate(self):
+        """Upgrade schema of the database file into SCHEMA_VERSION, each step in own transaction"""
+        version = self.schema_version()
+        if version > SCHEMA_VERSION:
+            self.logger.warning(f"Database schema version {version} is newer than supported {SCHEMA_VERSION}.")
+            return
+        if version == SCHEMA_VERSION:
+            return
+        # Some upgrades rebuild tables, dropping them must not cascade. Not changeable inside transaction.
+        self.execute("PRAGMA foreign_keys")
+        foreign_keys = self.cursor.fetchone()[0]
+        self.execute("PRAGMA foreign_keys = OFF")
+        try:
+            for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+                with self.transaction():
+                    migration(self)
+                    self.execute(f"PRAGMA user_version = {number}")
+                self.logger.debug(f"Database schema upgraded into version {number}.")
+        finally:
+            self.execute(f"PRAGMA foreign_keys = {foreign_keys}")
+
+    def explain_queries(self) -> Dict[str, List[str]]:
+        """
+        Query plans (EXPLAIN QUERY PLAN) of the hot queries by description. Statements are captured
+        from the query methods, called with placeholder arguments.
+        """
+        checker = classmap["github"]({"uri": "uri", "repository": "repository", "tool": "tool", "provider": "github"})
+        tools_query = f"SELECT name FROM {TABLE_TOOLS} WHERE {TABLE_TOOLS}.location = ?"
+        calls = {
+            "get_tools": lambda: self.get_tools("registry", [VersionType.REMOTE]),
+            "get_tools (tag)": lambda: self.get_tools("registry", [VersionType.REMOTE], tag="latest"),
+            "get_tools (versions)": lambda: self.get_versions_by_tools(tools_query, ("registry",),
+                                                                       [VersionType.REMOTE]),
+            "get_tools (meta information)": lambda: self._load_meta_information(
+                [{"source": "github"}], tools_query, ("registry",)),
+            "get_single_tool": lambda: self.get_single_tool("tool", "registry"),
+            "get_versions_by_tool": lambda: self.get_versions_by_tool("tool", [VersionType.REMOTE]),
+            "get_versions_by_tool (latest by provider)": lambda: self.get_versions_by_tool(
+                "tool", [VersionType.UPSTREAM], provider="github", latest=True, max_age=datetime.timedelta(hours=1)),
+            "get_meta_id": lambda: self.get_meta_id("tool", checker),
+            "get_meta_ids": lambda: self.get_meta_ids(["tool", "other"]),
+            "get_meta_information (provider)": lambda: self.get_meta_information("tool", "github"),
+            "get_meta_information (meta_id)": lambda: self.get_meta_information("tool", "github", "1"),
+            "get_tools_with_tag": lambda: self.get_tools_with_tag("latest", "registry", [VersionType.REMOTE]),
+            "get_version_by_tag": lambda: self.get_version_by_tag("tool", "latest", "registry", [VersionType.REMOTE]),
+            "get_tag_digests": lambda: self.get_tag_digests("tool", "registry"),
+            "get_tag_changes": lambda: self.get_tag_changes("tool", "registry"),
+        }
+        plans = {}
+        for description, call in calls.items():
+            statements = []
+            self.db_conn.set_trace_callback(statements.append)
+            try:
+                call()
+            finally:
+                self.db_conn.set_trace_callback(None)
+            for i, statement in enumerate(s for s in statements if s.lstrip().upper().startswith("SELECT")):
+                self.cursor.execute(f"EXPLAIN QUERY PLAN {statement}")
+                plans[description + (f" #{i + 1}" if i else "")] = [row["detail"] for row in self.cursor.fetchall()]
+        return plans
 
     def create_custom_functions(self):
         """Create functions e.g. date time conversion"""
@@ -139,45 +391,76 @@ class ToolDatabase:
         pass
 
     def insert_meta_info(self, tool_name: str, tool_location: str, meta_data: dict):
-        v_time = format_time(datetime.datetime.now())
+        """
+        Insert or update meta data of checker with upsert. Existing row keeps its meta_id,
+        replacing it would delete the versions referring to it by foreign key.
+        """
+        v_time = epoch_time(datetime.datetime.now())
         s_insert_meta = f"INSERT INTO {TABLE_METADATA}(tool_id, tool_location, uri, repository, tool, provider, " \
-                        f"suite, method, origin, docker_origin , updated) VALUES (?,?,?,?,?,?,?,?,?,?,?)"
+                        f"suite, method, origin, docker_origin , updated) VALUES (?,?,?,?,?,?,?,?,?,?,?) " \
+                        f"ON CONFLICT(uri, repository, tool, provider) DO UPDATE SET " \
+                        f"tool_id=excluded.tool_id, " \
+                        f"tool_location=excluded.tool_location, " \
+                        f"suite=excluded.suite, " \
+                        f"method=excluded.method, " \
+                        f"origin=excluded.origin, " \
+                        f"docker_origin=excluded.docker_origin, " \
+                        f"updated=excluded.updated"
         params = [tool_name, tool_location, meta_data.get("uri"), meta_data.get("repository"), meta_data.get("tool"),
                   meta_data.get("provider"), meta_data.get("suite"), meta_data.get("method"), meta_data.get("origin"),
                   meta_data.get("docker_origin"), v_time]
         # Lastrowid could be used on following VersionInfo insert to set
         self.execute(s_insert_meta, tuple(params))
 
-    def insert_version_info(self, tool: ToolInfo, version_info: Union[VersionInfo, List[VersionInfo]]):
-        """Insert list or single version info of specific tool, referenced by name"""
+    def insert_version_info(self, tool: ToolInfo, version_info: Union[VersionInfo, List[VersionInfo]],
+                            meta_ids: Dict[Tuple, int] = None):
+        """
+        Insert list or single version info of specific tool, referenced by name.
+        Meta ids of upstream versions are resolved from 'meta_ids' (see get_meta_ids), queried once if not given.
+        """
         if not version_info:
             self.logger.debug("Empty version list provided...nothing to add.")
             return
-        v_time = format_time(datetime.datetime.now())
+        if meta_ids is None:
+            versions = [version_info] if isinstance(version_info, VersionInfo) else version_info
+            meta_ids = self.get_meta_ids([tool.name]) if isinstance(versions, List) and any(
+                isinstance(i.source, UpstreamChecker) for i in versions) else {}
+        v_time = epoch_time(datetime.datetime.now())
         s_command = f"INSERT INTO {TABLE_VERSION_DATA}(tool_id, tool_location, meta_id, version, version_type, source, " \
                     f"tags, updated, origin, size, created) VALUES (?,?,?,?,?,?,?,?,?,?,?)"
         if isinstance(version_info, VersionInfo):
             # Insert raw size, meta_id by checking existing upstream checkers, created time last param
-            if isinstance(version_info.source, UpstreamChecker):
-                meta_id = self.get_meta_id(tool.name, version_info.source)
-            else:
-                meta_id = None
-            u_time = format_time(version_info.updated) if version_info.updated else v_time
+            meta_id = self._resolve_meta_id(meta_ids, tool.name, version_info.source)
+            u_time = epoch_time(version_info.updated) if version_info.updated else v_time
             self.execute(s_command,
                          (tool.name, tool.location, meta_id, version_info.version, version_info.version_type.value,
                           str(version_info.source),
                           ",".join(list(version_info.tags)), u_time, version_info.origin, version_info.raw_size(),
                           v_time))
+            self._insert_version_tags(tool.name, [version_info])
         elif isinstance(version_info, List):
             self.logger.debug("Running executemany for insert, NOT logged precisely...")
             # Insert raw size, meta_id by checking existing upstream checkers
-            version_list = [(tool.name, tool.location, str(i.source) if str(i.source) in classmap else None, i.version,
+            version_list = [(tool.name, tool.location,
+                             self._resolve_meta_id(meta_ids, tool.name, i.source),
+                             i.version,
                              i.version_type.value, str(i.source),
-                             ",".join(list(i.tags)), format_time(i.updated) if i.updated else v_time, i.origin,
+                             ",".join(list(i.tags)), epoch_time(i.updated) if i.updated else v_time, i.origin,
                              i.raw_size(), v_time)
                             for
                             i in version_info]
             self.cursor.executemany(s_command, version_list)
+            self._insert_version_tags(tool.name, version_info)
+
+    def _insert_version_tags(self, tool_name: str, versions: List[VersionInfo]):
+        """
+        Insert tags of inserted versions, version rows are found by their unique columns.
+        Tags of replaced and deleted versions are deleted by foreign key.
+        """
+        s_command = f"INSERT INTO {TABLE_VERSION_TAGS}(version_id, tag) SELECT id, ? FROM {TABLE_VERSION_DATA} " \
+                    f"WHERE id IN ({s_version_id})"
+        self.cursor.executemany(s_command, [(tag, tool_name, i.version, i.version_type.value, str(i.source))
+                                            for i in versions for tag in i.tags if tag])
 
     def insert_tool_info(self, tool_info: Union[ToolInfo, List[ToolInfo]]):
         """Insert ToolInfo object or list of objects with upsert into Database"""
@@ -189,18 +472,194 @@ class ToolDatabase:
                     f"WHERE excluded.updated > {TABLE_TOOLS}.updated"
         if isinstance(tool_info, ToolInfo):
             self.execute(s_command, (tool_info.name,
-                                     format_time(tool_info.updated), tool_info.location,
+                                     epoch_time(tool_info.updated), tool_info.location,
                                      tool_info.description))
             # Local, remote or upstream versions
             self.insert_version_info(tool_info, tool_info.versions)
         else:
             self.logger.debug("Running executemany for insert, NOT logged precisely...")
-            tool_list = [(i.name, format_time(i.updated), i.location, i.description) for i in tool_info]
+            tool_list = [(i.name, epoch_time(i.updated), i.location, i.description) for i in tool_info]
             self.cursor.executemany(s_command, tool_list)
+            # Meta ids of upstream versions of all tools at once
+            meta_ids = self.get_meta_ids([t.name for t in tool_info
+                                          if any(isinstance(v.source, UpstreamChecker) for v in t.versions)])
             # All versions from all tools
             # Local, remote or upstream versions
             for t in tool_info:
-                self.insert_version_info(t, t.versions)
+                self.insert_version_info(t, t.versions, meta_ids)
+
+    def insert_tag_digests(self, tool_name: str, tool_location: str, digests: Dict[str, str]):
+        """Insert or replace manifest digests of tags for tool"""
+        if not digests:
+            return
+        v_time = epoch_time(datetime.datetime.now())
+        s_command = f"INSERT INTO {TABLE_TAG_DIGESTS}(tool_id, tool_location, tag, digest, updated) " \
+                    f"VALUES (?,?,?,?,?)"
+        self.cursor.executemany(s_command, [(tool_name, tool_location, tag, digest, v_time)
+                                            for tag, digest in digests.items()])
+
+    def delete_tag_digests(self, tool_name: str, tool_location: str, tags: List[str]):
+        """Delete manifest digests of removed tags"""
+        s_command = f"DELETE FROM {TABLE_TAG_DIGESTS} WHERE tool_id = ? AND tool_location = ? AND tag = ?"
+        self.cursor.executemany(s_command, [(tool_name, tool_location, t) for t in tags])
+
+    def insert_tag_changes(self, tool_name: str, tool_location: str, changes: List[Tuple[str, str, str]]):
+        """Record changed tags of tool, as list of tag, change and new digest"""
+        if not changes:
+            return
+        v_time = epoch_time(datetime.datetime.now())
+        s_command = f"INSERT INTO {TABLE_TAG_CHANGES}(tool_id, tool_location, tag, change, digest, changed) " \
+                    f"VALUES (?,?,?,?,?,?)"
+        self.cursor.executemany(s_command, [(tool_name, tool_location, tag, change, digest, v_time)
+                                            for tag, change, digest in changes])
+
+    def get_tag_changes(self, tool_name: str, tool_location: str) -> List[Tuple[str, str, str, datetime.datetime]]:
+        """Get recorded tag changes of tool, oldest first, as tag, change, digest and time of change"""
+        s_command = f"SELECT tag, change, digest, changed FROM {TABLE_TAG_CHANGES} " \
+                    f"WHERE tool_id = ? AND tool_location = ? ORDER BY id"
+        self.execute(s_command, (tool_name, tool_location))
+        return [(row["tag"], row["change"], row["digest"], parse_epoch_time(row["changed"]))
+                for row in self.cursor.fetchall()]
+
+    def insert_tag_platforms(self, tool_name: str, tool_location: str,
+                             platforms: Dict[str, List[Tuple[str, str, str, datetime.datetime, int]]]):
+        """
+        Replace platform images of tags, given by tag as list of platform, digest, version, updated and size
+        """
+        if not platforms:
+            return
+        self.delete_tag_platforms(tool_name, tool_location, list(platforms.keys()))
+        s_command = f"INSERT INTO {TABLE_TAG_PLATFORMS}(tool_id, tool_location, tag, platform, digest, version, " \
+                    f"updated, size) VALUES (?,?,?,?,?,?,?,?)"
+        self.cursor.executemany(s_command, [(tool_name, tool_location, tag, platform, digest, version,
+                                             epoch_time(updated), size)
+                                            for tag, images in platforms.items()
+                                            for platform, digest, version, updated, size in images])
+
+    def delete_tag_platforms(self, tool_name: str, tool_location: str, tags: List[str]):
+        """Delete platform images of tags"""
+        s_command = f"DELETE FROM {TABLE_TAG_PLATFORMS} WHERE tool_id = ? AND tool_location = ? AND tag = ?"
+        self.cursor.executemany(s_command, [(tool_name, tool_location, t) for t in tags])
+
+    def get_tag_platforms(self, tool_name: str, tool_location: str) -> Dict[str, List[Dict]]:
+        """Get platform images of remote tags of tool, by tag"""
+        s_command = f"SELECT tag, platform, digest, version, updated, size FROM {TABLE_TAG_PLATFORMS} " \
+                    f"WHERE tool_id = ? AND tool_location = ? ORDER BY tag, platform"
+        self.execute(s_command, (tool_name, tool_location))
+        platforms = {}
+        for row in self.cursor.fetchall():
+            platforms.setdefault(row["tag"], []).append({
+                "platform": row["platform"],
+                "digest": row["digest"],
+                "version": row["version"],
+                "updated": parse_epoch_time(row["updated"]),
+                "size": row["size"],
+            })
+        return platforms
+
+    def delete_remote_versions(self, tool_name: str, tool_location: str, keep: List[str]):
+        """Delete remote versions of tool, which are not in the list of versions to keep"""
+        s_command = f"DELETE FROM {TABLE_VERSION_DATA} WHERE tool_id = ? AND tool_location = ? " \
+                    f"AND version_type = ? AND version NOT IN ({','.join('?' * len(keep))})"
+        self.execute(s_command, (tool_name, tool_location, VersionType.REMOTE.value, *keep))
+
+    def delete_old_upstream_versions(self, keep: int) -> int:
+        """Delete upstream versions of each tool and provider, except 'keep' newest ones. Returns amount."""
+        # Newer versions of the same tool and provider are counted, window functions need SQLite 3.25
+        s_newer = f"SELECT COUNT(*) FROM {TABLE_VERSION_DATA} n WHERE n.tool_id = v.tool_id " \
+                  f"AND n.tool_location = v.tool_location AND n.source = v.source " \
+                  f"AND n.version_type = v.version_type " \
+                  f"AND (n.updated > v.updated OR (n.updated = v.updated AND n.id > v.id))"
+        s_command = f"DELETE FROM {TABLE_VERSION_DATA} WHERE id IN (" \
+                    f"SELECT v.id FROM {TABLE_VERSION_DATA} v WHERE v.version_type = ? AND ({s_newer}) >= ?)"
+        self.execute(s_command, (VersionType.UPSTREAM.value, keep))
+        return self.cursor.rowcount
+
+    def delete_removed_remote_versions(self, days: int) -> int:
+        """
+        Delete remote versions without live tag, when their tags were removed more than 'days' ago.
+        Only tools with reconciled tags are handled, versions without recorded removal are aged by
+        the time they were stored. Returns amount.
+        """
+        before = epoch_time(datetime.datetime.now() - datetime.timedelta(days=days))
+        # Tags of version 'v' which are live, and latest removal of its tags ('removed' change of tag_changes)
+        s_live = f"SELECT 1 FROM {TABLE_VERSION_TAGS} t JOIN {TABLE_TAG_DIGESTS} d ON d.tag = t.tag " \
+                 f"AND d.tool_id = v.tool_id AND d.tool_location = v.tool_location WHERE t.version_id = v.id"
+        s_removed = f"SELECT max(c.changed) FROM {TABLE_VERSION_TAGS} t JOIN {TABLE_TAG_CHANGES} c ON c.tag = t.tag " \
+                    f"AND c.tool_id = v.tool_id AND c.tool_location = v.tool_location " \
+                    f"WHERE t.version_id = v.id AND c.change = 'removed'"
+        s_command = f"DELETE FROM {TABLE_VERSION_DATA} WHERE id IN (" \
+                    f"SELECT v.id FROM {TABLE_VERSION_DATA} v WHERE v.version_type = ? " \
+                    f"AND EXISTS (SELECT 1 FROM {TABLE_TAG_DIGESTS} d " \
+                    f"WHERE d.tool_id = v.tool_id AND d.tool_location = v.tool_location) " \
+                    f"AND NOT EXISTS ({s_live}) AND COALESCE(({s_removed}), v.created) < ?)"
+        self.execute(s_command, (VersionType.REMOTE.value, before))
+        return self.cursor.rowcount
+
+    def delete_old_tag_changes(self, days: int) -> int:
+        """Delete tag changes older than 'days'. Returns amount."""
+        before = epoch_time(datetime.datetime.now() - datetime.timedelta(days=days))
+        self.execute(f"DELETE FROM {TABLE_TAG_CHANGES} WHERE changed < ?", (before,))
+        return self.cursor.rowcount
+
+    def _file_size(self) -> int:
+        self.execute("PRAGMA page_count")
+        pages = self.cursor.fetchone()[0]
+        self.execute("PRAGMA page_size")
+        return pages * self.cursor.fetchone()[0]
+
+    def compact(self, pages: int = 0) -> int:
+        """
+        Release up to 'pages' free pages (all with 0) from the database file, returns released bytes.
+        File made without incremental auto vacuum is converted with full VACUUM once.
+        Must not be called inside transaction.
+        """
+        size = self._file_size()
+        self.execute("PRAGMA auto_vacuum")
+        if self.cursor.fetchone()[0] != 2:
+            self.logger.info("Converting database into incremental auto vacuum, running full VACUUM...")
+            self.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            self.execute("VACUUM")
+        else:
+            # Single step of the statement releases single page, script is run until done
+            self.db_conn.executescript(f"PRAGMA incremental_vacuum({int(pages)})")
+        # Released pages leave the file on checkpoint
+        self.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return size - self._file_size()
+
+    def apply_retention(self) -> RetentionReport:
+        """Delete history by retention rules of the configuration, and compact the database file"""
+        with self.transaction():
+            report = RetentionReport(
+                self.delete_old_upstream_versions(self.config.retention_upstream_versions),
+                self.delete_removed_remote_versions(self.config.retention_removed_tag_days),
+                self.delete_old_tag_changes(self.config.retention_tag_changes_days),
+                0,
+            )
+        report = report._replace(reclaimed_bytes=self.compact(self.config.retention_vacuum_pages))
+        self.logger.info(f"Retention deleted {report.upstream_versions} upstream versions, {report.remote_versions} "
+                         f"remote versions and {report.tag_changes} tag changes, "
+                         f"{report.reclaimed_bytes} bytes reclaimed.")
+        return report
+
+    def get_tag_digests(self, tool_name: str, tool_location: str) -> Dict[str, str]:
+        """Get stored manifest digests of tags for tool, as tag: digest"""
+        s_command = f"SELECT tag, digest FROM {TABLE_TAG_DIGESTS} WHERE tool_id = ? AND tool_location = ?"
+        self.execute(s_command, (tool_name, tool_location))
+        return {row["tag"]: row["digest"] for row in self.cursor.fetchall()}
+
+    def insert_validators(self, endpoint: str, location: str, etag: str, last_modified: str):
+        """Insert or replace cache validators of the endpoint"""
+        s_command = f"INSERT INTO {TABLE_VALIDATORS}(endpoint, location, etag, last_modified, updated) " \
+                    f"VALUES (?,?,?,?,?)"
+        self.execute(s_command, (endpoint, location, etag, last_modified, epoch_time(datetime.datetime.now())))
+
+    def get_validators(self, endpoint: str, location: str) -> Union[Tuple[str, str], None]:
+        """Get stored ETag and Last-Modified of the endpoint"""
+        s_command = f"SELECT etag, last_modified FROM {TABLE_VALIDATORS} WHERE endpoint = ? AND location = ?"
+        self.execute(s_command, (endpoint, location))
+        row = self.cursor.fetchone()
+        return (row["etag"], row["last_modified"]) if row else None
 
     def get_meta_id(self, tool_name: str, checker: UpstreamChecker) -> int:
         """Get meta id for matching Checker configuration, based on Unique constraint"""
@@ -222,6 +681,34 @@ class ToolDatabase:
             else:
                 return None
 
+    def get_meta_ids(self, tool_names: List[str]) -> Dict[Tuple, int]:
+        """
+        Meta ids of all checker configurations of the tools, for resolving meta ids of many versions at once.
+        Keyed by tool and unique columns of configuration, and by tool, tool and provider for the less
+        accurate match of get_meta_id.
+        """
+        meta_ids = {}
+        names = list(dict.fromkeys(tool_names))
+        for i in range(0, len(names), MAX_QUERY_PARAMS):
+            chunk = names[i:i + MAX_QUERY_PARAMS]
+            s_command = f"SELECT meta_id, tool_id, uri, repository, tool, provider FROM {TABLE_METADATA} " \
+                        f"WHERE tool_id IN ({','.join('?' * len(chunk))}) " \
+                        f"ORDER BY tool_id, tool, provider, uri, repository"
+            self.execute(s_command, tuple(chunk))
+            for row in self.cursor.fetchall():
+                meta_ids[(row["tool_id"], row["uri"], row["repository"], row["tool"], row["provider"])] = \
+                    row["meta_id"]
+                meta_ids.setdefault((row["tool_id"], row["tool"], row["provider"]), row["meta_id"])
+        return meta_ids
+
+    @staticmethod
+    def _resolve_meta_id(meta_ids: Dict[Tuple, int], tool_name: str, source: Any) -> Union[int, None]:
+        """Meta id of version source from get_meta_ids, None if source is not upstream checker"""
+        if not isinstance(source, UpstreamChecker):
+            return None
+        meta_id = meta_ids.get((tool_name, source.uri, source.repository, source.tool, source.provider))
+        return meta_id if meta_id is not None else meta_ids.get((tool_name, source.tool, source.provider))
+
     def get_single_tool(self, tool_name: str, remote_name: str = "", filter_by: [VersionType] = None) -> Union[
         ToolInfo, None]:
         """Get tool by name, filter by included versions"""
@@ -233,25 +720,93 @@ class ToolDatabase:
             params.append(remote_name)
         self.execute(command, tuple(params))
         t = self.cursor.fetchone()
-        return self.row_into_tool_info_obj(t, filter_by) if t else None
+        if not t:
+            return None
+        versions = self.get_versions_by_tools("SELECT ?", (tool_name,), filter_by)
+        return self.row_into_tool_info_obj(t, filter_by, versions=versions.get(tool_name, []))
 
-    def get_tools(self, remote_name: str = "", filter_by: [VersionType] = None, by_time: datetime.datetime = None) -> List[ToolInfo]:
-        """Get tools, filter by remote name or updated time
-        TODO implement time filter
+    def get_tools(self, remote_name: str = "", filter_by: [VersionType] = None, by_time: datetime.datetime = None,
+                  tag: str = "") -> List[ToolInfo]:
+        """Get tools, filter by remote name, tag of versions or updated time (tools updated at or after 'by_time')
         Only remote tool information is stored into database
+        Tools, their versions and meta information are loaded with three queries in total.
+        With tag, only tools having version (of 'filter_by' types) with the tag are included.
         """
-        command = f"SELECT name, updated, location, description from {TABLE_TOOLS}"
+        conditions = []
         params = []
         if remote_name:
-            command += f" WHERE {TABLE_TOOLS}.location = ?"
+            conditions.append(f"{TABLE_TOOLS}.location = ?")
             params.append(remote_name)
-        self.execute(command, tuple(params))
+        if tag:
+            s_with_tag, tag_params = self._tools_with_tag_query(tag, remote_name, filter_by)
+            conditions.append(f"{TABLE_TOOLS}.name IN ({s_with_tag})")
+            params.extend(tag_params)
+        if by_time:
+            conditions.append(f"{TABLE_TOOLS}.updated >= ?")
+            params.append(epoch_time(by_time))
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        self.execute(f"SELECT name, updated, location, description from {TABLE_TOOLS}{where}", tuple(params))
         rows = self.cursor.fetchall()
-        return [self.row_into_tool_info_obj(i, filter_by=filter_by) for i in rows]
+        if not rows:
+            return []
+        versions = self.get_versions_by_tools(f"SELECT name FROM {TABLE_TOOLS}{where}", tuple(params), filter_by)
+        return [self.row_into_tool_info_obj(i, filter_by=filter_by, versions=versions.get(i["name"], []))
+                for i in rows]
+
+    def _tools_with_tag_query(self, tag: str, remote_name: str = "", version_type: [VersionType] = None,
+                              columns: str = "v.tool_id") -> Tuple[str, Tuple]:
+        """Query and parameters for versions 'v' with the tag, selecting names of their tools by default"""
+        s_command = f"SELECT {columns} FROM {TABLE_VERSION_TAGS} t JOIN {TABLE_VERSION_DATA} v " \
+                    f"ON v.id = t.version_id WHERE t.tag = ?"
+        params = [tag]
+        if remote_name:
+            s_command += " AND v.tool_location = ?"
+            params.append(remote_name)
+        if version_type:
+            s_command += f" AND v.version_type IN ({','.join('?' * len(version_type))})"
+            params.extend(v_t.value for v_t in version_type)
+        return s_command, tuple(params)
+
+    def get_tools_with_tag(self, tag: str, remote_name: str = "", version_type: [VersionType] = None) -> List[str]:
+        """Get names of tools having version with the tag, filter by remote name and version types"""
+        s_command, params = self._tools_with_tag_query(tag, remote_name, version_type, "DISTINCT v.tool_id")
+        self.execute(s_command, params)
+        return [row["tool_id"] for row in self.cursor.fetchall()]
+
+    def get_version_by_tag(self, tool_name: str, tag: str, remote_name: str = "",
+                           version_type: [VersionType] = None) -> Union[VersionInfo, None]:
+        """Get latest version of tool with the tag, filter by remote name and version types"""
+        s_command, params = self._tools_with_tag_query(tag, remote_name, version_type, "v.*")
+        self.execute(f"{s_command} AND v.tool_id = ? ORDER BY v.updated DESC LIMIT 1", params + (tool_name,))
+        row = self.cursor.fetchone()
+        if not row:
+            return None
+        return self.row_into_version_info_obj(row)
+
+    def get_versions_by_tools(self, tools_query: str, params: Tuple, version_type: [VersionType] = None
+                              ) -> Dict[str, List[VersionInfo]]:
+        """
+        Get versions of all tools selected by subquery returning tool names, by tool name.
+        Meta information of upstream versions is loaded with single additional query.
+        """
+        s_get_versions = f"SELECT * FROM {TABLE_VERSION_DATA} WHERE tool_id IN ({tools_query})"
+        version_params = list(params)
+        if version_type:
+            s_get_versions += f" AND version_type IN ({','.join('?' * len(version_type))})"
+            version_params.extend(v_t.value for v_t in version_type)
+        self.execute(s_get_versions, tuple(version_params))
+        rows = self.cursor.fetchall()
+        metadata = self._load_meta_information(rows, tools_query, params)
+        versions = {}
+        for r in rows:
+            versions.setdefault(r["tool_id"], []).append(self.row_into_version_info_obj(r, metadata))
+        return versions
 
     def get_versions_by_tool(self, tool_name: str, version_type: [VersionType] = None, provider: str = "",
-                             latest: bool = False) -> Union[List[VersionInfo], VersionInfo]:
+                             latest: bool = False, max_age: datetime.timedelta = None
+                             ) -> Union[List[VersionInfo], VersionInfo]:
         """Get all versions by tool name, by version_type, provider if set
+        and only versions updated within max_age from now, if set
         return single VersionInfo object if latest set
         """
         s_get_versions = f"SELECT * FROM {TABLE_VERSION_DATA} WHERE tool_id = ?"
@@ -273,6 +828,10 @@ class ToolDatabase:
         if provider:
             s_get_versions += f" AND source = ?"
             params.append(provider)
+        if max_age is not None:
+            now = datetime.datetime.now()
+            s_get_versions += " AND updated BETWEEN ? AND ?"
+            params.extend((epoch_time(now - max_age), epoch_time(now)))
         if latest:
             s_get_versions += f" ORDER BY updated DESC LIMIT 1"
 
@@ -286,7 +845,8 @@ class ToolDatabase:
         if not rows:
             self.logger.debug(f"No versions found for tool {tool_name} by type {version_type} and provider {provider}")
             return []
-        return [self.row_into_version_info_obj(r) for r in rows]
+        metadata = self._load_meta_information(rows, "SELECT ?", (tool_name,))
+        return [self.row_into_version_info_obj(r, metadata) for r in rows]
 
     def get_meta_information(self, tool_name: str, provider: str = "", meta_id: str = "") -> List[Dict]:
         params = [tool_name]
@@ -312,8 +872,34 @@ class ToolDatabase:
         else:
             return []
 
-    def row_into_version_info_obj(self, row: sqlite3.Row) -> VersionInfo:
-        """Convert Row object into VersionInfo object"""
+    def _load_meta_information(self, version_rows: List[sqlite3.Row], tools_query: str, params: Tuple
+                               ) -> Dict[str, List[Dict]]:
+        """Meta information of tools selected by subquery, by tool name, if some of the versions are upstream"""
+        metadata = {}
+        if any(r["source"] and r["source"].lower() in classmap.keys() for r in version_rows):
+            self.execute(f"SELECT * FROM {TABLE_METADATA} WHERE tool_id IN ({tools_query})", tuple(params))
+            for m in self.cursor.fetchall():
+                metadata.setdefault(m["tool_id"], []).append(dict(m))
+            # Oldest first as when queried by tool, without sorting in SQL
+            for rows in metadata.values():
+                rows.sort(key=lambda r: r["meta_id"])
+        return metadata
+
+    def _select_meta_information(self, rows: List[Dict], tool_name: str, provider: str, meta_id: str) -> List[Dict]:
+        """Select meta information from already loaded rows of the tool, as get_meta_information() would"""
+        if meta_id:
+            return [r for r in rows if str(r["meta_id"]) == str(meta_id)]
+        selected = [r for r in rows if r["provider"].lower() == provider.lower()]
+        if len(selected) > 1:
+            self.logger.error(
+                f"Possible duplicates for meta data for tool {tool_name} with provider {provider}. Report bug.")
+        return selected
+
+    def row_into_version_info_obj(self, row: sqlite3.Row, metadata: Dict[str, List[Dict]] = None) -> VersionInfo:
+        """
+        Convert Row object into VersionInfo object. Meta information is queried, unless
+        preloaded meta information rows are given by tool name.
+        """
         try:
             # DB has raw size by default, could be integers instead of strings
             size = int(row["size"])
@@ -323,7 +909,11 @@ class ToolDatabase:
         origin = bool(row["origin"])
         if row["source"] and (row["source"].lower() in classmap.keys()):
             # If meta_id exist, query prioritizes it.
-            upstream_info = self.get_meta_information(row["tool_id"], row["source"], row["meta_id"])
+            if metadata is not None:
+                upstream_info = self._select_meta_information(metadata.get(row["tool_id"], []), row["tool_id"],
+                                                              row["source"], row["meta_id"])
+            else:
+                upstream_info = self.get_meta_information(row["tool_id"], row["source"], row["meta_id"])
             if upstream_info:
                 dummy_checker = classmap.get(row["source"].lower())(
                     upstream_info[0],
@@ -337,16 +927,22 @@ class ToolDatabase:
             dummy_checker = None
         return VersionInfo(version=row["version"], version_type=row["version_type"],
                            source=dummy_checker or row["source"],
-                           tags=set(row["tags"].split(',')), updated=parse_file_time(row["updated"]),
+                           tags=set(row["tags"].split(',')), updated=parse_epoch_time(row["updated"]),
                            origin=origin, size=size)
 
-    def row_into_tool_info_obj(self, row: sqlite3.Row, filter_by: [VersionType] = None) -> ToolInfo:
-        """Convert Row object into ToolInfo object. Get related versions which can be filtered by VersionType"""
+    def row_into_tool_info_obj(self, row: sqlite3.Row, filter_by: [VersionType] = None,
+                               versions: List[VersionInfo] = None) -> ToolInfo:
+        """
+        Convert Row object into ToolInfo object. Get related versions which can be filtered by VersionType,
+        unless already loaded versions are given.
+        """
         if len(row) < 4:
             raise ValueError(f"Row in {TABLE_TOOLS} table should have 4 values.")
         name, updated, location, description = row
-        return ToolInfo(name=name, updated=parse_file_time(updated), location=location, description=description,
-                        versions=self.get_versions_by_tool(name, version_type=filter_by))
+        if versions is None:
+            versions = self.get_versions_by_tool(name, version_type=filter_by)
+        return ToolInfo(name=name, updated=parse_epoch_time(updated), location=location, description=description,
+                        versions=versions)
 
     @contextmanager
     def transaction(self):
@@ -360,3 +956,177 @@ class ToolDatabase:
             raise
         else:
             self.db_conn.commit()
+
+
+class ConnectionPool:
+    """
+    Long-lived read-only connections into tool database for worker threads, one per thread. Schema of
+    the database file is checked once, by the first connection taken from the pool.
+    """
+
+    def __init__(self, config: Configuration):
+        self.config = config
+        self.connections: List[ToolDatabase] = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._schema_checked = False
+
+    def get(self) -> ToolDatabase:
+        """Connection of the calling thread, opened on first use"""
+        db = getattr(self._local, "db", None)
+        if db is None:
+            with self._lock:
+                if not self._schema_checked:
+                    # Creates missing file, tables and indexes
+                    ToolDatabase(self.config).close()
+                    self._schema_checked = True
+                db = ToolDatabase(self.config, read_only=True)
+                self.connections.append(db)
+            self._local.db = db
+        return db
+
+    def close(self):
+        """Close connections of all threads, threads must not use them anymore"""
+        with self._lock:
+            for db in self.connections:
+                db.close()
+            self.connections.clear()
+            self._local = threading.local()
+
+
+class DatabaseWriter:
+    """
+    Single thread writing into tool database with own connection, while others keep on fetching.
+    Writes are functions called with the connection, committed in batches: after 'db_write_batch' writes
+    or 'db_write_interval' seconds from the first write of the batch. Committed batches stay in the database
+    even if the process is interrupted later. Failed write is rolled back alone, the rest of the batch
+    is committed and the error is raised from flush(). At most two batches wait in the queue, producers
+    are blocked until the writer catches up. Coroutines use aput() and aflush() and 'async with', which
+    wait in the default executor instead of blocking the event loop.
+    """
+
+    _CLOSE = object()
+
+    def __init__(self, config: Configuration):
+        self.config = config
+        self.logger = logging.getLogger("database")
+        self.batch_size: int = max(1, config.db_write_batch)
+        self.interval: float = config.db_write_interval
+        self.commits: int = 0
+        self.writes: int = 0
+        self._queue: queue.Queue = queue.Queue(maxsize=2 * self.batch_size)
+        self._error: Union[Exception, None] = None
+        self._thread = threading.Thread(target=self._run, name="database-writer", daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            if exc_type is None:
+                self.flush()
+        finally:
+            self.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        try:
+            if exc_type is None:
+                await self.aflush()
+        finally:
+            await asyncio.get_event_loop().run_in_executor(None, self.close)
+
+    def put(self, write: Callable[[ToolDatabase], Any]):
+        """Queue write, function called with the database in the writer thread"""
+        if not self._thread.is_alive():
+            raise RuntimeError("Database writer is closed")
+        self._queue.put(write)
+
+    async def aput(self, write: Callable[[ToolDatabase], Any]):
+        """Queue write from coroutine, waits for free space in the executor when the queue is full"""
+        if not self._thread.is_alive():
+            raise RuntimeError("Database writer is closed")
+        try:
+            self._queue.put_nowait(write)
+        except queue.Full:
+            await asyncio.get_event_loop().run_in_executor(None, self.put, write)
+
+    def flush(self):
+        """Wait until all queued writes are committed. Raises the first failure since previous flush."""
+        if self._thread.is_alive():
+            done = threading.Event()
+            self._queue.put(done)
+            done.wait()
+        error, self._error = self._error, None
+        if error:
+            raise error
+
+    async def aflush(self):
+        """Wait in the executor until all queued writes are committed, see flush()"""
+        await asyncio.get_event_loop().run_in_executor(None, self.flush)
+
+    def close(self):
+        """Commit queued writes and stop the thread"""
+        if self._thread.is_alive():
+            self._queue.put(self._CLOSE)
+            self._thread.join()
+
+    def _failed(self, error: Exception):
+        self.logger.error(f"Failed to write into database: {error}")
+        if self._error is None:
+            self._error = error
+
+    def _run(self):
+        db = None
+        try:
+            db = ToolDatabase(self.config)
+        except sqlite3.Error as e:
+            # Queue is still drained, producers must not be blocked
+            self._failed(e)
+        closing = False
+        while not closing:
+            writes, events, closing = self._next_batch()
+            if writes and db:
+                self._commit(db, writes)
+            for e in events:
+                e.set()
+        if db:
+            db.close()
+
+    def _next_batch(self) -> Tuple[List[Callable], List[threading.Event], bool]:
+        """Writes until batch is full, interval has passed, flush is requested or writer is closed"""
+        writes, events = [], []
+        item = self._queue.get()
+        deadline = time.monotonic() + self.interval
+        while True:
+            if item is self._CLOSE:
+                return writes, events, True
+            if isinstance(item, threading.Event):
+                events.append(item)
+                return writes, events, False
+            writes.append(item)
+            if len(writes) >= self.batch_size:
+                return writes, events, False
+            try:
+                item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                return writes, events, False
+
+    def _commit(self, db: ToolDatabase, writes: List[Callable]):
+        try:
+            with db.transaction():
+                for write in writes:
+                    db.db_conn.execute("SAVEPOINT write")
+                    try:
+                        write(db)
+                    except Exception as e:
+                        db.db_conn.execute("ROLLBACK TO write")
+                        self._failed(e)
+                    db.db_conn.execute("RELEASE write")
+            self.commits += 1
+            self.writes += len(writes)
+        except sqlite3.Error as e:
+            self._failed(e)
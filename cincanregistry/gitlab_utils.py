@@ -1,5 +1,5 @@
 from urllib.parse import quote_plus, urlparse
-from typing import List
+from typing import List, Tuple, Union
 import requests
 import logging
 import gitlab
@@ -15,12 +15,14 @@ class GitLabUtils:
             namespace: str = "",
             project: str = "",
             token: str = "",
-            pool_maxsize: int = 100
+            pool_maxsize: int = 100,
+            session: requests.Session = None,
+            timeout: Union[float, Tuple[float, float]] = None,
     ):
         if url:
             url = f"https://{urlparse(url).netloc}/"
         self.base_url = url or "https://gitlab.com"
-        self.gl = gitlab.Gitlab(self.base_url, private_token=token)
+        self.gl = gitlab.Gitlab(self.base_url, private_token=token, session=session, timeout=timeout)
         adapter = requests.adapters.HTTPAdapter(pool_maxsize=pool_maxsize)
         self.gl.session.mount("https://", adapter)
         self.logger = logging.getLogger("gitlab-util")
@@ -0,0 +1,208 @@
+import logging
+import random
+import threading
+import time
+from typing import Dict, Tuple, Union
+from urllib.parse import urlparse
+
+import requests
+
+# Only these are retried, repeating them has no side effects
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS")
+# Server side failures which are likely transient
+RETRY_STATUSES = (500, 502, 503, 504)
+
+BREAKER_CLOSED = "closed"
+BREAKER_OPEN = "open"
+BREAKER_HALF_OPEN = "half-open"
+
+
+class CircuitOpenError(requests.ConnectionError):
+    """Request was not sent, host has failed repeatedly and its circuit breaker is open"""
+
+
+class CircuitBreaker:
+    """
+    Failure tracking of single host. After 'threshold' consecutive failures the breaker opens, and
+    requests fail fast without being sent. After 'reset_timeout' seconds single trial request is let
+    through (half-open); success closes the breaker, failure opens it again.
+    """
+
+    def __init__(self, threshold: int, reset_timeout: float):
+        self.threshold: int = threshold
+        self.reset_timeout: float = reset_timeout
+        self.state: str = BREAKER_CLOSED
+        self.failures: int = 0
+        # Times opened, for statistics
+        self.opened: int = 0
+        self._opened_at: float = 0.0
+        self._trial: bool = False
+
+    def allow(self) -> bool:
+        """Whether request can be sent now. Lock of the policy must be held."""
+        if self.state == BREAKER_CLOSED:
+            return True
+        if self.state == BREAKER_OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self.state = BREAKER_HALF_OPEN
+            self._trial = False
+        if self.state == BREAKER_HALF_OPEN and not self._trial:
+            self._trial = True
+            return True
+        return False
+
+    def abandon(self):
+        """Request ended without outcome from the host, trial can be sent again"""
+        self._trial = False
+
+    def success(self):
+        self.state = BREAKER_CLOSED
+        self.failures = 0
+
+    def failure(self):
+        self.failures += 1
+        if self.state == BREAKER_HALF_OPEN or (self.state == BREAKER_CLOSED and self.failures >= self.threshold):
+            self.state = BREAKER_OPEN
+            self.opened += 1
+            self._opened_at = time.monotonic()
+
+
+class HttpPolicy:
+    """
+    Timeouts, retries and circuit breakers shared by HTTP clients of remote registries and upstream checkers.
+
+    Idempotent requests failing on connection error, timeout or 5xx response are retried up to 'retries' times,
+    with exponential backoff and full jitter. Every host has own circuit breaker.
+    Thread-safe; checkers use it from worker threads, registry transport from the event loop.
+    """
+
+    def __init__(self, connect_timeout: float = 10, read_timeout: float = 30, retries: int = 3,
+                 backoff_base: float = 0.5, backoff_max: float = 10, breaker_threshold: int = 5,
+                 breaker_reset: float = 30):
+        self.logger = logging.getLogger("httppolicy")
+        self.connect_timeout: float = connect_timeout
+        self.read_timeout: float = read_timeout
+        self.retries: int = retries
+        self.backoff_base: float = backoff_base
+        self.backoff_max: float = backoff_max
+        self.breaker_threshold: int = breaker_threshold
+        self.breaker_reset: float = breaker_reset
+        self.lock = threading.Lock()
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        # Retried requests and requests rejected by open breaker, by host
+        self.retry_counts: Dict[str, int] = {}
+        self.rejected: Dict[str, int] = {}
+
+    @classmethod
+    def from_configuration(cls, config) -> "HttpPolicy":
+        return cls(
+            connect_timeout=config.http_connect_timeout,
+            read_timeout=config.http_read_timeout,
+            retries=config.http_retries,
+            breaker_threshold=config.breaker_threshold,
+            breaker_reset=config.breaker_reset,
+        )
+
+    @property
+    def timeout(self) -> Tuple[float, float]:
+        """Connect and read timeouts, as accepted by 'requests'"""
+        return self.connect_timeout, self.read_timeout
+
+    @staticmethod
+    def host(url: str) -> str:
+        return urlparse(url).netloc
+
+    def _breaker(self, host: str) -> CircuitBreaker:
+        if host not in self.breakers:
+            self.breakers[host] = CircuitBreaker(self.breaker_threshold, self.breaker_reset)
+        return self.breakers[host]
+
+    def check(self, host: str):
+        """Raise CircuitOpenError if request to host must not be sent now"""
+        with self.lock:
+            if self._breaker(host).allow():
+                return
+            self.rejected[host] = self.rejected.get(host, 0) + 1
+        raise CircuitOpenError(f"Host {host} is failing, circuit breaker is open.")
+
+    def record(self, host: str, status_code: Union[int, None]):
+        """Record outcome of request, status code None for connection failure or timeout"""
+        with self.lock:
+            breaker = self._breaker(host)
+            previous = breaker.state
+            if status_code is None or status_code in RETRY_STATUSES:
+                breaker.failure()
+            else:
+                breaker.success()
+            state = breaker.state
+        if state != previous and state == BREAKER_OPEN:
+            self.logger.warning(f"Circuit breaker opened for {host}, requests fail fast for {self.breaker_reset}s.")
+        elif state != previous and state == BREAKER_CLOSED:
+            self.logger.info(f"Circuit breaker closed for {host}.")
+
+    def abandon(self, host: str):
+        """Request allowed by check() ended without outcome, e.g. cancelled or failed while reading the response"""
+        with self.lock:
+            self._breaker(host).abandon()
+
+    def retry_delay(self, method: str, host: str, attempt: int, status_code: Union[int, None]) -> Union[float, None]:
+        """
+        Seconds to wait before retrying failed request (attempt starts from 0),
+        None if request is not retried.
+        """
+        if method.upper() not in IDEMPOTENT_METHODS or attempt >= self.retries:
+            return None
+        if status_code is not None and status_code not in RETRY_STATUSES:
+            return None
+        with self.lock:
+            if self._breaker(host).state == BREAKER_OPEN:
+                return None
+            self.retry_counts[host] = self.retry_counts.get(host, 0) + 1
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def summary(self) -> str:
+        """Retries and breaker states by host as text, empty if every request succeeded at first"""
+        parts = []
+        with self.lock:
+            for host in sorted(set(self.retry_counts) | set(self.rejected) | set(
+                    h for h, b in self.breakers.items() if b.opened)):
+                breaker = self.breakers.get(host)
+                part = f"{host}: {self.retry_counts.get(host, 0)} retries"
+                if breaker and breaker.opened:
+                    part += f", breaker {breaker.state} (opened {breaker.opened} times)"
+                if self.rejected.get(host):
+                    part += f", {self.rejected[host]} requests rejected"
+                parts.append(part)
+        return f"Failed requests: {'; '.join(parts)}." if parts else ""
+
+
+class PolicySession(requests.Session):
+    """Session applying HttpPolicy for every request: default timeouts, retries and circuit breaker"""
+
+    def __init__(self, policy: HttpPolicy):
+        super().__init__()
+        self.policy: HttpPolicy = policy
+
+    def request(self, method, url, *args, **kwargs):
+        kwargs.setdefault("timeout", self.policy.timeout)
+        host = self.policy.host(url)
+        attempt = 0
+        while True:
+            self.policy.check(host)
+            try:
+                resp = super().request(method, url, *args, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                self.policy.record(host, None)
+                delay = self.policy.retry_delay(method, host, attempt, None)
+                if delay is None:
+                    raise
+            except BaseException:
+                self.policy.abandon(host)
+                raise
+            else:
+                self.policy.record(host, resp.status_code)
+                delay = self.policy.retry_delay(method, host, attempt, resp.status_code)
+                if delay is None:
+                    return resp
+                resp.close()
+            attempt += 1
+            time.sleep(delay)
@@ -2,12 +2,16 @@ import argparse
 import asyncio
 import json
 import logging
+import pathlib
 import sys
 from os.path import basename
 from typing import Dict
 from importlib import reload
 
 from . import ToolRegistry, ToolInfoEncoder, HubReadmeHandler, QuayReadmeHandler, ToolInfo, Remotes
+from .configuration import Configuration
+from .database import ToolDatabase
+from .snapshot import SnapshotError, export_snapshot, import_snapshot
 
 DEFAULT_IMAGE_FILTER_TAG = "latest"
 
@@ -369,6 +373,35 @@ def create_utils_argparse(subparsers: argparse._SubParsersAction):
     readme_exclusive_group.add_argument(
         "-n", "--name", help="Name of the tool to update README in remote registry.",
     )
+    sub_utils_parser.add_parser(
+        "explain-queries",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        help="Print query plans of the most frequent database queries, to check that no full scans are made.",
+    )
+    sub_utils_parser.add_parser(
+        "retention",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        help="Delete old version history by retention settings of configuration and compact the database file.",
+    )
+    export_parser = sub_utils_parser.add_parser(
+        "export-snapshot",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        help="Write deterministic, compressed snapshot of the database, or delta from earlier snapshot.",
+    )
+    export_parser.add_argument("file", help="Snapshot or delta file to write.")
+    export_parser.add_argument(
+        "--since", help="Earlier snapshot, delta from it is written instead of full snapshot. Can be the same file.",
+    )
+    import_parser = sub_utils_parser.add_parser(
+        "import-snapshot",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        help="Apply snapshot or delta into the database.",
+    )
+    import_parser.add_argument("file", help="Snapshot or delta file to apply.")
+    import_parser.add_argument(
+        "--force", action="store_true",
+        help="Apply delta even if the database is not at its base snapshot, result is not verified.",
+    )
 
 
 def create_list_argparse(subparsers: argparse._SubParsersAction, ):
@@ -492,6 +525,8 @@ def list_handler(args):
                 )
 
             finally:
+                # Connections of the remote registry are bound to the loop
+                loop.run_until_complete(reg.remote_registry.transport.aclose())
                 loop.close()
             if tools:
                 location = "local" if args.local else "remote"
@@ -539,6 +574,7 @@ def list_handler(args):
                 force_refresh=args.force_refresh,
             )
         )
+        loop.run_until_complete(reg.remote_registry.transport.aclose())
         if args.silent and ret:
             # On silent mode, use logger instead of printing, mainly used for database updating
             logger = logging.getLogger("main")
@@ -573,8 +609,47 @@ def utils_handler(args):
             reg.update_readme_single_tool(args.name)
         else:
             raise NotImplementedError
+    elif args.utils_sub_command == "explain-queries":
+        config = Configuration(args.config or "", args.tools or "")
+        db = ToolDatabase(config)
+        print(f"Database {config.tool_db}, schema version {db.schema_version()}")
+        scans = 0
+        for description, plan in db.explain_queries().items():
+            print(f"{description}:")
+            for detail in plan:
+                print(f"    {detail}")
+                scans += detail.startswith("SCAN")
+        if scans:
+            print(f"{scans} full scans found.")
+            sys.exit(1)
+    elif args.utils_sub_command == "retention":
+        config = Configuration(args.config or "", args.tools or "")
+        report = ToolDatabase(config).apply_retention()
+        print(f"Deleted upstream versions: {report.upstream_versions}")
+        print(f"Deleted remote versions:   {report.remote_versions}")
+        print(f"Deleted tag changes:       {report.tag_changes}")
+        print(f"Reclaimed bytes:           {report.reclaimed_bytes}")
+    elif args.utils_sub_command == "export-snapshot":
+        config = Configuration(args.config or "", args.tools or "")
+        try:
+            report = export_snapshot(ToolDatabase(config), pathlib.Path(args.file),
+                                     pathlib.Path(args.since) if args.since else None)
+        except SnapshotError as e:
+            print(e)
+            sys.exit(1)
+        kind = f"Delta from {args.since}" if args.since else "Snapshot"
+        print(f"{kind} written into {args.file}: {report.rows} rows, {report.deleted} deleted, "
+              f"digest {report.digest}")
+    elif args.utils_sub_command == "import-snapshot":
+        config = Configuration(args.config or "", args.tools or "")
+        try:
+            report = import_snapshot(ToolDatabase(config), pathlib.Path(args.file), args.force)
+        except SnapshotError as e:
+            print(e)
+            sys.exit(1)
+        print(f"Imported {args.file}: {report.rows} rows written, {report.deleted} deleted, digest {report.digest}")
     else:
-        print("Available subcommands: update-readme")
+        print("Available subcommands: update-readme, explain-queries, retention, export-snapshot, import-snapshot")
         sys.exit(1)
 
 
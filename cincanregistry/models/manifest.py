@@ -6,11 +6,16 @@ class ManifestV2:
     """
     Manifest object, based on the schema described in
     here https://docs.docker.com/registry/spec/manifest-v2-2/
+    OCI image manifest and image index (https://github.com/opencontainers/image-spec) have same structure.
 
     Raises TypeError if invalid schema
     """
     MANIFEST_LIST_MIME = "application/vnd.docker.distribution.manifest.list.v2+json"
     MANIFEST_IMAGE_MIME = "application/vnd.docker.distribution.manifest.v2+json"
+    OCI_INDEX_MIME = "application/vnd.oci.image.index.v1+json"
+    OCI_MANIFEST_MIME = "application/vnd.oci.image.manifest.v1+json"
+    LIST_TYPES = (MANIFEST_LIST_MIME, OCI_INDEX_MIME)
+    IMAGE_TYPES = (MANIFEST_IMAGE_MIME, OCI_MANIFEST_MIME)
 
     def __init__(self, manifest: Dict):
         """
@@ -20,12 +25,13 @@ class ManifestV2:
         self.schemaVersion: int = manifest.get("schemaVersion", None)
         if self.schemaVersion != 2:
             raise TypeError(f"Unsupported Manifest schema version: {self.schemaVersion}")
-        self.mediaType: str = manifest.get("mediaType", "")
-        if self.mediaType.casefold() == self.MANIFEST_LIST_MIME.casefold():
+        # Media type is optional in OCI schema
+        self.mediaType: str = manifest.get("mediaType", "") or (
+            self.OCI_INDEX_MIME if "manifests" in manifest else self.OCI_MANIFEST_MIME)
+        if self.mediaType.casefold() in (m.casefold() for m in self.LIST_TYPES):
             # Manifest list aka "fat manifest"
-            # TODO implement rest as separate object
-            self.manifests: List[Dict] = manifest.get("manifests", [])
-        elif self.mediaType.casefold() == self.MANIFEST_IMAGE_MIME.casefold():
+            self.manifests: List[PlatformReference] = [PlatformReference(m) for m in manifest.get("manifests", [])]
+        elif self.mediaType.casefold() in (m.casefold() for m in self.IMAGE_TYPES):
             # Image manifest
             self.config: ConfigReference = ConfigReference(manifest.get("config", {}))
             self.layers: List[LayerObject] = [LayerObject(layer) for layer in manifest.get("layers", [])]
@@ -34,19 +40,52 @@ class ManifestV2:
         else:
             raise TypeError(f"Unsupported Manifest MIME type: {self.mediaType}")
 
+    @property
+    def is_list(self) -> bool:
+        """Manifest list or image index, referring into image manifests of platforms"""
+        return hasattr(self, "manifests")
+
     def __str__(self):
         return json.dumps(self.dict_form, indent=2)
 
 
+class PlatformReference:
+    """
+    Reference to image manifest of single platform in manifest list or image index
+    """
+
+    def __init__(self, manifest: Dict):
+        self.mediaType: str = manifest.get("mediaType", "")
+        self.size: int = manifest.get("size")
+        self.digest: str = manifest.get("digest", "")
+        platform: Dict = manifest.get("platform", {})
+        self.architecture: str = platform.get("architecture", "")
+        self.os: str = platform.get("os", "")
+        self.variant: str = platform.get("variant", "")
+        if not self.digest.startswith("sha256:"):
+            raise ValueError("Reference digest for platform manifest cannot be null or invalid format.")
+
+    @property
+    def platform(self) -> str:
+        """Platform as 'os/architecture[/variant]', e.g. linux/arm64/v8"""
+        return "/".join(p for p in (self.os, self.architecture, self.variant) if p)
+
+    @property
+    def is_image(self) -> bool:
+        """False for entries without runnable image, such as build attestations"""
+        return self.os != "unknown" and self.architecture != "unknown"
+
+
 class ConfigReference:
     """
     Reference object to container configuration object based on Manifest V2 schema
     """
     CONTAINER_CONFIG_MIME = "application/vnd.docker.container.image.v1+json"
+    OCI_CONFIG_MIME = "application/vnd.oci.image.config.v1+json"
 
     def __init__(self, config: Dict):
         self.mediaType: str = config.get("mediaType", "")
-        if self.mediaType.casefold() != self.CONTAINER_CONFIG_MIME.casefold():
+        if self.mediaType.casefold() not in (self.CONTAINER_CONFIG_MIME.casefold(), self.OCI_CONFIG_MIME.casefold()):
             raise TypeError(f"Invalid type for container config: {self.mediaType}")
         self.size: int = config.get("size", None)
         self.digest: str = config.get("digest", "")
@@ -91,5 +130,11 @@ class ImageConfig:
         # Config from the last layer of the build
         self.container_config: Dict = image_config.get("container_config", {})
         self.docker_version: str = image_config.get("docker_version", "")
+        self.variant: str = image_config.get("variant", "")
         if not (self.architecture and self.os and self.rootfs):
             raise ValueError("Invalid container conf, missing required fields")
+
+    @property
+    def platform(self) -> str:
+        """Platform of the image as 'os/architecture[/variant]'"""
+        return "/".join(p for p in (self.os, self.architecture, self.variant) if p)
@@ -0,0 +1,170 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Dict, Union
+
+# Header names used by Docker Hub, and common variant used by other services
+REMAINING_HEADERS = ("RateLimit-Remaining", "X-RateLimit-Remaining")
+LIMIT_HEADERS = ("RateLimit-Limit", "X-RateLimit-Limit")
+
+
+def parse_limit_header(value: str) -> Union[int, None]:
+    """Parse value of rate limit header, e.g. '76;w=21600' as 76"""
+    try:
+        return int(value.split(";", 1)[0].strip())
+    except (AttributeError, ValueError):
+        return None
+
+
+def parse_retry_after(value: str) -> Union[float, None]:
+    """Parse Retry-After header, given as seconds or HTTP date, into seconds from now"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+class HostBudget:
+    """Rate limit state and request statistics of single host"""
+
+    def __init__(self):
+        self.limit: Union[int, None] = None
+        self.remaining: Union[int, None] = None
+        # Remaining budget when first seen, for calculating consumed budget
+        self.initial_remaining: Union[int, None] = None
+        # Requests are not sent before this (monotonic) time
+        self.paused_until: float = 0.0
+        self.active: int = 0
+        self.requests: int = 0
+        self.throttled: int = 0
+        # Consecutive 429 responses
+        self.retries: int = 0
+        # Concurrency limit of the transport, for handing out freed slots
+        self.max_concurrency: int = 1
+
+
+class RateLimitScheduler:
+    """
+    Schedules requests of remote registry by host, based on rate limit headers of responses.
+
+    Concurrency of a host is lowered as its remaining budget drops: at most half of the remaining
+    requests are in flight at once. On 429 (Too Many Requests) host is paused by 'Retry-After'
+    (or exponential backoff) and the request is retried, unless the wait would be longer than 'max_wait'
+    seconds or request has been retried 'max_retries' times.
+    """
+
+    def __init__(self, max_wait: float = 120, max_retries: int = 5):
+        self.logger = logging.getLogger("ratelimit")
+        self.max_wait: float = max_wait
+        self.max_retries: int = max_retries
+        self.hosts: Dict[str, HostBudget] = {}
+        # Total time of pauses
+        self.waited: float = 0.0
+        self._conditions: Dict[str, asyncio.Condition] = {}
+        self._loop: Union[asyncio.AbstractEventLoop, None] = None
+
+    def condition(self, host: str) -> asyncio.Condition:
+        """Conditions by host are bound to the event loop, new ones are made if loop has changed"""
+        loop = asyncio.get_event_loop()
+        if self._loop is not loop:
+            self._conditions = {}
+            self._loop = loop
+        if host not in self._conditions:
+            self._conditions[host] = asyncio.Condition()
+        return self._conditions[host]
+
+    def allowed(self, host: str, max_concurrency: int) -> int:
+        """Amount of concurrent requests allowed for host"""
+        budget = self.hosts.get(host)
+        if not budget or budget.remaining is None:
+            return max_concurrency
+        return max(1, min(max_concurrency, budget.remaining // 2))
+
+    async def acquire(self, host: str, max_concurrency: int):
+        """Wait until request to host can be sent"""
+        budget = self.hosts.setdefault(host, HostBudget())
+        budget.max_concurrency = max_concurrency
+        condition = self.condition(host)
+        async with condition:
+            while True:
+                pause = budget.paused_until - time.monotonic()
+                if pause > 0:
+                    try:
+                        await asyncio.wait_for(condition.wait(), pause)
+                    except asyncio.TimeoutError:
+                        pass
+                elif budget.active < self.allowed(host, max_concurrency):
+                    break
+                else:
+                    await condition.wait()
+            budget.active += 1
+            budget.requests += 1
+
+    async def release(self, host: str, response=None) -> bool:
+        """Update budget of host from the response. Returns True if request should be retried."""
+        budget = self.hosts[host]
+        condition = self.condition(host)
+        async with condition:
+            budget.active -= 1
+            paused_until = budget.paused_until
+            retry = self._update(host, budget, response) if response is not None else False
+            if budget.paused_until != paused_until:
+                condition.notify_all()
+            else:
+                # Wake only as many waiters as there are free slots, waking all of them
+                # on every response makes long queues quadratic
+                condition.notify(max(1, self.allowed(host, budget.max_concurrency) - budget.active))
+        return retry
+
+    def _update(self, host: str, budget: HostBudget, response) -> bool:
+        headers = response.headers
+        remaining = next((parse_limit_header(headers.get(h)) for h in REMAINING_HEADERS if headers.get(h)), None)
+        if remaining is not None:
+            budget.remaining = remaining
+            if budget.initial_remaining is None:
+                budget.initial_remaining = remaining
+        limit = next((parse_limit_header(headers.get(h)) for h in LIMIT_HEADERS if headers.get(h)), None)
+        if limit is not None:
+            budget.limit = limit
+        if response.status_code != 429:
+            budget.retries = 0
+            return False
+        budget.throttled += 1
+        budget.retries += 1
+        wait = parse_retry_after(headers.get("Retry-After"))
+        if wait is None:
+            wait = min(60.0, 2.0 ** (budget.retries - 1))
+        if budget.retries > self.max_retries or wait > self.max_wait:
+            self.logger.warning(f"Rate limit of {host} exceeded, retry after {wait:.0f} seconds not attempted.")
+            return False
+        now = time.monotonic()
+        if now + wait > budget.paused_until:
+            self.waited += wait - max(0.0, budget.paused_until - now)
+            budget.paused_until = now + wait
+            self.logger.info(f"Rate limited by {host}, pausing requests for {wait:.1f} seconds.")
+        return True
+
+    def summary(self) -> str:
+        """Requests made by host, throttling and remaining budget, as text"""
+        total = sum(b.requests for b in self.hosts.values())
+        parts = []
+        for host, b in sorted(self.hosts.items()):
+            part = f"{host}: {b.requests}"
+            if b.remaining is not None:
+                consumed = b.initial_remaining - b.remaining if b.initial_remaining is not None else 0
+                part += f" (budget used {max(0, consumed)}, remaining {b.remaining}" + (
+                    f"/{b.limit})" if b.limit is not None else ")")
+            parts.append(part)
+        throttled = sum(b.throttled for b in self.hosts.values())
+        text = f"Made {total} requests" + (f" ({', '.join(parts)})" if parts else "")
+        if throttled:
+            text += f", rate limited {throttled} times, waited {self.waited:.1f} seconds"
+        return text + "."
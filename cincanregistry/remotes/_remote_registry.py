@@ -1,376 +1,847 @@
-import asyncio
-import base64
-import io
-import json
-import queue
-import re
-import tarfile
-from abc import abstractmethod
-from concurrent.futures.thread import ThreadPoolExecutor
-from os.path import basename
-from typing import List, Dict, Callable, Union
-from urllib.parse import urlparse
-
-import docker
-import requests
-
-from cincanregistry import ToolInfo, VersionInfo, VersionType
-from cincanregistry._registry import RegistryBase
-from cincanregistry.models.manifest import ImageConfig, ManifestV2
-from cincanregistry.utils import parse_file_time
-
-
-class RemoteRegistry(RegistryBase):
-    """
-    Implements client for Docker Registry HTTP V2 API
-    https://docs.docker.com/registry/spec/api/
-    """
-
-    def __init__(self, *args, **kwargs):
-        super(RemoteRegistry, self).__init__(*args, **kwargs)
-        self.schema_version: str = "v2"
-        self.registry_root: str = ""
-        self.registry_service: str = ""
-        self.image_prefix: str = ""
-        self.cincan_namespace: str = ""
-        self.full_prefix: str = ""
-        # Url for other endpoint (Non-image-registry)
-        self.custom_uri: str = ""
-        self.auth_digest_type: str = "Bearer"
-        self.auth_url: str = ""
-        self.max_workers: int = self.config.max_workers
-        # Using single Requests.Session instance here
-        self.session: requests.Session = requests.Session()
-        # Adapter allows more simultaneous connections
-        adapter = requests.adapters.HTTPAdapter(pool_maxsize=self.max_workers)
-        self.session.mount("https://", adapter)
-        # Queue used to hold data among threads, write into db in the end
-        self.cache_meta_data = queue.Queue()
-
-    @abstractmethod
-    def fetch_tags(self, tool: ToolInfo, update_cache: bool = False):
-        pass
-
-    def __del__(self):
-        """Close requests session if it exists"""
-        if self.session:
-            self.session.close()
-
-    def _docker_registry_api_error(
-            self, r: requests.Response, custom_error_msg: str = ""
-    ):
-        """
-        Logs error response caused by Docker Registry HTTP API V2
-        """
-        if custom_error_msg:
-            self.logger.error(f"{custom_error_msg}")
-        for error in r.json().get("errors"):
-            self.logger.debug(
-                f"{error.get('code')}: {error.get('message')} Additional details: {error.get('detail')}"
-            )
-
-    def _set_auth_and_service_location(self):
-        """
-        Set registry auth endpoint and actual service location from root url
-        Acquired from the www-authenticate header with HEAD (or GET) against v2 api
-        """
-
-        init_req = self.session.head(f"{self.registry_root}/{self.schema_version}/")
-        www_auth = init_req.headers.get("www-authenticate", "")
-        if not www_auth:
-            raise ValueError("No WWW-Authenticate header - unable to get auth details.")
-        # Parse key value pairs into dict
-        reg = re.compile(r'(\w+)[:=][\s"]?([^",]+)"?')
-        parsed_www = dict(reg.findall(www_auth))
-        self.registry_service = parsed_www.get("service", "")
-        self.auth_url = parsed_www.get("realm", "")
-        try:
-            self.auth_digest_type = www_auth.split(" ", 1)[0]
-        except IndexError():
-            self.logger.warning(f"Unable to get token digest type from {self.registry_root} , using default.")
-
-    def _get_daemon_credentials_for_registry(self):
-
-        config = docker.utils.config.load_general_config()
-        auths = (
-            iter(config.get("auths")) if config.get("auths") else None
-        )
-        if auths:
-            if self.custom_uri:
-                uri = self.custom_uri
-            else:
-                uri = self.registry_root
-            # top the domain e.g. quay.io
-            top_domain = ".".join(urlparse(uri).netloc.split('.')[-2:])
-            auth = {key: value for key, value in config.get("auths").items() if top_domain in key}
-            if auth:
-                token = next(iter(auth.items()))[1].get("auth")
-                username, password = (
-                    base64.b64decode(token).decode("utf-8").split(":", 1)
-                )
-                self.username = username
-                self.password = password
-            else:
-                raise PermissionError(
-                    "Unable to find Docker Hub credentials. Please use 'docker login' to log in."
-                )
-        else:
-            raise PermissionError(
-                "Unable to find any credentials. Please use 'docker login' to log in."
-            )
-
-    def _get_registry_service_token(self, repo: str) -> str:
-        """
-        Gets Bearer token with 'pull' scope for single repository
-        in Docker Registry HTTP API V2 by default.
-        """
-        if not self.auth_url and not self.registry_service:
-            self._set_auth_and_service_location()
-        params = {
-            "service": self.registry_service,
-            "scope": f"repository:{repo}:pull",
-        }
-        token_req = self.session.get(self.auth_url, params=params)
-        if token_req.status_code != 200:
-            self._docker_registry_api_error(
-                token_req, f"Error when getting token for repository {repo}"
-            )
-            return ""
-        else:
-            return token_req.json().get("token", "")
-
-    def _get_version_from_manifest(
-            self, manifest: dict,
-    ):
-        """
-        Parses value from defined variable from container's environment variables.
-        In this case, defined variable is expected to contain version information.
-
-        Applies for old V1 manifest.
-        """
-
-        v1_comp_string = manifest.get("history", [{}])[0].get("v1Compatibility")
-        if v1_comp_string is None:
-            return {}
-        v1_comp = json.loads(v1_comp_string)
-        # Get time and convert to Datetime object
-        updated = parse_file_time(v1_comp.get("created"))
-        version = ""
-        try:
-            for i in v1_comp.get("config").get("Env"):
-                if "".join(i).split("=")[0] == self.version_var:
-                    version = "".join(i).split("=")[1]
-                    break
-        except IndexError as e:
-            self.logger.warning(
-                f"No version information for tool {manifest.get('name')}: {e}"
-            )
-        return version, updated
-
-    def _get_version_from_image_config(self, conf: ImageConfig) -> str:
-        """
-        By given ImageConfig object, returns version of the tool from specific Env vale
-        :param conf:
-        :return:
-        """
-        env: List[str] = conf.config.get("Env")
-        for var in env:
-            if "".join(var).split("=")[0] == self.version_var:
-                version = "".join(var).split("=")[1]
-                return version
-        return ""
-
-    def read_remote_versions_from_db(self, tool_name: str = "") -> Union[Dict[str, ToolInfo], ToolInfo]:
-        """Get dict of tools which have remote versions (no upstream)"""
-        r = {}
-        if tool_name:
-            return self.db.get_single_tool(tool_name=tool_name, remote_name=self.registry_name,
-                                           filter_by=[VersionType.REMOTE])
-        else:
-            tools = self.db.get_tools(remote_name=self.registry_name, filter_by=[VersionType.REMOTE])
-
-        # Generate dict accessible by name from list
-        for t in tools:
-            r[t.name] = t
-        return r
-
-    def fetch_manifest(
-            self, name: str, tag: str, token: str = ""
-    ) -> Union[ManifestV2, None]:
-        """
-        Fetch docker image manifest information by tag
-        Manifest version 1 is deprecated, only V2 used.
-
-        TODO add maybe "fat manifest" support
-        """
-
-        # Get authentication token for tool with pull scope if not provided
-        if not token:
-            token = self._get_registry_service_token(name)
-
-        manifest_req = self.session.get(
-            f"{self.registry_root}/{self.schema_version}/{name}/manifests/{tag}",
-            headers={
-                "Authorization": f"{self.auth_digest_type} {token}",
-                "Accept": f"application/vnd.docker.distribution.manifest.v2+json",
-            }
-        )
-        if manifest_req.status_code != 200:
-            self._docker_registry_api_error(
-                manifest_req,
-                f"Error when getting manifest for tool {name}. Code {manifest_req.status_code}",
-            )
-            return None
-        return ManifestV2(manifest_req.json())
-
-    def _handle_cache_queue(self):
-        """
-        Meta file format: upstreams: [{}]
-        Write from queue into db until empty
-        Should be used under db.transaction
-        """
-        while not self.cache_meta_data.empty():
-            name, location, meta_data = self.cache_meta_data.get()
-            for u in meta_data.get("upstreams"):
-                self.db.insert_meta_info(name, location, u)
-
-    def _parse_meta_file(self, resp: requests.Response, tool_name: str) -> Dict:
-        """Parse metafile from downloaded single layer blob of Docker image"""
-        if len(resp.content) > self.config.meta_max_size:
-            self.logger.error(
-                f"Meta.json from {tool_name} Docker image is larger than {self.config.meta_max_size / 1000}MB, not used.")
-            return None
-        file_like_object = io.BytesIO(resp.content)
-        try:
-            tar = tarfile.open(fileobj=file_like_object)
-            for member in tar.getmembers():
-                if basename(member.name) == self.config.meta_filename:
-                    f = tar.extractfile(member)
-                    try:
-                        return json.load(f)
-                    except json.JSONDecodeError:
-                        self.logger.debug(f"Metafile not JSON for tool {tool_name}")
-        except tarfile.TarError:
-            self.logger.warning(f"Invalid tar format from blob of tool {tool_name}")
-        return None
-
-    def update_cache_by_tool(self, tool: ToolInfo):
-        """All changes here are roll-backed on sqlite error. Update tool info related to remote and meta files"""
-        with self.db.transaction():
-            self.db.insert_tool_info(tool)
-            self._handle_cache_queue()
-
-    def update_cache(self, tools: Dict[str, Union[ToolInfo, str]]):
-        """
-        Update tool cache by dict of ToolInfo objects. SQLite database used
-        """
-        with self.db.transaction():
-            self.db.insert_tool_info([tools.get(i) for i in tools.keys()])
-            self._handle_cache_queue()
-
-    def fetch_blob(self, tool_name: str, digest: str, token: str = ""):
-        if not token:
-            token = self._get_registry_service_token(tool_name)
-        try:
-            blob_res = self.session.get(
-                f"{self.registry_root}/{self.schema_version}/{tool_name}/blobs/{digest}",
-                headers={
-                    "Authorization": f"{self.auth_digest_type} {token}",
-                    "Accept": f"application/vnd.docker.image.rootfs.diff.tar.gzip",
-                }
-            )
-            if blob_res and blob_res.status_code == 200:
-                return blob_res
-            else:
-                self.logger.warning(f"Unable to get blob for tool {tool_name} with digest {digest}"
-                                    f"response code: {blob_res.status_code}")
-
-        except requests.ConnectionError as e:
-            self.logger.error(e)
-        return None
-
-    def fetch_image_config(self, name: str, config_digest: str, token: str = "") -> Union[ImageConfig, None]:
-        """
-        Fetches image configuration JSON for tool by given config digest
-        """
-        config_res = self.fetch_blob(name, config_digest, token)
-        if config_res:
-            return ImageConfig(config_res.json())
-        return None
-
-    async def update_tools_in_parallel(self, tools: Dict[str, ToolInfo], fetch_function: Callable,
-                                       force_update: bool = False):
-        """
-        Updates information of tools based on given list by querying all manifests for available tags
-        """
-
-        old_tools = self.read_remote_versions_from_db()
-
-        updated = 0
-        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-            loop = asyncio.get_event_loop()
-            tasks = []
-            for t in tools.values():
-                if (
-                        t.name not in old_tools
-                        or (t.updated > old_tools[t.name].updated if not force_update else True)
-                ):
-                    tasks.append(
-                        loop.run_in_executor(
-                            executor, fetch_function, t
-                        )
-                    )
-                    updated += 1
-                else:
-                    tools[t.name] = old_tools[t.name]
-                    self.logger.debug("no updates for %s", t.name)
-            for _ in await asyncio.gather(*tasks):
-                pass
-
-        # save the tool list
-        if updated > 0:
-            self.update_cache(tools)
-        return self.read_remote_versions_from_db()
-
-    def update_versions_from_manifest_by_tags(self, tool_name: str, tag_names: List[str]) -> List[VersionInfo]:
-        """
-        By given tag name list, fetches corresponding manifests and generates version info
-        """
-        available_versions: List[VersionInfo] = []
-        # Get token only once for one tool because speed
-        token = self._get_registry_service_token(tool_name)
-        for t in tag_names:
-            manifest = self.fetch_manifest(tool_name, t, token)
-            if not manifest:
-                continue
-            container_config = self.fetch_image_config(tool_name, manifest.config.digest, token)
-            if not container_config:
-                continue
-            size = sum([layer.size for layer in manifest.layers])
-            if manifest:
-                version = self._get_version_from_image_config(container_config)
-                updated = parse_file_time(container_config.created)
-                # Get meta data from latest image for upstream checking, skip big files (1MB+). Should be only file
-                # on final layer
-                if t == self.config.tag and manifest.layers[-1].size < self.config.meta_max_size:
-                    meta_blob_resp = self.fetch_blob(tool_name, manifest.layers[-1].digest, token)
-                    meta_parsed = self._parse_meta_file(meta_blob_resp, tool_name)
-                    if meta_parsed and isinstance(meta_parsed, Dict):
-                        self.cache_meta_data.put((basename(tool_name), self.registry_name, meta_parsed))
-                if not version:
-                    version = self.VER_UNDEFINED
-                match = [v for v in available_versions if version == v.version]
-                if match:
-                    next(iter(match)).tags.add(t)
-                else:
-                    ver_info = VersionInfo(
-                        version,
-                        VersionType.REMOTE,
-                        self.registry_name,
-                        {t},
-                        updated,
-                        size=size
-                    )
-                    available_versions.append(ver_info)
-
-        return available_versions
+import asyncio
+import base64
+import functools
+import json
+import re
+import tarfile
+from abc import abstractmethod
+from os.path import basename
+from datetime import datetime
+from typing import AsyncIterator, List, Dict, Callable, NamedTuple, Set, Tuple, Union
+from urllib.parse import urlencode, urlparse
+
+import docker
+import requests
+
+from cincanregistry import ToolInfo, VersionInfo, VersionType
+from cincanregistry._registry import RegistryBase
+from cincanregistry.blob_cache import BlobCache
+from cincanregistry.database import DatabaseWriter, ToolDatabase
+from cincanregistry.http_policy import HttpPolicy
+from cincanregistry.models.manifest import ImageConfig, LayerObject, ManifestV2
+from cincanregistry.rate_limit import RateLimitScheduler
+from cincanregistry.tar_stream import TarMemberExtractor
+from cincanregistry.token_cache import DEFAULT_EXPIRES_IN, TokenCache, granted_repositories
+from cincanregistry.transport import HttpTransport, TransportError, create_transport
+from cincanregistry.utils import parse_file_time, split_tool_tag
+
+
+TAG_ADDED = "added"
+TAG_MOVED = "moved"
+TAG_REMOVED = "removed"
+
+
+class PlatformImage(NamedTuple):
+    """Image of single platform in remote tag"""
+    platform: str
+    # Digest of image manifest
+    digest: str
+    version: str
+    updated: datetime
+    size: int
+
+
+class TagReconciliation(NamedTuple):
+    """Live tags of tool compared with stored tags, written into database with the tool"""
+    tool_id: str
+    location: str
+    # Current manifest digests of fetched tags
+    digests: Dict[str, str]
+    # Tag, change and new digest
+    changes: List[Tuple[str, str, str]]
+    # Current remote versions, others are removed. None if some tags failed, nothing is removed then
+    versions: Union[List[str], None]
+    # Platform images of fetched tags
+    platforms: Dict[str, List[PlatformImage]]
+
+
+class PendingWrites:
+    """Fetched data of single tool, written into database with the tool"""
+
+    def __init__(self):
+        # Name of the tool, location and parsed meta file
+        self.meta_data: List[Tuple[str, str, Dict]] = []
+        self.tag_changes: List[TagReconciliation] = []
+        # Endpoint key, location, ETag and Last-Modified
+        self.validators: List[Tuple[str, str, str, str]] = []
+
+
+class TagDetails(NamedTuple):
+    """Version information of single tag, from the image of configured platform"""
+    version: str
+    updated: datetime
+    size: int
+    # Images of all platforms, empty when reused from database
+    platforms: List[PlatformImage]
+
+
+class RemoteRegistry(RegistryBase):
+    """
+    Implements client for Docker Registry HTTP V2 API
+    https://docs.docker.com/registry/spec/api/
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(RemoteRegistry, self).__init__(*args, **kwargs)
+        self.schema_version: str = "v2"
+        self.registry_root: str = ""
+        self.registry_service: str = ""
+        self.image_prefix: str = ""
+        self.cincan_namespace: str = ""
+        self.full_prefix: str = ""
+        # Url for other endpoint (Non-image-registry)
+        self.custom_uri: str = ""
+        self.auth_digest_type: str = "Bearer"
+        self.auth_url: str = ""
+        self.max_workers: int = self.config.max_workers
+        # Using single Requests.Session instance here
+        self.session: requests.Session = requests.Session()
+        # Adapter allows more simultaneous connections
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=self.max_workers)
+        self.session.mount("https://", adapter)
+        # Requests are paced by rate limits of the hosts
+        self.rate_limiter: RateLimitScheduler = RateLimitScheduler(self.config.rate_limit_max_wait,
+                                                                   self.config.rate_limit_retries)
+        # Timeouts, retries and circuit breakers, shared with upstream checkers
+        self.http_policy: HttpPolicy = HttpPolicy.from_configuration(self.config)
+        # All registry API requests are coroutines made through transport
+        self.transport: HttpTransport = create_transport(self.config.http_backend, self.session,
+                                                         self.config.max_connections, self.max_workers,
+                                                         self.rate_limiter, self.http_policy)
+        # Meta data, reconciled tags and validators of listing endpoints by tool, written into db with the tool.
+        # Validators of tool listing are under empty name, written after all tools.
+        self.pending_writes: Dict[str, PendingWrites] = {}
+        # Fetch every tag, even if digest has not changed
+        self.force_refresh: bool = False
+        # Image configs and meta layers are cached by digest
+        self.blob_cache: BlobCache = BlobCache(self.config.blob_cache, self.config.blob_cache_max_size)
+        # Bearer tokens are shared by all requests and stored between runs
+        self.token_cache: TokenCache = TokenCache(self.config.token_cache)
+        # Token requests in progress by scope
+        self._pending_tokens: Dict[str, asyncio.Future] = {}
+        # Blob downloads in progress by digest, layers shared by tools are downloaded once
+        self._pending_blobs: Dict[str, asyncio.Future] = {}
+        # Cleared when auth service does not support tokens with multiple scopes
+        self._multi_scope_tokens: bool = True
+
+    @abstractmethod
+    async def fetch_tags(self, tool: ToolInfo, update_cache: bool = False):
+        pass
+
+    def __del__(self):
+        """Close requests session and transport if they exist"""
+        if self.session:
+            self.session.close()
+        if getattr(self, "transport", None):
+            self.transport.close()
+
+    def _docker_registry_api_error(
+            self, r, custom_error_msg: str = ""
+    ):
+        """
+        Logs error response caused by Docker Registry HTTP API V2
+        """
+        if custom_error_msg:
+            self.logger.error(f"{custom_error_msg}")
+        for error in r.json().get("errors"):
+            self.logger.debug(
+                f"{error.get('code')}: {error.get('message')} Additional details: {error.get('detail')}"
+            )
+
+    async def _set_auth_and_service_location(self):
+        """
+        Set registry auth endpoint and actual service location from root url
+        Acquired from the www-authenticate header with HEAD (or GET) against v2 api
+        """
+
+        init_req = await self.transport.head(f"{self.registry_root}/{self.schema_version}/")
+        www_auth = init_req.headers.get("www-authenticate", "")
+        if not www_auth:
+            raise ValueError("No WWW-Authenticate header - unable to get auth details.")
+        # Parse key value pairs into dict
+        reg = re.compile(r'(\w+)[:=][\s"]?([^",]+)"?')
+        parsed_www = dict(reg.findall(www_auth))
+        self.registry_service = parsed_www.get("service", "")
+        self.auth_url = parsed_www.get("realm", "")
+        try:
+            self.auth_digest_type = www_auth.split(" ", 1)[0]
+        except IndexError():
+            self.logger.warning(f"Unable to get token digest type from {self.registry_root} , using default.")
+
+    def _get_daemon_credentials_for_registry(self):
+
+        config = docker.utils.config.load_general_config()
+        auths = (
+            iter(config.get("auths")) if config.get("auths") else None
+        )
+        if auths:
+            if self.custom_uri:
+                uri = self.custom_uri
+            else:
+                uri = self.registry_root
+            # top the domain e.g. quay.io
+            top_domain = ".".join(urlparse(uri).netloc.split('.')[-2:])
+            auth = {key: value for key, value in config.get("auths").items() if top_domain in key}
+            if auth:
+                token = next(iter(auth.items()))[1].get("auth")
+                username, password = (
+                    base64.b64decode(token).decode("utf-8").split(":", 1)
+                )
+                self.username = username
+                self.password = password
+            else:
+                raise PermissionError(
+                    "Unable to find Docker Hub credentials. Please use 'docker login' to log in."
+                )
+        else:
+            raise PermissionError(
+                "Unable to find any credentials. Please use 'docker login' to log in."
+            )
+
+    def _repository_name(self, tool_name: str) -> str:
+        """Name of the image repository in registry for tool"""
+        name, _ = split_tool_tag(tool_name)
+        return name
+
+    async def _get_registry_service_token(self, repo: str) -> str:
+        """
+        Gets Bearer token with 'pull' scope for single repository
+        in Docker Registry HTTP API V2 by default.
+        Tokens are cached until they expire, concurrent calls for same repository share single request.
+        """
+        if not self.auth_url and not self.registry_service:
+            await self._set_auth_and_service_location()
+        scope = f"repository:{repo}:pull"
+        token = self.token_cache.get(self.registry_service, scope)
+        if token:
+            return token
+        pending = self._pending_tokens.get(scope)
+        if pending is not None:
+            return await asyncio.shield(pending)
+        future = asyncio.get_event_loop().create_future()
+        self._pending_tokens[scope] = future
+        token = ""
+        try:
+            token = (await self._request_tokens([repo])).get(repo, "")
+        finally:
+            del self._pending_tokens[scope]
+            future.set_result(token)
+        return token
+
+    async def _request_tokens(self, repos: List[str]) -> Dict[str, str]:
+        """
+        Request single token with 'pull' scope for all given repositories, and cache it.
+        Returns token by repository, for those repositories where access was granted.
+        """
+        scopes = [f"repository:{r}:pull" for r in repos]
+        params = {
+            "service": self.registry_service,
+            "scope": scopes if len(scopes) > 1 else scopes[0],
+        }
+        token_req = await self.transport.get(self.auth_url, params=params)
+        if token_req.status_code != 200:
+            if len(repos) > 1:
+                self._multi_scope_tokens = False
+                self.logger.debug(f"Multi-scope token request failed with code {token_req.status_code}, "
+                                  f"requesting tokens one by one.")
+            else:
+                self._docker_registry_api_error(
+                    token_req, f"Error when getting token for repository {repos[0]}"
+                )
+            return {}
+        content = token_req.json()
+        token = content.get("token", "")
+        if not token:
+            return {}
+        if len(repos) > 1:
+            # Auth service might grant only some of the scopes
+            granted = granted_repositories(token)
+            if granted is None:
+                self._multi_scope_tokens = False
+                self.logger.debug("Unable to read granted scopes from token, requesting tokens one by one.")
+                return {}
+            repos = [r for r in repos if r in granted]
+        self.token_cache.put(self.registry_service, [f"repository:{r}:pull" for r in repos], token,
+                             content.get("expires_in", DEFAULT_EXPIRES_IN))
+        return {r: token for r in repos}
+
+    async def prefetch_tokens(self, repos: List[str]):
+        """
+        Get tokens for many repositories with few requests, at most 'max_token_scopes' scopes in
+        single request. Repositories left without token get their own token when needed.
+        """
+        if not self._multi_scope_tokens:
+            return
+        if not self.auth_url and not self.registry_service:
+            await self._set_auth_and_service_location()
+        missing = [r for r in repos if not self.token_cache.get(self.registry_service, f"repository:{r}:pull")]
+        size = self.config.max_token_scopes
+        if len(missing) < 2 or size < 2:
+            return
+        chunks = [missing[i:i + size] for i in range(0, len(missing), size)]
+        try:
+            await asyncio.gather(*[self._request_tokens(c) for c in chunks])
+        except TransportError as e:
+            self.logger.debug(f"Unable to prefetch tokens: {e}")
+
+    def _get_version_from_manifest(
+            self, manifest: dict,
+    ):
+        """
+        Parses value from defined variable from container's environment variables.
+        In this case, defined variable is expected to contain version information.
+
+        Applies for old V1 manifest.
+        """
+
+        v1_comp_string = manifest.get("history", [{}])[0].get("v1Compatibility")
+        if v1_comp_string is None:
+            return {}
+        v1_comp = json.loads(v1_comp_string)
+        # Get time and convert to Datetime object
+        updated = parse_file_time(v1_comp.get("created"))
+        version = ""
+        try:
+            for i in v1_comp.get("config").get("Env"):
+                if "".join(i).split("=")[0] == self.version_var:
+                    version = "".join(i).split("=")[1]
+                    break
+        except IndexError as e:
+            self.logger.warning(
+                f"No version information for tool {manifest.get('name')}: {e}"
+            )
+        return version, updated
+
+    def _get_version_from_image_config(self, conf: ImageConfig) -> str:
+        """
+        By given ImageConfig object, returns version of the tool from specific Env vale
+        :param conf:
+        :return:
+        """
+        env: List[str] = conf.config.get("Env")
+        for var in env:
+            if "".join(var).split("=")[0] == self.version_var:
+                version = "".join(var).split("=")[1]
+                return version
+        return ""
+
+    @staticmethod
+    def _endpoint_key(url: str, params: Dict = None) -> str:
+        """Identifier of the endpoint for stored validators"""
+        return f"{url}?{urlencode(sorted((params or {}).items()), doseq=True)}"
+
+    async def _conditional_get(self, url: str, params: Dict = None, conditional: bool = True):
+        """
+        GET listing endpoint with stored validators as conditional request (If-None-Match, If-Modified-Since).
+        Validators are not used when refresh is forced. Status 304 tells that stored data is still valid.
+        """
+        headers = {}
+        if conditional and not self.force_refresh:
+            validators = self.db.get_validators(self._endpoint_key(url, params), self.registry_name)
+            if validators:
+                etag, last_modified = validators
+                if etag:
+                    headers["If-None-Match"] = etag
+                if last_modified:
+                    headers["If-Modified-Since"] = last_modified
+        return await self.transport.get(url, params=params, headers=headers or None)
+
+    def _pending(self, tool_id: str) -> PendingWrites:
+        """Data waiting to be written with the tool, empty name for tool listing"""
+        return self.pending_writes.setdefault(tool_id, PendingWrites())
+
+    def _queue_validators(self, url: str, params: Dict = None, resp=None, tool_id: str = ""):
+        """
+        Queue validators of the response to be stored with the data of the response, the tool or the listing.
+        Without response, validators of the endpoint are cleared.
+        """
+        headers = resp.headers if resp is not None else {}
+        self._pending(tool_id).validators.append((self._endpoint_key(url, params), self.registry_name,
+                                                  headers.get("ETag", ""), headers.get("Last-Modified", "")))
+
+    def _use_cached_versions(self, tool: ToolInfo) -> bool:
+        """Set stored remote versions for the tool when tags were not modified. False if nothing stored"""
+        cached = self.read_remote_versions_from_db(tool.name)
+        if not cached or not cached.versions:
+            return False
+        self.logger.debug(f"Tags not modified for tool {tool.name}, using cached versions.")
+        tool.versions = cached.versions
+        return True
+
+    def read_remote_versions_from_db(self, tool_name: str = "", defined_tag: str = ""
+                                     ) -> Union[Dict[str, ToolInfo], ToolInfo]:
+        """Get dict of tools which have remote versions (no upstream), only tools with the tag if defined"""
+        r = {}
+        if tool_name:
+            return self.db.get_single_tool(tool_name=tool_name, remote_name=self.registry_name,
+                                           filter_by=[VersionType.REMOTE])
+        else:
+            tools = self.db.get_tools(remote_name=self.registry_name, filter_by=[VersionType.REMOTE],
+                                      tag=defined_tag)
+
+        # Generate dict accessible by name from list
+        for t in tools:
+            r[t.name] = t
+        return r
+
+    def _manifest_headers(self, token: str) -> Dict[str, str]:
+        """Headers for manifest requests, HEAD and GET must accept same types to get same digest"""
+        return {
+            "Authorization": f"{self.auth_digest_type} {token}",
+            "Accept": ", ".join(ManifestV2.IMAGE_TYPES + ManifestV2.LIST_TYPES),
+        }
+
+    async def fetch_manifest_digest(self, name: str, tag: str, token: str = "") -> Union[str, None]:
+        """
+        Get digest of the manifest by tag with HEAD request, without downloading manifest.
+        Returns None if digest is not available.
+        """
+        if not token:
+            token = await self._get_registry_service_token(name)
+        try:
+            resp = await self.transport.head(
+                f"{self.registry_root}/{self.schema_version}/{name}/manifests/{tag}",
+                headers=self._manifest_headers(token)
+            )
+        except TransportError as e:
+            self.logger.error(e)
+            return None
+        if resp.status_code != 200:
+            self.logger.debug(f"Unable to get manifest digest for tool {name} with tag {tag}. "
+                              f"Code {resp.status_code}")
+            return None
+        return resp.headers.get("Docker-Content-Digest")
+
+    async def fetch_manifest(
+            self, name: str, tag: str, token: str = ""
+    ) -> Union[ManifestV2, None]:
+        """
+        Fetch docker image manifest information by tag or digest
+        Manifest version 1 is deprecated, only V2 used. Result can be manifest list (or OCI index).
+        Returns None if manifest is not available or not valid, the tag is skipped.
+        """
+
+        # Get authentication token for tool with pull scope if not provided
+        if not token:
+            token = await self._get_registry_service_token(name)
+
+        try:
+            manifest_req = await self.transport.get(
+                f"{self.registry_root}/{self.schema_version}/{name}/manifests/{tag}",
+                headers=self._manifest_headers(token)
+            )
+        except TransportError as e:
+            self.logger.error(f"Unable to get manifest for tool {name} with tag {tag}: {e}")
+            return None
+        if manifest_req.status_code != 200:
+            self._docker_registry_api_error(
+                manifest_req,
+                f"Error when getting manifest for tool {name}. Code {manifest_req.status_code}",
+            )
+            return None
+        try:
+            return ManifestV2(manifest_req.json())
+        except (TypeError, ValueError, KeyError) as e:
+            self.logger.error(f"Invalid manifest for tool {name} with tag {tag}: {e}")
+            return None
+
+    @staticmethod
+    def _write_pending(writes: PendingWrites, db: ToolDatabase):
+        """
+        Meta file format: upstreams: [{}]
+        Should be used under db.transaction, after the tool is inserted
+        """
+        for name, location, meta_data in writes.meta_data:
+            for u in meta_data.get("upstreams"):
+                db.insert_meta_info(name, location, u)
+        for r in writes.tag_changes:
+            db.insert_tag_digests(r.tool_id, r.location, r.digests)
+            db.delete_tag_digests(r.tool_id, r.location, [t for t, c, _ in r.changes if c == TAG_REMOVED])
+            db.insert_tag_changes(r.tool_id, r.location, r.changes)
+            db.delete_tag_platforms(r.tool_id, r.location, [t for t, c, _ in r.changes if c == TAG_REMOVED])
+            db.insert_tag_platforms(r.tool_id, r.location, {t: [tuple(p) for p in platforms]
+                                                            for t, platforms in r.platforms.items()})
+            if r.versions is not None:
+                db.delete_remote_versions(r.tool_id, r.location, r.versions)
+        for v in writes.validators:
+            db.insert_validators(*v)
+
+    def _write_tool(self, tool: ToolInfo, writes: PendingWrites, db: ToolDatabase):
+        """Tool with its versions and pending data"""
+        db.insert_tool_info(tool)
+        self._write_pending(writes, db)
+
+    def _handle_cache_queue(self):
+        """
+        Write all pending data into db, validators of tool listing last
+        Should be used under db.transaction
+        """
+        listing = self.pending_writes.pop("", None)
+        for writes in self.pending_writes.values():
+            self._write_pending(writes, self.db)
+        self.pending_writes.clear()
+        if listing:
+            self._write_pending(listing, self.db)
+
+    def _read_meta_file(self, extractor: TarMemberExtractor, tool_name: str) -> Union[Dict, None]:
+        """Parse metafile found by extractor"""
+        if extractor.too_large:
+            self.logger.error(
+                f"Meta.json from {tool_name} Docker image is larger than {self.config.meta_max_size / 1000}KB, "
+                f"not used.")
+            return None
+        if extractor.content is None:
+            return None
+        try:
+            return json.loads(extractor.content)
+        except ValueError:
+            self.logger.debug(f"Metafile not JSON for tool {tool_name}")
+        return None
+
+    def _parse_meta_file(self, blob: bytes, tool_name: str) -> Union[Dict, None]:
+        """Parse metafile from downloaded single layer blob of Docker image"""
+        extractor = TarMemberExtractor(self.config.meta_filename, self.config.meta_max_size)
+        try:
+            extractor.feed(blob)
+        except tarfile.TarError:
+            self.logger.warning(f"Invalid tar format from blob of tool {tool_name}")
+            return None
+        return self._read_meta_file(extractor, tool_name)
+
+    async def fetch_meta_file(self, tool_name: str, layer: LayerObject, token: str = "") -> Union[Dict, None]:
+        """
+        Get metafile from image layer. Layers up to 'meta_max_size' are downloaded whole and cached.
+        Larger layers are streamed and read only until the metafile is found; download is aborted
+        after 'meta_layer_max_size' bytes.
+        """
+        if layer.size <= self.config.meta_max_size:
+            blob = await self.fetch_blob(tool_name, layer.digest, token)
+            return self._parse_meta_file(blob, tool_name) if blob else None
+        if not token:
+            token = await self._get_registry_service_token(tool_name)
+        extractor = TarMemberExtractor(self.config.meta_filename, self.config.meta_max_size)
+        received = 0
+
+        def consume(chunk: bytes) -> bool:
+            nonlocal received
+            received += len(chunk)
+            if received > self.config.meta_layer_max_size:
+                self.logger.debug(f"No metafile in first {self.config.meta_layer_max_size} bytes of "
+                                  f"layer {layer.digest} of tool {tool_name}")
+                return True
+            return extractor.feed(chunk)
+
+        try:
+            resp = await self.transport.stream(
+                f"{self.registry_root}/{self.schema_version}/{tool_name}/blobs/{layer.digest}",
+                consume,
+                headers={
+                    "Authorization": f"{self.auth_digest_type} {token}",
+                    "Accept": f"application/vnd.docker.image.rootfs.diff.tar.gzip",
+                }
+            )
+        except TransportError as e:
+            self.logger.error(e)
+            return None
+        except tarfile.TarError:
+            self.logger.warning(f"Invalid tar format from blob of tool {tool_name}")
+            return None
+        if resp.status_code != 200:
+            self.logger.warning(f"Unable to get blob for tool {tool_name} with digest {layer.digest} "
+                                f"response code: {resp.status_code}")
+            return None
+        return self._read_meta_file(extractor, tool_name)
+
+    def update_cache_by_tool(self, tool: ToolInfo):
+        """All changes here are roll-backed on sqlite error. Update tool info related to remote and meta files"""
+        with self.db.transaction():
+            self.db.insert_tool_info(tool)
+            self._handle_cache_queue()
+
+    def update_cache(self, tools: Dict[str, Union[ToolInfo, str]]):
+        """
+        Update tool cache by dict of ToolInfo objects. SQLite database used
+        """
+        with self.db.transaction():
+            self.db.insert_tool_info([tools.get(i) for i in tools.keys()])
+            self._handle_cache_queue()
+
+    async def fetch_blob(self, tool_name: str, digest: str, token: str = "") -> Union[bytes, None]:
+        """
+        Get content of blob by digest. Blobs are immutable, local blob cache is used before the registry.
+        Concurrent requests of the same blob share single download.
+        """
+        cached = self.blob_cache.get(digest)
+        if cached is not None:
+            return cached
+        future = self._shared(self._pending_blobs, digest, lambda: self._download_blob(tool_name, digest, token))
+        try:
+            return await asyncio.shield(future)
+        finally:
+            if future.done():
+                self._pending_blobs.pop(digest, None)
+
+    async def _download_blob(self, tool_name: str, digest: str, token: str = "") -> Union[bytes, None]:
+        if not token:
+            token = await self._get_registry_service_token(tool_name)
+        try:
+            blob_res = await self.transport.get(
+                f"{self.registry_root}/{self.schema_version}/{tool_name}/blobs/{digest}",
+                headers={
+                    "Authorization": f"{self.auth_digest_type} {token}",
+                    "Accept": f"application/vnd.docker.image.rootfs.diff.tar.gzip",
+                }
+            )
+            if blob_res.status_code == 200:
+                self.blob_cache.put(digest, blob_res.content)
+                return blob_res.content
+            else:
+                self.logger.warning(f"Unable to get blob for tool {tool_name} with digest {digest}"
+                                    f"response code: {blob_res.status_code}")
+
+        except TransportError as e:
+            self.logger.error(e)
+        return None
+
+    async def fetch_image_config(self, name: str, config_digest: str, token: str = "") -> Union[ImageConfig, None]:
+        """
+        Fetches image configuration JSON for tool by given config digest
+        """
+        config_blob = await self.fetch_blob(name, config_digest, token)
+        if config_blob:
+            try:
+                return ImageConfig(json.loads(config_blob))
+            except (TypeError, ValueError, KeyError) as e:
+                self.logger.error(f"Invalid image config {config_digest} for tool {name}: {e}")
+        return None
+
+    async def _fetch_and_write(self, tool: ToolInfo, fetch_function: Callable, writer: DatabaseWriter):
+        """Fetch tool and queue it for writer with its pending data, the tool is not kept in memory after"""
+        await fetch_function(tool)
+        writes = self.pending_writes.pop(tool.name, PendingWrites())
+        await writer.aput(functools.partial(self._write_tool, tool, writes))
+
+    async def _update_batch(self, to_update: List[ToolInfo], fetch_function: Callable, writer: DatabaseWriter):
+        await self.prefetch_tokens([self._repository_name(t.name) for t in to_update])
+        await asyncio.gather(*[self._fetch_and_write(t, fetch_function, writer) for t in to_update])
+
+    @staticmethod
+    async def _single_batch(tools: Dict[str, ToolInfo]) -> AsyncIterator[Dict[str, ToolInfo]]:
+        yield tools
+
+    @staticmethod
+    async def _chain(first, rest: AsyncIterator) -> AsyncIterator:
+        """Async iterator of already received first item, followed by the rest"""
+        yield first
+        async for item in rest:
+            yield item
+
+    async def update_tools_in_parallel(self, tools: Union[Dict[str, ToolInfo], AsyncIterator[Dict[str, ToolInfo]]],
+                                       fetch_function: Callable, force_update: bool = False, defined_tag: str = ""):
+        """
+        Updates information of tools based on given list by querying all manifests for available tags
+        Fetch function is coroutine function, all tools are fetched concurrently on the same event loop
+        Updated tools are returned from the database, only tools with 'defined_tag' if given.
+
+        Tools can be given as async iterator of batches (e.g. pages of listing), then fetching of each batch
+        starts as soon as it arrives, while the rest of the listing is still being requested.
+
+        Every tool is written into the database by the writer thread as soon as it is fetched, commits are
+        made in batches. Validators of the listing are written last, so interrupted update is continued
+        by the next one, only tools not yet written are fetched again.
+        """
+
+        old_tools = self.read_remote_versions_from_db()
+        self.force_refresh = force_update
+
+        batches = self._single_batch(tools) if isinstance(tools, dict) else tools
+        fetches = []
+        async with DatabaseWriter(self.config) as writer:
+            async for batch in batches:
+                to_update = []
+                for t in batch.values():
+                    if (
+                            t.name not in old_tools
+                            or (t.updated > old_tools[t.name].updated if not force_update else True)
+                    ):
+                        to_update.append(t)
+                    else:
+                        self.logger.debug("no updates for %s", t.name)
+                if to_update:
+                    fetches.append(asyncio.ensure_future(self._update_batch(to_update, fetch_function, writer)))
+            await asyncio.gather(*fetches)
+            # Listing is valid only when all tools are written
+            await writer.aflush()
+            listing = self.pending_writes.pop("", None)
+            if listing:
+                await writer.aput(functools.partial(self._write_pending, listing))
+        self.logger.info(self.rate_limiter.summary())
+        if self.http_policy.summary():
+            self.logger.info(self.http_policy.summary())
+        return self.read_remote_versions_from_db(defined_tag=defined_tag)
+
+    @staticmethod
+    def _shared(futures: Dict[str, asyncio.Future], key: str, coro_function: Callable) -> asyncio.Future:
+        """Run coroutine only once by key, all callers share the same result"""
+        if key not in futures:
+            futures[key] = asyncio.ensure_future(coro_function())
+        return futures[key]
+
+    async def _fetch_tag_details(self, tool_name: str, reference: str, digest: str, tags: Set[str], token: str,
+                                 semaphore: asyncio.Semaphore, shared: Dict[str, asyncio.Future],
+                                 tool_id: str = "") -> Union[TagDetails, None]:
+        """
+        Fetch manifest and image config by reference (tag or digest) shared by given tags.
+        For manifest list or image index, images of all platforms are resolved concurrently.
+        Platform manifests and configs are fetched once per digest for the tool, by 'shared' futures.
+        Returns version, time of creation and compressed size of the image of configured platform,
+        and details of every platform.
+        Meta file is fetched from the final layer of the latest tag, and queued for database with the tool.
+        Semaphore limits the concurrent tags of single tool.
+        """
+        async with semaphore:
+            manifest = await self.fetch_manifest(tool_name, reference, token)
+            if not manifest:
+                return None
+            if manifest.is_list:
+                refs = [m for m in manifest.manifests if m.is_image]
+                manifests = await asyncio.gather(*[
+                    self._shared(shared, m.digest, functools.partial(self.fetch_manifest, tool_name, m.digest, token))
+                    for m in refs])
+                images = [(ref.digest, ref.platform, m) for ref, m in zip(refs, manifests) if m and not m.is_list]
+            else:
+                images = [(digest, "", manifest)]
+            configs = await asyncio.gather(*[
+                self._shared(shared, m.config.digest,
+                             functools.partial(self.fetch_image_config, tool_name, m.config.digest, token))
+                for _, _, m in images])
+            platforms = []
+            primary = None
+            for (image_digest, platform, image), container_config in zip(images, configs):
+                if not container_config:
+                    continue
+                platform_image = PlatformImage(
+                    platform or container_config.platform,
+                    image_digest,
+                    self._get_version_from_image_config(container_config),
+                    parse_file_time(container_config.created),
+                    sum([layer.size for layer in image.layers])
+                )
+                platforms.append(platform_image)
+                if primary is None or platform_image.platform == self.config.platform:
+                    primary = (platform_image, image)
+            if primary is None:
+                return None
+            # Get meta data from latest image for upstream checking. Should be only file on final layer
+            if self.config.tag in tags:
+                meta_parsed = await self.fetch_meta_file(tool_name, primary[1].layers[-1], token)
+                if meta_parsed and isinstance(meta_parsed, Dict):
+                    tool_id = tool_id or basename(tool_name)
+                    self._pending(tool_id).meta_data.append((tool_id, self.registry_name, meta_parsed))
+        image = primary[0]
+        return TagDetails(image.version, image.updated, image.size, platforms)
+
+    async def _fetch_tag_digests(self, tool_name: str, tag_names: List[str], token: str,
+                                 semaphore: asyncio.Semaphore) -> Dict[str, Union[str, None]]:
+        """Get current manifest digests of tags with HEAD requests"""
+
+        async def fetch_digest(tag: str):
+            async with semaphore:
+                return await self.fetch_manifest_digest(tool_name, tag, token)
+
+        digests = await asyncio.gather(*[fetch_digest(t) for t in tag_names])
+        return dict(zip(tag_names, digests))
+
+    async def update_versions_from_manifest_by_tags(self, tool_name: str, tag_names: List[str], tool_id: str = "",
+                                                    tag_digests: Dict[str, str] = None) -> List[VersionInfo]:
+        """
+        By given tag name list, fetches corresponding manifests and generates version info
+        Tags are fetched concurrently, at most 'max_tag_requests' at once for single tool
+
+        If 'tool_id' (name of the tool in database) is given, tags are reconciled with stored tags by
+        their manifest digests. Digests are taken from 'tag_digests' (from tag listing) when available,
+        otherwise checked with HEAD requests. Only added and moved tags are fetched, once per digest;
+        unchanged tags reuse stored version information. Removed tags and their versions are deleted.
+        """
+        available_versions: List[VersionInfo] = []
+        # Get token only once for one tool because speed
+        token = await self._get_registry_service_token(tool_name)
+        semaphore = asyncio.Semaphore(self.config.max_tag_requests)
+        digests: Dict[str, str] = {t: d for t, d in (tag_digests or {}).items() if d and t in tag_names}
+        missing = [t for t in tag_names if t not in digests]
+        if tool_id and missing:
+            digests.update(await self._fetch_tag_digests(tool_name, missing, token, semaphore))
+        stored_digests = self.db.get_tag_digests(tool_id, self.registry_name) if tool_id else {}
+        reuse = stored_digests and not self.force_refresh
+        stored_versions = self.db.get_versions_by_tool(tool_id, [VersionType.REMOTE]) if reuse else []
+        details: Dict[str, TagDetails] = {}
+        # Tags to be fetched grouped by digest, or by tag when digest is not known
+        to_fetch: Dict[str, List[str]] = {}
+        for t in tag_names:
+            digest = digests.get(t)
+            if reuse and digest and stored_digests.get(t) == digest:
+                stored = next((v for v in stored_versions if t in v.tags), None)
+                if stored:
+                    details[t] = TagDetails(stored.version, stored.updated, stored.raw_size(), [])
+                    continue
+            to_fetch.setdefault(digest or t, []).append(t)
+        if tool_id:
+            self.logger.debug(f"{len(tag_names) - len(details)} of {len(tag_names)} tags changed for tool {tool_name}")
+        groups = list(to_fetch.values())
+        # Configs and platform manifests of the tool, fetched once per digest
+        shared: Dict[str, asyncio.Future] = {}
+        # Use tag as reference, listings can give digest of a manifest list in another format
+        results = await asyncio.gather(
+            *[self._fetch_tag_details(tool_name, tags[0], digests.get(tags[0], ""), set(tags), token, semaphore,
+                                      shared, tool_id) for tags in groups]
+        )
+        for tags, result in zip(groups, results):
+            if result:
+                for t in tags:
+                    details[t] = result
+        # Merge in the order of given tags, as if fetched one by one
+        for t in tag_names:
+            if t not in details:
+                continue
+            version, updated, size, _ = details[t]
+            if not version:
+                version = self.VER_UNDEFINED
+            match = [v for v in available_versions if version == v.version]
+            if match:
+                next(iter(match)).tags.add(t)
+            else:
+                ver_info = VersionInfo(
+                    version,
+                    VersionType.REMOTE,
+                    self.registry_name,
+                    {t},
+                    updated,
+                    size=size
+                )
+                available_versions.append(ver_info)
+        if tool_id:
+            self._pending(tool_id).tag_changes.append(self._reconcile(tool_id, tag_names, digests, stored_digests,
+                                                                      details, available_versions))
+        return available_versions
+
+    def _reconcile(self, tool_id: str, tag_names: List[str], digests: Dict[str, str], stored_digests: Dict[str, str],
+                   details: Dict, versions: List[VersionInfo]) -> TagReconciliation:
+        """Compare live tags of the tool with stored tags"""
+        # Digests only for fetched tags, failed ones are tried again on next update
+        fetched = {t: d for t, d in digests.items() if d and t in details}
+        changes = []
+        for t, d in fetched.items():
+            if t not in stored_digests:
+                changes.append((t, TAG_ADDED, d))
+            elif stored_digests[t] != d:
+                changes.append((t, TAG_MOVED, d))
+        live = set(tag_names)
+        changes += [(t, TAG_REMOVED, "") for t in stored_digests if t not in live]
+        if changes:
+            summary = ", ".join(f"{c} {len([x for x in changes if x[1] == c])}"
+                                for c in (TAG_ADDED, TAG_MOVED, TAG_REMOVED))
+            self.logger.info(f"Tags of tool {tool_id} changed: {summary}")
+        complete = all(t in details for t in tag_names)
+        platforms = {t: d.platforms for t, d in details.items() if d.platforms}
+        return TagReconciliation(tool_id, self.registry_name, fetched, changes,
+                                 [v.version for v in versions] if complete else None, platforms)
@@ -1,11 +1,11 @@
+import asyncio
 from datetime import datetime
-from typing import Dict
-
-import requests
+from typing import AsyncIterator, Dict, List, Union
 
 from cincanregistry import Remotes
 from cincanregistry.models.tool_info import ToolInfo
 from cincanregistry.remotes._remote_registry import RemoteRegistry
+from cincanregistry.transport import TransportError
 from cincanregistry.utils import parse_file_time, split_tool_tag
 
 
@@ -20,13 +20,13 @@ class DockerHubRegistry(RemoteRegistry):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.registry_name = Remotes.DOCKERHUB.value
-        self.registry_root = "https://registry.hub.docker.com"
+        self.registry_root = self.config.registry_url or "https://registry.hub.docker.com"
         self.image_prefix = ""
         self.cincan_namespace = "cincan"
         self.full_prefix = self.cincan_namespace
         self.custom_uri = "https://docker.io"
-        # Page size for Docker Hub
-        self.max_page_size: int = 1000
+        # Page size for Docker Hub, it serves at most 100 results per page
+        self.max_page_size: int = 100
 
     def _get_hub_session_cookies(self):
         """
@@ -49,43 +49,89 @@ class DockerHubRegistry(RemoteRegistry):
         else:
             raise PermissionError(f"Failed to fetch JWT and CSRF Token: {resp.content}")
 
-    def fetch_tags(self, tool: ToolInfo, update_cache: bool = False
-                   ):
+    async def _fetch_page(self, endpoint: str, params: Dict, page: int) -> Union[List[Dict], None]:
+        """Get results of single page of Docker Hub listing, None on failure"""
+        try:
+            resp = await self.transport.get(endpoint, params={**params, "page": page})
+        except TransportError as e:
+            self.logger.error(f"Failed to get page {page} of {endpoint}: {e}")
+            return None
+        if resp.status_code != 200:
+            self.logger.error(f"Failed to get page {page} of {endpoint}, code: {resp.status_code}")
+            return None
+        return resp.json().get("results", [])
+
+    async def _fetch_pages(self, endpoint: str, params: Dict, first: Dict) -> AsyncIterator[Union[List[Dict], None]]:
+        """
+        Yield results of Docker Hub listing by page, starting from the already fetched first page.
+        Amount of pages is known from 'count' of the first page, and the remaining pages are
+        requested concurrently. Pages are yielded in order of arrival, failed page as None.
+        """
+        results = first.get("results", [])
+        yield results
+        if not first.get("next") or not results:
+            return
+        # Size of the first page, registry may serve less than requested
+        pages = -(-first.get("count", 0) // len(results))
+        futures = [asyncio.ensure_future(self._fetch_page(endpoint, params, p)) for p in range(2, pages + 1)]
+        try:
+            for future in asyncio.as_completed(futures):
+                yield await future
+        finally:
+            for future in futures:
+                future.cancel()
+
+    async def fetch_tags(self, tool: ToolInfo, update_cache: bool = False
+                         ):
         """
         Fetch remote data to update a tool info. Gives more information than using regular registry /tags/list method
         Applies only to Docker Hub
         """
         if not self.auth_url:
-            self._set_auth_and_service_location()
+            await self._set_auth_and_service_location()
         self.logger.info("fetch %s...", tool.name)
         tool_name, tool_tag = split_tool_tag(tool.name)
         params = {"page_size": self.max_page_size}
-        tags_req = self.session.get(
-            f"{self.registry_root}/{self.schema_version}/repositories/{tool_name}/tags",
-            params=params,
-            # headers={
-            # "Host": self.registry_host
-            # },
-        )
+        endpoint = f"{self.registry_root}/{self.schema_version}/repositories/{tool_name}/tags"
+        tags_req = await self._conditional_get(endpoint, params=params)
+        if tags_req.status_code == 304:
+            if self._use_cached_versions(tool):
+                if update_cache:
+                    self.update_cache_by_tool(tool)
+                return
+            tags_req = await self._conditional_get(endpoint, params=params, conditional=False)
         if tags_req.status_code != 200:
             self.logger.error(
                 f"Error when getting tags for tool {tool_name}: {tags_req.content}"
             )
             return
-        if tags_req.json().get("count") > self.max_page_size:
-            self.logger.warning(
-                f"More tags ( > {self.max_page_size}) than able to list for tool {tool_name}."
-            )
         tags = tags_req.json()
+        results = []
+        pages = self._fetch_pages(endpoint, params, tags)
+        try:
+            async for page in pages:
+                if page is None:
+                    # Tags of missing page would be taken as removed
+                    self.logger.error(f"Unable to list all tags for tool {tool_name}.")
+                    return
+                results.extend(page)
+        finally:
+            await pages.aclose()
+        # Validators are usable only when all tags fit in single page
+        self._queue_validators(endpoint, params, tags_req if not tags.get("next") else None, tool.name)
         # sort tags by update time
         tags_sorted = sorted(
-            tags.get("results", []),
+            results,
             key=lambda x: parse_file_time(x["last_updated"]),
             reverse=True,
         )
         tag_names = list(map(lambda x: x["name"], tags_sorted))
         if tag_names:
-            available_versions = self.update_versions_from_manifest_by_tags(tool_name, tag_names)
+            # Digest is not included in the listing by older API versions
+            digests = {x["name"]: x.get("digest") for x in tags_sorted}
+            available_versions = await self.update_versions_from_manifest_by_tags(tool_name, tag_names,
+                                                                                  tool_id=tool.name,
+                                                                                  tag_digests=digests)
 
         else:
             self.logger.error(f"No tags found for tool {tool_name} for unknown reason.")
@@ -100,32 +146,38 @@ class DockerHubRegistry(RemoteRegistry):
         # get_fetch_start = timeit.default_timer()
         fresh_resp = None
         # Get fresh list of tools from remote registry
-        self._set_auth_and_service_location()
+        await self._set_auth_and_service_location()
+        self.force_refresh = force_update
+        endpoint = f"{self.registry_root}/{self.schema_version}/repositories/{self.cincan_namespace}/"
+        params = {"page_size": self.max_page_size}
         try:
-            params = {"page_size": 1000}
-            fresh_resp = self.session.get(
-                f"{self.registry_root}/{self.schema_version}/repositories/{self.cincan_namespace}/", params=params
-            )
-        except requests.ConnectionError as e:
+            fresh_resp = await self._conditional_get(endpoint, params=params)
+        except TransportError as e:
             self.logger.warning(e)
-        if fresh_resp and fresh_resp.status_code != 200:
+        if fresh_resp is not None and fresh_resp.status_code == 304:
+            self.logger.debug("List of tools not modified, using cached tools.")
+            self.logger.info(self.rate_limiter.summary())
+            return self.read_remote_versions_from_db(defined_tag=defined_tag)
+        if fresh_resp is not None and fresh_resp.status_code != 200:
             self._docker_registry_api_error(
                 fresh_resp,
                 "Error getting list of remote tools, code: {}".format(
                     fresh_resp.status_code
                 ),
             )
-        elif fresh_resp:
+        elif fresh_resp is not None:
             # get a images JSON, form new tool list
             fresh_json = fresh_resp.json()
-            # print(fresh_json)
+            # Validators are usable only when whole list fits in single page
+            self._queue_validators(endpoint, params, fresh_resp if not fresh_json.get("next") else None)
+            return await self.update_tools_in_parallel(self._tool_pages(endpoint, params, fresh_json),
+                                                       self.fetch_tags, force_update, defined_tag)
+
+    async def _tool_pages(self, endpoint: str, params: Dict, first: Dict) -> AsyncIterator[Dict[str, ToolInfo]]:
+        """Tools of namespace listing by page, as they arrive"""
+        async for page in self._fetch_pages(endpoint, params, first):
             tool_list = {}
-            for t in fresh_json["results"]:
-                # pprint(t)
-                # if defined_tag:
-                #     # name = f"{t['user']}/{t['name']}:{defined_tag}"
-                #     name = f"{t['user']}/{t['name']}"
-                # else:
+            for t in page or []:
                 name = f"{t.get('namespace')}/{t.get('name')}"
                 tool_list[name] = ToolInfo(
                     name,
@@ -133,5 +185,4 @@ class DockerHubRegistry(RemoteRegistry):
                     self.registry_name,
                     description=t.get("description", ""),
                 )
-
-            return await self.update_tools_in_parallel(tool_list, self.fetch_tags, force_update)
+            yield tool_list
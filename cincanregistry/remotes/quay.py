@@ -1,11 +1,11 @@
+import asyncio
 import datetime
-import requests
 import json
-from typing import Dict, List
+from typing import AsyncIterator, Dict, List, Union
 
-import cincanregistry.models.tool_info
 from cincanregistry.utils import split_tool_tag
 from cincanregistry.remotes._remote_registry import RemoteRegistry
+from cincanregistry.transport import TransportError
 from cincanregistry import ToolInfo, Remotes
 
 
@@ -18,12 +18,12 @@ class QuayRegistry(RemoteRegistry):
     def __init__(self, *args, **kwargs):
         super(QuayRegistry, self).__init__(*args, **kwargs)
         self.registry_name = Remotes.QUAY.value
-        self.registry_root = "https://quay.io"
+        self.registry_root = self.config.registry_url or "https://quay.io"
         self.image_prefix = "quay.io"
         self.cincan_namespace: str = "cincan"
         self.full_prefix = f"{self.image_prefix}/{self.cincan_namespace}"
 
-    def _quay_api_error(self, resp: requests.Response):
+    def _quay_api_error(self, resp):
         """ Error schema:
         {
           "status": 0,
@@ -42,11 +42,33 @@ class QuayRegistry(RemoteRegistry):
         except json.JSONDecodeError as e:
             self.logger.error(f"Non-schema response with status code: {resp.status_code} - {e}")
 
-    def __fetch_available_tools(self, next_page: str = "", repo_kind: str = "image", popularity: bool = False,
-                                last_modified: bool = True, public: bool = True, starred: bool = False,
-                                namespace: str = "") -> List[Dict]:
+    def _repository_name(self, tool_name: str) -> str:
+        """Tools are listed without namespace in Quay"""
+        name, _ = split_tool_tag(tool_name)
+        return f"{self.cincan_namespace}/{name}"
+
+    async def __fetch_tools_page(self, url: str, params: Dict) -> Union[Dict, None]:
+        """Get single page of repository listing, None on failure"""
+        try:
+            resp = await self.transport.get(url, params=params)
+        except TransportError as e:
+            self.logger.error(e)
+            return None
+        if resp.status_code != 200:
+            self.logger.error(f"Something went wrong when fetching "
+                              f"multiple pages of tools in {self.registry_name}")
+            self._quay_api_error(resp)
+            return None
+        return resp.json()
+
+    async def __fetch_available_tools(self, next_page: str = "", repo_kind: str = "image", popularity: bool = False,
+                                      last_modified: bool = True, public: bool = True, starred: bool = False,
+                                      namespace: str = "") -> AsyncIterator[Union[List[Dict], None]]:
         """
-        Fetch all Docker images related to namespace
+        Fetch all Docker images related to namespace, yielded page by page. Request for the next page
+        is sent before the current page is yielded, so tools of the page are processed while listing continues.
+        First item is None if list has not been modified since the previous fetch.
+        Listing stops at failed page, tools of earlier pages are yielded already.
         See: https://docs.quay.io/api/swagger/#!/repository/listRepos
         """
         endpoint = "/api/v1/repository"
@@ -63,12 +85,16 @@ class QuayRegistry(RemoteRegistry):
             # Remove empty param
             params.pop("next_page")
         resp = None
+        url = f"{self.registry_root}{endpoint}"
         try:
-            resp = self.session.get(f"{self.registry_root}{endpoint}", params=params)
-        except requests.exceptions.ConnectionError as e:
+            resp = await self._conditional_get(url, params=params)
+        except TransportError as e:
             self.logger.error(e)
 
-        if resp and resp.status_code == 200:
+        if resp is not None and resp.status_code == 304:
+            yield None
+            return
+        if resp is not None and resp.status_code == 200:
             # For some reason 200 is returned when namespace does not exist
             self.logger.debug(f"Acquired list of tools from {self.registry_root}")
             resp_cont = resp.json()
@@ -76,65 +102,71 @@ class QuayRegistry(RemoteRegistry):
                 self.logger.debug("Seems like namespace does not exist nor have available repositories.")
         else:
             self.logger.error(f"Failed to fetch tools from {self.registry_name}")
-            self._quay_api_error(resp)
-            return []
-        tools_list = resp_cont.get("repositories")
-        while "next_page" in resp_cont.keys():
-            self.logger.debug(f"Did not fetch all tools from the {self.registry_name}. Fetching possible 100 more...")
-            params["next_page"] = resp_cont.get("next_page")
-            try:
-                resp = self.session.get(f"{self.registry_root}{endpoint}", params=params)
-                if resp and resp.status_code == 200:
-                    resp_cont = resp.json()
-                    tools_list += resp_cont.get("repositories")
-                elif resp:
-                    self._quay_api_error(resp)
-                else:
-                    # Should not happen..
-                    self.logger.error(f"Something went wrong when fetching "
-                                      f"multiple pages of tools in {self.registry_name}")
-            except requests.exceptions.ConnectionError as e:
-                self.logger.error(e)
-                return []
+            if resp is not None:
+                self._quay_api_error(resp)
+            yield []
+            return
+        # Validators are usable only when whole list fits in single page
+        self._queue_validators(url, dict(params), resp if "next_page" not in resp_cont.keys() else None)
+        next_request = None
+        try:
+            while resp_cont is not None:
+                if "next_page" in resp_cont.keys():
+                    self.logger.debug(f"Did not fetch all tools from the {self.registry_name}. "
+                                      f"Fetching possible 100 more...")
+                    next_request = asyncio.ensure_future(
+                        self.__fetch_tools_page(url, {**params, "next_page": resp_cont.get("next_page")}))
+                yield resp_cont.get("repositories") or []
+                resp_cont = await next_request if next_request else None
+                next_request = None
+        finally:
+            if next_request:
+                next_request.cancel()
 
-        return tools_list
+    async def __tool_batches(self, pages: AsyncIterator[List[Dict]]) -> AsyncIterator[Dict[str, ToolInfo]]:
+        """Tools of listing by page"""
+        async for page in pages:
+            tool_list = {}
+            for t in page:
+                # name = f"{self.image_prefix}/{t.get('namespace')}/{t.get('name')}"
+                name = t.get('name')
+                timestamp = t.get("last_modified")
+                description = t.get("description")
+                tool_list[name] = ToolInfo(name, datetime.datetime.fromtimestamp(timestamp),
+                                           self.registry_name, description=description)
+            yield tool_list
 
     async def get_tools(self, defined_tag: str = "", force_update: bool = False) -> Dict[str, ToolInfo]:
         """Get tools from remote registry. Name set without repository prefixes"""
-        self._set_auth_and_service_location()
-        available_tools = self.__fetch_available_tools()
-        tool_list = {}
-        for t in available_tools:
-            # name = f"{self.image_prefix}/{t.get('namespace')}/{t.get('name')}"
-            name = t.get('name')
-            timestamp = t.get("last_modified")
-            description = t.get("description")
-            tool_list[name] = ToolInfo(name, datetime.datetime.fromtimestamp(timestamp),
-                                       self.registry_name, description=description)
-        tools = await self.update_tools_in_parallel(tool_list, self.fetch_tags, force_update)
-        if defined_tag:
-            keep = []
-            for t in tools.keys():
-                for v in tools[t].versions:
-                    if defined_tag in v.tags:
-                        keep.append(t)
-                        break
-            tools = {k: tools[k] for k in keep}
+        await self._set_auth_and_service_location()
+        self.force_refresh = force_update
+        pages = self.__fetch_available_tools()
+        try:
+            first = await pages.__anext__()
+            if first is None:
+                self.logger.debug("List of tools not modified, using cached tools.")
+                self.logger.info(self.rate_limiter.summary())
+                tools = self.read_remote_versions_from_db(defined_tag=defined_tag)
+            else:
+                tools = await self.update_tools_in_parallel(self.__tool_batches(self._chain(first, pages)),
+                                                            self.fetch_tags, force_update, defined_tag)
+        finally:
+            await pages.aclose()
         return tools
 
-    def fetch_tags(self, tool: ToolInfo, update_cache: bool = False):
+    async def fetch_tags(self, tool: ToolInfo, update_cache: bool = False):
         """
         Fetches available tags for single tool from quay.io HTTP API
         See: https://docs.quay.io/api/swagger/#!/repository/getRepo
         """
         if not self.auth_url:
-            self._set_auth_and_service_location()
+            await self._set_auth_and_service_location()
         # In case name includes tag, separate it
         self.logger.info("fetch %s...", tool.name)
         tool_name, tool_tag = split_tool_tag(tool.name)
         # Use name without registry prefix e.g. quay.io
         # name_without_prefix = "/".join(tool_name.split("/")[-2:])
-        name_without_prefix = f"{self.cincan_namespace}/{tool_name}"
+        name_without_prefix = self._repository_name(tool.name)
         endpoint = f"{self.registry_root}/api/v1/repository/{name_without_prefix}"
         params = {
             "includeTags": True,
@@ -142,15 +174,26 @@ class QuayRegistry(RemoteRegistry):
         }
         resp = None
         try:
-            resp = self.session.get(endpoint, params=params)
-        except requests.exceptions.ConnectionError as e:
+            resp = await self._conditional_get(endpoint, params=params)
+            if resp.status_code == 304:
+                if self._use_cached_versions(tool):
+                    if update_cache:
+                        self.update_cache_by_tool(tool)
+                    return
+                resp = await self._conditional_get(endpoint, params=params, conditional=False)
+        except TransportError as e:
             self.logger.error(e)
-        if resp and resp.status_code == 200:
+        if resp is not None and resp.status_code == 200:
             resp_cont = resp.json()
+            self._queue_validators(endpoint, params, resp, tool.name)
             tags = resp_cont.get("tags")
             tag_names = tags.keys()
             if tag_names:
-                available_versions = self.update_versions_from_manifest_by_tags(name_without_prefix, tag_names)
+                digests = {name: t.get("manifest_digest") for name, t in tags.items()}
+                available_versions = await self.update_versions_from_manifest_by_tags(name_without_prefix,
+                                                                                      list(tag_names),
+                                                                                      tool_id=tool.name,
+                                                                                      tag_digests=digests)
             else:
                 self.logger.error(f"No tags found for tool {tool_name}.")
                 return
@@ -160,6 +203,6 @@ class QuayRegistry(RemoteRegistry):
 
         else:
             self.logger.error(f"Failed to fetch tags for image {tool.name} - not updated")
-            if resp:
+            if resp is not None:
                 self._quay_api_error(resp)
             return
@@ -0,0 +1,301 @@
+"""
+Deterministic, compressed snapshots of the tool database and deltas between two snapshots.
+
+Both are gzip compressed JSON lines. First line is header with format, columns of tables and digest of the
+content. Snapshot rows follow as [table, values], sorted by their unique columns. Delta has digest of its base
+snapshot in header, followed by [table, "-", key] for deleted and [table, "+", values] for added or changed rows.
+Same database content gives always the same bytes: surrogate ids are left out (versions refer to meta data by
+its unique columns, identical tag changes are told apart by their occurrence), tags of versions are sorted and gzip
+header has no time or file name.
+Validators of registry listings and times of local bookkeeping (when created in database) are not included.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import pathlib
+import time
+from typing import Dict, Iterable, List, NamedTuple, Tuple
+
+from .database import (TABLE_METADATA, TABLE_TAG_CHANGES, TABLE_TAG_DIGESTS, TABLE_TAG_PLATFORMS, TABLE_TOOLS,
+                       TABLE_VALIDATORS, TABLE_VERSION_DATA, TABLE_VERSION_TAGS, SCHEMA_VERSION, ToolDatabase,
+                       s_fill_version_tags)
+
+SNAPSHOT_FORMAT = "cincanregistry-snapshot"
+DELTA_FORMAT = "cincanregistry-delta"
+FORMAT_VERSION = 1
+
+Rows = Dict[str, List[Tuple]]
+
+
+class SnapshotError(Exception):
+    """Snapshot or delta can't be read, or applied into the database"""
+
+
+class SnapshotReport(NamedTuple):
+    """Digest of the database content in snapshot, and rows written or deleted"""
+    digest: str
+    rows: int
+    deleted: int
+
+
+class SnapshotTable(NamedTuple):
+    name: str
+    columns: Tuple[str, ...]
+    # Unique columns of row
+    key: Tuple[str, ...]
+    # Changed rows are updated in place, otherwise deleted and inserted again. Rows referred by others are updated.
+    update: bool = False
+    # Selected columns in the order of 'columns', when not just the columns of the table
+    select: str = ""
+    # Inserted columns and values, when not just the columns of the table. Time of import is the last value.
+    insert: Tuple[Tuple[str, ...], str] = None
+    # No unique columns, identical rows are numbered by their occurrence in the last column, which is not stored
+    occurrence: bool = False
+
+    def key_of(self, row: Tuple) -> Tuple:
+        return tuple(row[self.columns.index(k)] for k in self.key)
+
+    def stored(self, row: Tuple) -> Tuple:
+        """Values of row or key as stored in the database"""
+        return row[:-1] if self.occurrence else row
+
+
+_META_KEY = ("uri", "repository", "tool", "provider")
+_VERSION_COLUMNS = ("tool_id", "tool_location", "version", "version_type", "source", "tags", "updated", "origin",
+                    "size", "extra_info")
+_TAG_CHANGE_COLUMNS = ("tool_id", "tool_location", "tag", "change", "digest", "changed")
+
+# In the order of foreign keys, referred tables first
+TABLES = [
+    SnapshotTable(TABLE_TOOLS, ("name", "location", "updated", "description"), ("name", "location"), update=True),
+    SnapshotTable(TABLE_METADATA, ("tool_id", "tool_location") + _META_KEY + ("suite", "method", "origin",
+                                                                           "docker_origin"),
+                  _META_KEY, update=True,
+                  insert=(("tool_id", "tool_location") + _META_KEY + ("suite", "method", "origin", "docker_origin",
+                                                                     "updated"), "?,?,?,?,?,?,?,?,?,?,?")),
+    SnapshotTable(TABLE_VERSION_DATA, _VERSION_COLUMNS + tuple(f"meta_{k}" for k in _META_KEY),
+                  ("tool_id", "version", "version_type", "source"),
+                  select=f"SELECT {', '.join(f'v.{c}' for c in _VERSION_COLUMNS)}, m.uri, m.repository, m.tool, "
+                         f"m.provider FROM {TABLE_VERSION_DATA} v "
+                         f"LEFT JOIN {TABLE_METADATA} m ON m.meta_id = v.meta_id "
+                         f"ORDER BY v.tool_id, v.version, v.version_type, v.source",
+                  insert=(_VERSION_COLUMNS + ("meta_id", "created"),
+                          f"{','.join('?' * len(_VERSION_COLUMNS))},(SELECT meta_id FROM {TABLE_METADATA} "
+                          f"WHERE uri IS ? AND repository IS ? AND tool IS ? AND provider IS ?),?")),
+    SnapshotTable(TABLE_TAG_DIGESTS, ("tool_id", "tool_location", "tag", "digest", "updated"),
+                  ("tool_id", "tool_location", "tag")),
+    SnapshotTable(TABLE_TAG_PLATFORMS, ("tool_id", "tool_location", "tag", "platform", "digest", "version",
+                                        "updated", "size"), ("tool_id", "tool_location", "tag", "platform")),
+    # History can have identical changes, ids are local. Oldest first, to keep the order of history on import.
+    SnapshotTable(TABLE_TAG_CHANGES, _TAG_CHANGE_COLUMNS + ("occurrence",), _TAG_CHANGE_COLUMNS + ("occurrence",),
+                  select=f"SELECT {', '.join(_TAG_CHANGE_COLUMNS)} FROM {TABLE_TAG_CHANGES} "
+                         f"ORDER BY tool_id, tool_location, changed, tag, change, digest, id",
+                  occurrence=True),
+]
+
+
+def _select(table: SnapshotTable) -> str:
+    if table.select:
+        return table.select
+    return f"SELECT {', '.join(table.columns)} FROM {table.name} " \
+           f"ORDER BY {', '.join(table.key + tuple(c for c in table.columns if c not in table.key))}"
+
+
+def _insert(table: SnapshotTable) -> str:
+    if table.occurrence:
+        # Inserted only if there are less identical rows than the occurrence, values are given twice
+        columns = table.stored(table.columns)
+        return f"INSERT INTO {table.name}({', '.join(columns)}) SELECT {','.join('?' * len(columns))} " \
+               f"WHERE (SELECT COUNT(*) FROM {table.name} WHERE {' AND '.join(f'{c} IS ?' for c in columns)}) < ?"
+    columns, values = table.insert or (table.columns, ",".join("?" * len(table.columns)))
+    s_insert = f"INSERT INTO {table.name}({', '.join(columns)}) VALUES ({values})"
+    if table.update:
+        changed = [c for c in columns if c in table.columns and c not in table.key] + \
+                  (["meta_id"] if "meta_id" in columns else [])
+        s_insert += f" ON CONFLICT({', '.join(table.key)}) DO UPDATE SET " \
+                    f"{', '.join(f'{c}=excluded.{c}' for c in changed)}"
+    return s_insert
+
+
+def _delete(table: SnapshotTable) -> str:
+    where = ' AND '.join(f'{k} IS ?' for k in table.stored(table.key))
+    if table.occurrence:
+        # Identical rows are interchangeable, the latest one is deleted
+        return f"DELETE FROM {table.name} WHERE rowid = (SELECT MAX(rowid) FROM {table.name} WHERE {where})"
+    return f"DELETE FROM {table.name} WHERE {where}"
+
+
+def _normalize(table: SnapshotTable, row: Tuple) -> Tuple:
+    """Tags of version in sorted order, order of the comma separated column depends on the writer"""
+    row = tuple(row)
+    if table.name != TABLE_VERSION_DATA:
+        return row
+    i = table.columns.index("tags")
+    tags = ",".join(sorted(t for t in (row[i] or "").split(",") if t))
+    return row[:i] + (tags,) + row[i + 1:]
+
+
+def _count_occurrences(table: SnapshotTable, rows: List[Tuple]) -> List[Tuple]:
+    """Number identical rows from 1 in the last column"""
+    if not table.occurrence:
+        return rows
+    counts = {}
+    for i, row in enumerate(rows):
+        counts[row] = counts.get(row, 0) + 1
+        rows[i] = row + (counts[row],)
+    return rows
+
+
+def read_rows(db: ToolDatabase) -> Rows:
+    """Content of the database as snapshot rows"""
+    return {t.name: _count_occurrences(t, [_normalize(t, r) for r in db.db_conn.execute(_select(t))])
+            for t in TABLES}
+
+
+def _line(*values) -> bytes:
+    return (json.dumps(list(values), separators=(",", ":")) + "\n").encode()
+
+
+def _snapshot_lines(rows: Rows) -> Iterable[bytes]:
+    for table in TABLES:
+        for row in rows.get(table.name, []):
+            yield _line(table.name, row)
+
+
+def digest(rows: Rows) -> str:
+    """SHA-256 of snapshot rows"""
+    sha = hashlib.sha256()
+    for line in _snapshot_lines(rows):
+        sha.update(line)
+    return sha.hexdigest()
+
+
+def diff(base: Rows, target: Rows) -> Tuple[Rows, Rows]:
+    """Keys of rows deleted from base, and rows added or changed in target"""
+    deleted, changed = {}, {}
+    for table in TABLES:
+        base_rows = {table.key_of(r): r for r in base.get(table.name, [])}
+        target_rows = {table.key_of(r): r for r in target.get(table.name, [])}
+        deleted[table.name] = [k for k in base_rows if k not in target_rows]
+        changed[table.name] = [r for k, r in target_rows.items() if base_rows.get(k) != r]
+    return deleted, changed
+
+
+def _header(file_format: str, content_digest: str, **kwargs) -> Dict:
+    return dict(format=file_format, version=FORMAT_VERSION, schema=SCHEMA_VERSION, digest=content_digest,
+                columns={t.name: list(t.columns) for t in TABLES}, **kwargs)
+
+
+def _write(path: pathlib.Path, header: Dict, lines: Iterable[bytes]):
+    """Write into temporary file first, existing file is replaced only when complete"""
+    tmp = path.with_name(f"{path.name}.tmp")
+    with tmp.open("wb") as f, gzip.GzipFile(filename="", mode="wb", fileobj=f, mtime=0) as gz:
+        gz.write((json.dumps(header, sort_keys=True, separators=(",", ":")) + "\n").encode())
+        for line in lines:
+            gz.write(line)
+    tmp.replace(path)
+
+
+def _read(path: pathlib.Path) -> Tuple[Dict, List[List]]:
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            header = json.loads(f.readline())
+            lines = [json.loads(line) for line in f]
+    except (OSError, EOFError, ValueError) as e:
+        raise SnapshotError(f"Unable to read {path}: {e}")
+    if not isinstance(header, dict) or header.get("format") not in (SNAPSHOT_FORMAT, DELTA_FORMAT):
+        raise SnapshotError(f"{path} is not a snapshot or delta of tool database")
+    if header.get("version") != FORMAT_VERSION:
+        raise SnapshotError(f"Unsupported version {header.get('version')} of {header['format']} in {path}")
+    if header.get("columns") != {t.name: list(t.columns) for t in TABLES}:
+        raise SnapshotError(f"Tables of {path} do not match the database, made with schema version "
+                            f"{header.get('schema')}")
+    return header, lines
+
+
+def _rows_of_snapshot(path: pathlib.Path, header: Dict, lines: List[List]) -> Rows:
+    if header["format"] != SNAPSHOT_FORMAT:
+        raise SnapshotError(f"{path} is a delta, full snapshot is required")
+    rows = {t.name: [] for t in TABLES}
+    for table, values in lines:
+        rows[table].append(tuple(values))
+    if digest(rows) != header["digest"]:
+        raise SnapshotError(f"Content of {path} does not match its digest")
+    return rows
+
+
+def read_snapshot(path: pathlib.Path) -> Rows:
+    """Rows of snapshot file, digest is verified"""
+    return _rows_of_snapshot(path, *_read(path))
+
+
+def export_snapshot(db: ToolDatabase, path: pathlib.Path, since: pathlib.Path = None) -> SnapshotReport:
+    """
+    Write snapshot of the database into file, or delta from snapshot 'since' when given.
+    Delta can be written into the file of its base snapshot.
+    """
+    rows = read_rows(db)
+    content_digest = digest(rows)
+    if not since:
+        _write(path, _header(SNAPSHOT_FORMAT, content_digest), _snapshot_lines(rows))
+        return SnapshotReport(content_digest, sum(len(r) for r in rows.values()), 0)
+    base = read_snapshot(since)
+    deleted, changed = diff(base, rows)
+
+    def delta_lines():
+        for table in TABLES:
+            for key in deleted[table.name]:
+                yield _line(table.name, "-", key)
+            for row in changed[table.name]:
+                yield _line(table.name, "+", row)
+
+    _write(path, _header(DELTA_FORMAT, content_digest, base=digest(base)), delta_lines())
+    return SnapshotReport(content_digest, sum(len(r) for r in changed.values()),
+                          sum(len(k) for k in deleted.values()))
+
+
+def import_snapshot(db: ToolDatabase, path: pathlib.Path, force: bool = False) -> SnapshotReport:
+    """
+    Apply snapshot or delta into the database, in single transaction.
+    After snapshot, the database has the same content as the snapshot. Delta is applied only on its base
+    snapshot, and the result must match the digest of the delta, unless forced.
+    Validators of listings are cleared, next update checks all tools again but fetches only the changed ones.
+    """
+    logger = logging.getLogger("snapshot")
+    header, lines = _read(path)
+    local = read_rows(db)
+    if header["format"] == SNAPSHOT_FORMAT:
+        deleted, changed = diff(local, _rows_of_snapshot(path, header, lines))
+    else:
+        if not force and digest(local) != header.get("base"):
+            raise SnapshotError(f"Database does not match the base snapshot of delta {path}")
+        deleted, changed = {t.name: [] for t in TABLES}, {t.name: [] for t in TABLES}
+        for table, op, values in lines:
+            (deleted if op == "-" else changed)[table].append(tuple(values))
+    now = (int(time.time()),)
+    try:
+        with db.transaction():
+            for table in reversed(TABLES):
+                db.cursor.executemany(_delete(table), [table.stored(k) for k in deleted[table.name]])
+            for table in TABLES:
+                rows = changed[table.name]
+                if table.occurrence:
+                    # Every column is part of the key, changed rows are new ones
+                    db.cursor.executemany(_insert(table), [table.stored(r) + r for r in rows])
+                    continue
+                if not table.update:
+                    db.cursor.executemany(_delete(table), [table.key_of(r) for r in rows])
+                db.cursor.executemany(_insert(table), [r + now for r in rows] if table.insert else rows)
+            db.cursor.execute(f"DELETE FROM {TABLE_VERSION_TAGS}")
+            db.cursor.execute(s_fill_version_tags)
+            db.cursor.execute(f"DELETE FROM {TABLE_VALIDATORS}")
+            result = digest(read_rows(db))
+            if not force and result != header["digest"]:
+                raise SnapshotError(f"Database does not match {path} after import")
+    except SnapshotError:
+        db.db_conn.rollback()
+        raise
+    report = SnapshotReport(result, sum(len(r) for r in changed.values()), sum(len(k) for k in deleted.values()))
+    logger.info(f"Imported {path}: {report.rows} rows written, {report.deleted} deleted")
+    return report
@@ -0,0 +1,449 @@
+"""
+Local stand-in for the remote registries, for offline benchmarking and testing.
+
+Serves Docker Registry HTTP API V2 (token handshake, manifests, blobs), Docker Hub repository
+and tag listings and Quay repository API for synthetic namespace of N tools with M tags each.
+Latency, server errors and rate limiting (429) can be injected.
+
+Run with e.g. 'python -m cincanregistry.stand_in --tools 500 --tags 10 --port 5000' and set
+'registry_url: http://127.0.0.1:5000' in configuration file of the registry.
+"""
+import argparse
+import base64
+import gzip
+import hashlib
+import io
+import json
+import random
+import re
+import socketserver
+import tarfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import Dict, List, Tuple, Union
+from urllib.parse import parse_qs, urlencode, urlparse
+
+from .models.manifest import ManifestV2
+from .token_cache import granted_repositories
+
+# Docker Hub serves at most this many results per page, Quay always this many
+HUB_MAX_PAGE_SIZE = 100
+QUAY_PAGE_SIZE = 100
+TOKEN_EXPIRES_IN = 300
+# Timestamp of the first synthetic tool, others are one minute apart
+BASE_TIME = 1590000000
+
+
+def _digest(data: bytes) -> str:
+    return f"sha256:{hashlib.sha256(data).hexdigest()}"
+
+
+class Repository:
+    """Images and tags of single synthetic tool"""
+
+    def __init__(self, name: str, meta_file: Dict):
+        self.name: str = name
+        self.tags: Dict[str, str] = {}
+        self.blobs: Dict[str, bytes] = {}
+        self.manifests: Dict[str, bytes] = {}
+        self.last_modified: int = BASE_TIME
+        buf = io.BytesIO()
+        meta = json.dumps(meta_file).encode()
+        # Fixed mtime, content and digests are same on every run
+        with gzip.GzipFile(fileobj=buf, mode="wb", mtime=0) as gz:
+            with tarfile.open(fileobj=gz, mode="w") as tar:
+                info = tarfile.TarInfo("meta.json")
+                info.size = len(meta)
+                tar.addfile(info, io.BytesIO(meta))
+        self.meta_layer: str = self._add(self.blobs, buf.getvalue())
+
+    @staticmethod
+    def _add(store: Dict[str, bytes], data: bytes) -> str:
+        digest = _digest(data)
+        store[digest] = data
+        return digest
+
+    def set_tag(self, tag: str, version: str):
+        """Point tag into image of given version"""
+        config = json.dumps({
+            "created": datetime.fromtimestamp(self.last_modified, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "architecture": "amd64", "os": "linux", "rootfs": {"type": "layers"},
+            "config": {"Env": [f"TOOL_VERSION={version}"]},
+        }).encode()
+        config_digest = self._add(self.blobs, config)
+        manifest = json.dumps({
+            "schemaVersion": 2,
+            "mediaType": ManifestV2.MANIFEST_IMAGE_MIME,
+            "config": {"mediaType": "application/vnd.docker.container.image.v1+json", "size": len(config),
+                       "digest": config_digest},
+            "layers": [{"mediaType": "application/vnd.docker.image.rootfs.diff.tar.gzip",
+                        "size": len(self.blobs[self.meta_layer]), "digest": self.meta_layer}],
+        }).encode()
+        self.tags[tag] = self._add(self.manifests, manifest)
+
+
+class SyntheticNamespace:
+    """
+    Namespace of 'tools' tools named 'tool-00000'..., each with versions '1.0'... as 'tags' tags and
+    'latest' pointing to the newest one. Repositories are generated on first use, content is deterministic.
+    """
+
+    def __init__(self, namespace: str = "cincan", tools: int = 100, tags: int = 5, meta_file: Dict = None):
+        self.namespace: str = namespace
+        self.tool_count: int = tools
+        self.tag_count: int = tags
+        # No upstreams by default, version checks do not reach the network
+        self.meta_file: Dict = meta_file if meta_file is not None else {"upstreams": []}
+        self.lock = threading.Lock()
+        self._repositories: Dict[str, Repository] = {}
+
+    @property
+    def names(self) -> List[str]:
+        return [f"tool-{i:05d}" for i in range(self.tool_count)]
+
+    def repository(self, name: str) -> Union[Repository, None]:
+        """Repository by tool name, None if not in namespace"""
+        with self.lock:
+            repo = self._repositories.get(name)
+            if repo is None:
+                match = re.fullmatch(r"tool-(\d{5})", name)
+                if not match or int(match.group(1)) >= self.tool_count:
+                    return None
+                repo = Repository(name, self.meta_file)
+                repo.last_modified = BASE_TIME + int(match.group(1)) * 60
+                for i in range(self.tag_count):
+                    repo.set_tag(f"1.{i}", f"1.{i}")
+                if self.tag_count:
+                    repo.set_tag("latest", f"1.{self.tag_count - 1}")
+                self._repositories[name] = repo
+            return repo
+
+    def last_modified(self, name: str) -> int:
+        with self.lock:
+            repo = self._repositories.get(name)
+        if repo:
+            return repo.last_modified
+        return BASE_TIME + int(name[5:]) * 60
+
+    def release(self, name: str, version: str, timestamp: int = None):
+        """Publish new version of tool at given time (default now), 'latest' is moved to it"""
+        repo = self.repository(name)
+        with self.lock:
+            repo.last_modified = timestamp or int(time.time())
+            repo.set_tag(version, version)
+            repo.set_tag("latest", version)
+
+
+class Faults:
+    """
+    Injected latency (seconds, with up to 'jitter' added), server errors ('error_rate' of requests
+    answered with 503) and rate limit of 'rate_limit' requests per 'rate_limit_window' seconds.
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+                 rate_limit: int = 0, rate_limit_window: float = 60.0, seed: int = 0):
+        self.latency: float = latency
+        self.jitter: float = jitter
+        self.error_rate: float = error_rate
+        self.rate_limit: int = rate_limit
+        self.rate_limit_window: float = rate_limit_window
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self._window_start: float = time.monotonic()
+        self._used: int = 0
+
+    def delay(self) -> float:
+        with self.lock:
+            return self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0.0)
+
+    def error(self) -> bool:
+        with self.lock:
+            return self.error_rate > 0 and self.random.random() < self.error_rate
+
+    def take(self) -> Tuple[Dict[str, str], Union[float, None]]:
+        """
+        Consume one request from the budget. Returns rate limit headers, and seconds until the
+        window resets if budget was exhausted (None otherwise).
+        """
+        if not self.rate_limit:
+            return {}, None
+        with self.lock:
+            now = time.monotonic()
+            if now - self._window_start >= self.rate_limit_window:
+                self._window_start = now
+                self._used = 0
+            window = f";w={int(self.rate_limit_window)}"
+            headers = {"RateLimit-Limit": f"{self.rate_limit}{window}"}
+            if self._used >= self.rate_limit:
+                headers["RateLimit-Remaining"] = f"0{window}"
+                return headers, max(0.0, self.rate_limit_window - (now - self._window_start))
+            self._used += 1
+            headers["RateLimit-Remaining"] = f"{self.rate_limit - self._used}{window}"
+            return headers, None
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately, without this delayed ACK stalls keep-alive connections
+    disable_nagle_algorithm = True
+    server: "StandInRegistry"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self._handle()
+
+    def do_GET(self):
+        self._handle()
+
+    def _handle(self):
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        kind, status, headers, body = self.server.respond(self.command, url.path, params, self.headers)
+        if self.command == "HEAD":
+            headers.setdefault("Content-Length", str(len(body)))
+            body = b""
+        else:
+            headers["Content-Length"] = str(len(body))
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.record(kind, len(body))
+
+
+class StandInRegistry(socketserver.ThreadingMixIn, HTTPServer):
+    """
+    HTTP server answering the endpoints used by DockerHubRegistry and QuayRegistry,
+    each request in own thread. Port 0 picks free port. Used as context manager, or with start() and stop().
+    With 'bind' False no socket is opened, and responses are only made by calling respond() directly.
+    """
+    daemon_threads = True
+    # Clients open many connections at once, default backlog of 5 would drop them
+    request_queue_size = 1024
+
+    def __init__(self, namespace: SyntheticNamespace = None, faults: Faults = None,
+                 host: str = "127.0.0.1", port: int = 0, bind: bool = True):
+        super().__init__((host, port), _Handler, bind_and_activate=bind)
+        self.namespace: SyntheticNamespace = namespace or SyntheticNamespace()
+        self.faults: Faults = faults or Faults()
+        # Requests by endpoint kind, and bytes of response bodies sent
+        self.requests: Counter = Counter()
+        self.bytes_sent: int = 0
+        self._stats_lock = threading.Lock()
+        self._thread: Union[threading.Thread, None] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "StandInRegistry":
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._thread:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def record(self, kind: str, size: int):
+        with self._stats_lock:
+            self.requests[kind] += 1
+            self.bytes_sent += size
+
+    @staticmethod
+    def _json(status: int, content, headers: Dict = None) -> Tuple[int, Dict, bytes]:
+        headers = dict(headers or {})
+        headers["Content-Type"] = "application/json"
+        return status, headers, json.dumps(content).encode()
+
+    @staticmethod
+    def _error(status: int, code: str, message: str) -> Tuple[int, Dict, bytes]:
+        return StandInRegistry._json(status, {"errors": [{"code": code, "message": message, "detail": None}]})
+
+    @staticmethod
+    def _listing(content, request_headers) -> Tuple[int, Dict, bytes]:
+        """JSON listing with ETag, 304 when it matches If-None-Match"""
+        body = json.dumps(content).encode()
+        etag = f'"{hashlib.sha256(body).hexdigest()[:16]}"'
+        if request_headers.get("If-None-Match") == etag:
+            return 304, {"ETag": etag}, b""
+        return 200, {"ETag": etag, "Content-Type": "application/json"}, body
+
+    def respond(self, method: str, path: str, params: Dict[str, List[str]], request_headers
+                ) -> Tuple[str, int, Dict, bytes]:
+        """Response for request as endpoint kind, status, headers and body"""
+        kind = self._kind(path)
+        delay = self.faults.delay()
+        if delay:
+            time.sleep(delay)
+        limit_headers, retry_after = self.faults.take()
+        if retry_after is not None:
+            headers = dict(limit_headers, **{"Retry-After": str(max(1, round(retry_after)))})
+            status, headers, body = self._json(429, {"errors": [{"code": "TOOMANYREQUESTS"}]}, headers)
+            return kind, status, headers, body
+        if self.faults.error():
+            status, headers, body = self._error(503, "UNAVAILABLE", "Injected error")
+        else:
+            status, headers, body = self._route(kind, method, path, params, request_headers)
+        headers.update(limit_headers)
+        return kind, status, headers, body
+
+    def _kind(self, path: str) -> str:
+        ns = self.namespace.namespace
+        if path == "/v2/":
+            return "ping"
+        if path == "/token":
+            return "token"
+        if path.startswith(f"/v2/repositories/{ns}/"):
+            return "hub_tags" if path.endswith("/tags") else "hub_repositories"
+        if path == "/api/v1/repository":
+            return "quay_repositories"
+        if path.startswith("/api/v1/repository/"):
+            return "quay_tags"
+        if "/manifests/" in path:
+            return "manifest"
+        if "/blobs/" in path:
+            return "blob"
+        return "other"
+
+    def _route(self, kind: str, method: str, path: str, params: Dict[str, List[str]], request_headers
+               ) -> Tuple[int, Dict, bytes]:
+        ns = self.namespace.namespace
+        if kind == "ping":
+            return 401, {"WWW-Authenticate": f'Bearer realm="{self.url}/token",service="stand-in"'}, b""
+        if kind == "token":
+            return self._json(200, {"token": self._token(params.get("scope", [])), "expires_in": TOKEN_EXPIRES_IN})
+        if kind == "hub_repositories":
+            return self._hub_page(params, [self._hub_repository(n) for n in self.namespace.names], path)
+        if kind == "hub_tags":
+            repo = self.namespace.repository(path[len(f"/v2/repositories/{ns}/"):-len("/tags")])
+            if not repo:
+                return self._json(404, {"message": "object not found"})
+            return self._hub_page(params, self._hub_tags(repo), path)
+        if kind == "quay_repositories":
+            return self._quay_repositories(params, request_headers)
+        if kind == "quay_tags":
+            repo = self.namespace.repository(path[len(f"/api/v1/repository/{ns}/"):])
+            if not repo or not path.startswith(f"/api/v1/repository/{ns}/"):
+                return self._json(404, {"status": 404, "error_message": "Not Found"})
+            return self._listing({"name": repo.name, "namespace": ns, "tags": {
+                t: {"name": t, "manifest_digest": d, "last_modified": repo.last_modified}
+                for t, d in repo.tags.items()}}, request_headers)
+        if kind in ("manifest", "blob"):
+            return self._image_content(kind, path, request_headers)
+        return self._error(404, "NOT_FOUND", "Unknown endpoint")
+
+    @staticmethod
+    def _token(scopes: List[str]) -> str:
+        """Unsigned JWT granting pull for every requested repository"""
+        access = [{"type": "repository", "name": s.split(":")[1], "actions": ["pull"]}
+                  for s in scopes if s.count(":") == 2]
+        payload = base64.urlsafe_b64encode(json.dumps({"access": access, "iat": int(time.time())}).encode())
+        return f"e30.{payload.decode().rstrip('=')}."
+
+    def _image_content(self, kind: str, path: str, request_headers) -> Tuple[int, Dict, bytes]:
+        name, _, reference = path[len("/v2/"):].partition(f"/{kind}s/")
+        ns, _, tool = name.partition("/")
+        repo = self.namespace.repository(tool) if ns == self.namespace.namespace else None
+        if not repo:
+            return self._error(404, "NAME_UNKNOWN", "repository name not known to registry")
+        auth = request_headers.get("Authorization", "")
+        granted = granted_repositories(auth[len("Bearer "):]) if auth.startswith("Bearer ") else None
+        if not granted or name not in granted:
+            return self._error(401, "UNAUTHORIZED", "authentication required")
+        if kind == "blob":
+            blob = repo.blobs.get(reference)
+            if blob is None:
+                return self._error(404, "BLOB_UNKNOWN", "blob unknown to registry")
+            return 200, {"Content-Type": "application/octet-stream", "Docker-Content-Digest": reference}, blob
+        digest = repo.tags.get(reference, reference)
+        manifest = repo.manifests.get(digest)
+        if manifest is None:
+            return self._error(404, "MANIFEST_UNKNOWN", "manifest unknown")
+        return 200, {"Content-Type": ManifestV2.MANIFEST_IMAGE_MIME, "Docker-Content-Digest": digest}, manifest
+
+    def _hub_page(self, params: Dict[str, List[str]], results: List[Dict], path: str) -> Tuple[int, Dict, bytes]:
+        size = min(int(params.get("page_size", ["10"])[0]), HUB_MAX_PAGE_SIZE)
+        page = int(params.get("page", ["1"])[0])
+        more = page * size < len(results)
+        return self._json(200, {
+            "count": len(results),
+            "next": f"{self.url}{path}?{urlencode({'page_size': size, 'page': page + 1})}" if more else None,
+            "previous": None,
+            "results": results[(page - 1) * size:page * size],
+        })
+
+    @staticmethod
+    def _time(timestamp: int) -> str:
+        return datetime.fromtimestamp(timestamp, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+    def _hub_repository(self, name: str) -> Dict:
+        return {"namespace": self.namespace.namespace, "name": name, "description": f"Synthetic tool {name}",
+                "last_updated": self._time(self.namespace.last_modified(name))}
+
+    def _hub_tags(self, repo: Repository) -> List[Dict]:
+        return [{"name": t, "digest": d, "full_size": len(repo.manifests[d]),
+                 "last_updated": self._time(repo.last_modified)} for t, d in repo.tags.items()]
+
+    def _quay_repositories(self, params: Dict[str, List[str]], request_headers) -> Tuple[int, Dict, bytes]:
+        if params.get("namespace", [""])[0] != self.namespace.namespace:
+            return self._listing({"repositories": []}, request_headers)
+        start = int(params.get("next_page", ["0"])[0])
+        names = self.namespace.names
+        content = {"repositories": [
+            {"namespace": self.namespace.namespace, "name": n, "description": f"Synthetic tool {n}",
+             "is_public": True, "kind": "image", "last_modified": self.namespace.last_modified(n)}
+            for n in names[start:start + QUAY_PAGE_SIZE]
+        ]}
+        if start + QUAY_PAGE_SIZE < len(names):
+            content["next_page"] = str(start + QUAY_PAGE_SIZE)
+        return self._listing(content, request_headers)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for Docker Hub and Quay registries.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--namespace", default="cincan")
+    parser.add_argument("--tools", type=int, default=100, help="Amount of tools in namespace.")
+    parser.add_argument("--tags", type=int, default=5, help="Version tags of each tool, 'latest' in addition.")
+    parser.add_argument("--latency", type=float, default=0.0, help="Added latency of every request, in seconds.")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Random latency added on top, in seconds.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests failing with 503.")
+    parser.add_argument("--rate-limit", type=int, default=0, help="Requests allowed per window, 0 for unlimited.")
+    parser.add_argument("--rate-limit-window", type=float, default=60.0, help="Rate limit window in seconds.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for injected latency and errors.")
+    args = parser.parse_args()
+    server = StandInRegistry(
+        SyntheticNamespace(args.namespace, args.tools, args.tags),
+        Faults(args.latency, args.jitter, args.error_rate, args.rate_limit, args.rate_limit_window, args.seed),
+        host=args.host, port=args.port,
+    )
+    print(f"Serving {args.tools} tools with {args.tags} tags in namespace '{args.namespace}' at {server.url}")
+    print(f"Use it with 'registry_url: {server.url}' in the configuration file.")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(", ".join(f"{k}: {v}" for k, v in sorted(server.requests.items())) or "No requests.")
+
+
+if __name__ == "__main__":
+    main()
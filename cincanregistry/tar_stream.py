@@ -0,0 +1,158 @@
+import tarfile
+import zlib
+from os.path import basename
+from typing import Union
+
+BLOCK_SIZE = tarfile.BLOCKSIZE
+GZIP_MAGIC = b"\x1f\x8b"
+# Decompressed at once, bounds memory use of highly compressed input
+DECOMPRESS_CHUNK = 64 * 1024
+# Maximum size of pax or GNU long name header data
+MAX_EXTENDED_HEADER = 64 * 1024
+
+
+class TarMemberExtractor:
+    """
+    Incremental reader of tar stream (gzip compressed or plain), for extracting single small member.
+    Stream is fed in chunks as they are downloaded. Only tar headers and the wanted member are held
+    in memory, data of other members is skipped by counting bytes.
+
+    Reading is finished when first regular file with basename 'filename' is found, when it is larger
+    than 'max_size' bytes, or when archive ends. Invalid tar or gzip raises tarfile.TarError.
+    """
+
+    def __init__(self, filename: str, max_size: int):
+        self.filename: str = filename
+        self.max_size: int = max_size
+        # Content of the member, when found
+        self.content: Union[bytes, None] = None
+        # Member was found, but larger than maximum size
+        self.too_large: bool = False
+        self.done: bool = False
+        self._decompressor = None
+        self._compressed: Union[bool, None] = None
+        self._buf = bytearray()
+        # Bytes of member data (with padding) to be skipped or read
+        self._skip: int = 0
+        self._read: int = 0
+        self._padding: int = 0
+        self._reading: bytes = b""
+        self._data = bytearray()
+        # Name from pax or GNU long name header, applied to next member
+        self._long_name: str = ""
+
+    def feed(self, data: bytes) -> bool:
+        """Feed next chunk of the stream. Returns True when no more data is needed."""
+        if self.done:
+            return True
+        if self._compressed is None:
+            self._buf += data
+            if len(self._buf) < len(GZIP_MAGIC):
+                return False
+            data, self._buf = bytes(self._buf), bytearray()
+            self._compressed = data.startswith(GZIP_MAGIC)
+            if self._compressed:
+                self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        if not self._compressed:
+            self._process(data)
+            return self.done
+        while data and not self.done:
+            try:
+                out = self._decompressor.decompress(data, DECOMPRESS_CHUNK)
+            except zlib.error as e:
+                raise tarfile.ReadError(f"Invalid gzip stream: {e}") from e
+            data = self._decompressor.unconsumed_tail
+            self._process(out)
+            if self._decompressor.eof:
+                self.done = True
+        return self.done
+
+    def _process(self, data: bytes):
+        """Run tar state machine over decompressed data"""
+        view = memoryview(data)
+        while not self.done:
+            if self._skip:
+                n = min(self._skip, len(view))
+                self._skip -= n
+                view = view[n:]
+            elif self._read:
+                n = min(self._read, len(view))
+                self._data += view[:n]
+                self._read -= n
+                view = view[n:]
+                if not self._read:
+                    self._member_read()
+            else:
+                need = BLOCK_SIZE - len(self._buf)
+                self._buf += view[:need]
+                view = view[need:]
+                if len(self._buf) < BLOCK_SIZE:
+                    break
+                block, self._buf = bytes(self._buf), bytearray()
+                self._header(block)
+            if not view:
+                break
+
+    def _header(self, block: bytes):
+        if block == tarfile.NUL * BLOCK_SIZE:
+            # End of archive
+            self.done = True
+            return
+        info = tarfile.TarInfo.frombuf(block, tarfile.ENCODING, "surrogateescape")
+        padded = -(-info.size // BLOCK_SIZE) * BLOCK_SIZE
+        if info.type in (tarfile.XHDTYPE, tarfile.GNUTYPE_LONGNAME):
+            if info.size > MAX_EXTENDED_HEADER:
+                raise tarfile.HeaderError("Too large extended header")
+            self._start_read(info.type, info.size, padded)
+            return
+        name = self._long_name or info.name
+        self._long_name = ""
+        if info.isreg() and basename(name.rstrip("/")) == self.filename:
+            if info.size > self.max_size:
+                self.too_large = True
+                self.done = True
+                return
+            self._start_read(tarfile.REGTYPE, info.size, padded)
+            if not info.size:
+                self._member_read()
+            return
+        self._skip = padded
+
+    def _start_read(self, kind: bytes, size: int, padded: int):
+        self._reading = kind
+        self._read = size
+        # Padding is skipped after the data
+        self._padding = padded - size
+        self._data = bytearray()
+
+    def _member_read(self):
+        self._skip = self._padding
+        data = bytes(self._data)
+        self._data = bytearray()
+        if self._reading == tarfile.XHDTYPE:
+            self._long_name = self._pax_path(data) or self._long_name
+        elif self._reading == tarfile.GNUTYPE_LONGNAME:
+            self._long_name = data.rstrip(tarfile.NUL).decode(tarfile.ENCODING, "surrogateescape")
+        else:
+            self.content = data
+            self.done = True
+
+    @staticmethod
+    def _pax_path(data: bytes) -> str:
+        """Get 'path' from pax extended header records, formatted as '<length> <key>=<value>\\n'"""
+        pos = 0
+        while pos < len(data):
+            space = data.find(b" ", pos)
+            if space == -1:
+                break
+            try:
+                length = int(data[pos:space])
+            except ValueError:
+                raise tarfile.HeaderError("Invalid pax header")
+            if length <= 0:
+                raise tarfile.HeaderError("Invalid pax header")
+            key, _, value = data[space + 1:pos + length - 1].partition(b"=")
+            if key == b"path":
+                return value.decode("utf-8", "surrogateescape")
+            pos += length
+        return ""
@@ -0,0 +1,93 @@
+import base64
+import json
+import logging
+import os
+import pathlib
+import tempfile
+import threading
+import time
+from typing import Dict, List, Set, Union
+
+# Default lifetime of token in seconds, if not told by auth service
+DEFAULT_EXPIRES_IN = 60
+# Token is not used when it expires within this many seconds
+EXPIRY_MARGIN = 10
+
+
+def granted_repositories(token: str) -> Union[Set[str], None]:
+    """
+    Repositories with 'pull' access granted for token, read from the 'access' claim of JWT.
+    Returns None if token is not JWT, access can't be known then.
+    """
+    try:
+        payload = token.split(".")[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+        access = claims["access"]
+        return set(a.get("name") for a in access if a.get("type") == "repository" and "pull" in a.get("actions", []))
+    except (IndexError, ValueError, TypeError, KeyError, AttributeError):
+        return None
+
+
+class TokenCache:
+    """
+    Bearer tokens of registry auth service, stored by service and scope until they expire.
+    Cache is kept in single JSON file, so tokens can be used across runs. File is read on first use,
+    and written again whenever new tokens are added.
+    """
+
+    def __init__(self, location: pathlib.Path):
+        self.logger = logging.getLogger("tokencache")
+        self.location: pathlib.Path = location
+        self.lock = threading.Lock()
+        self._tokens: Union[Dict[str, Dict], None] = None
+
+    @staticmethod
+    def _key(service: str, scope: str) -> str:
+        return f"{service} {scope}"
+
+    def _load(self) -> Dict[str, Dict]:
+        """Read stored tokens, lock must be held"""
+        if self._tokens is None:
+            self._tokens = {}
+            try:
+                with self.location.open() as f:
+                    self._tokens = json.load(f)
+            except FileNotFoundError:
+                pass
+            except (ValueError, OSError) as e:
+                self.logger.warning(f"Unable to read token cache {self.location}, ignoring it: {e}")
+            if not isinstance(self._tokens, dict):
+                self._tokens = {}
+        return self._tokens
+
+    def get(self, service: str, scope: str) -> Union[str, None]:
+        """Get token for service with scope, None if not stored or about to expire"""
+        with self.lock:
+            entry = self._load().get(self._key(service, scope))
+        if not isinstance(entry, dict) or entry.get("expires", 0) < time.time() + EXPIRY_MARGIN:
+            return None
+        return entry.get("token")
+
+    def put(self, service: str, scopes: List[str], token: str, expires_in: int = DEFAULT_EXPIRES_IN):
+        """Store token for every scope it was granted, and save the cache"""
+        expires = time.time() + expires_in
+        with self.lock:
+            tokens = self._load()
+            for scope in scopes:
+                tokens[self._key(service, scope)] = {"token": token, "expires": expires}
+            self._save(tokens)
+
+    def _save(self, tokens: Dict[str, Dict]):
+        """Write tokens which are still valid, lock must be held"""
+        now = time.time()
+        for key in [k for k, v in tokens.items() if not isinstance(v, dict) or v.get("expires", 0) < now]:
+            del tokens[key]
+        try:
+            self.location.parent.mkdir(parents=True, exist_ok=True)
+            # Temporary file is readable only by owner, replaced atomically
+            fd, tmp_name = tempfile.mkstemp(dir=str(self.location.parent), prefix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                json.dump(tokens, f)
+            os.replace(tmp_name, str(self.location))
+        except OSError as e:
+            self.logger.warning(f"Unable to save token cache {self.location}: {e}")
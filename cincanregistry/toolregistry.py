@@ -27,7 +27,7 @@ class ToolRegistry(RegistryBase):
             **kwargs,
 
     ):
-        super(ToolRegistry, self).__init__(*args)
+        super(ToolRegistry, self).__init__(*args, configuration=kwargs.get("configuration"))
         self.logger: logging.Logger = logging.getLogger("registry")
         self.default_remote = default_remote if (
                 default_remote is not None and default_remote != list(Remotes)[0]) else self.config.registry
@@ -59,6 +59,8 @@ class ToolRegistry(RegistryBase):
         local_tools, remote_tools = loop.run_until_complete(
             self.get_local_remote_tools(defined_tag)
         )
+        # Connections of the remote registry are bound to the loop
+        loop.run_until_complete(self.remote_registry.transport.aclose())
         loop.close()
         use_tools = {}
         # merged_tools_dic = {**local_tools, **remote_tools}
@@ -124,6 +126,7 @@ class ToolRegistry(RegistryBase):
             self.config,
             db=self.db,
             force_refresh=force_refresh,
+            http_policy=self.remote_registry.http_policy,
         )
         versions = {}
         if tool:
@@ -142,7 +145,8 @@ class ToolRegistry(RegistryBase):
             if not r_tool.updated or not (
                     now - timedelta(hours=self.config.cache_lifetime) <= r_tool.updated <= now
             ):
-                self.remote_registry.fetch_tags(r_tool, update_cache=True)
+                self.remote_registry.force_refresh = force_refresh
+                await self.remote_registry.fetch_tags(r_tool, update_cache=True)
             if l_tool or (r_tool and not r_tool.updated == datetime.min):
                 l_tool, r_tool = maintainer.get_versions_single_tool(
                     tool_name, l_tool, r_tool
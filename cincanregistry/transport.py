@@ -0,0 +1,268 @@
+import asyncio
+import functools
+import importlib.util
+import logging
+from abc import ABCMeta, abstractmethod
+from concurrent.futures.thread import ThreadPoolExecutor
+from typing import Awaitable, Callable, Dict, Union
+from urllib.parse import urlparse
+
+import requests
+
+from .http_policy import CircuitOpenError, HttpPolicy
+from .rate_limit import RateLimitScheduler
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+BACKEND_REQUESTS = "requests"
+BACKEND_HTTPX = "httpx"
+# Size of chunks when response body is streamed
+STREAM_CHUNK_SIZE = 16 * 1024
+
+
+class TransportError(IOError):
+    """Connection level failure (refused, reset, timed out) from any transport backend"""
+
+
+class HttpTransport(metaclass=ABCMeta):
+    """
+    Coroutine interface for HTTP requests made by remote registries.
+
+    Responses are returned as they come from the backend; both 'requests' and 'httpx'
+    responses provide 'status_code', 'headers', 'content' and 'json()' which is all we use.
+
+    With scheduler, requests wait for their turn by host and are retried when rate limited.
+    Policy sets the timeouts, retries failed idempotent requests and stops requests to failing hosts.
+    """
+    name: str = ""
+
+    def __init__(self, max_connections: int, scheduler: RateLimitScheduler = None, policy: HttpPolicy = None):
+        self.logger = logging.getLogger("transport")
+        self.max_connections: int = max_connections
+        self.scheduler: Union[RateLimitScheduler, None] = scheduler
+        self.policy: HttpPolicy = policy or HttpPolicy()
+        # Amount of requests sent through this transport
+        self.request_count: int = 0
+
+    async def _scheduled(self, url: str, call: Callable[[], Awaitable]):
+        """Run request coroutine function under the scheduler"""
+        if not self.scheduler:
+            self.request_count += 1
+            return await call()
+        host = urlparse(url).netloc
+        while True:
+            await self.scheduler.acquire(host, self.max_connections)
+            resp = None
+            try:
+                self.request_count += 1
+                resp = await call()
+            finally:
+                retry = await self.scheduler.release(host, resp)
+            if not retry:
+                return resp
+
+    async def _with_policy(self, method: str, url: str, call: Callable[[], Awaitable], retry: bool = True):
+        """Run request under the circuit breaker of the host, retrying transient failures"""
+        host = self.policy.host(url)
+        attempt = 0
+        while True:
+            try:
+                self.policy.check(host)
+            except CircuitOpenError as e:
+                raise TransportError(e) from e
+            try:
+                resp = await self._scheduled(url, call)
+            except TransportError:
+                self.policy.record(host, None)
+                delay = self.policy.retry_delay(method, host, attempt, None) if retry else None
+                if delay is None:
+                    raise
+            except BaseException:
+                # Cancelled or failed in decoding or consuming the response, trial request is given up
+                self.policy.abandon(host)
+                raise
+            else:
+                self.policy.record(host, resp.status_code)
+                delay = self.policy.retry_delay(method, host, attempt, resp.status_code) if retry else None
+                if delay is None:
+                    return resp
+            attempt += 1
+            self.logger.debug(f"{method} {url} failed, retrying in {delay:.1f} seconds.")
+            await asyncio.sleep(delay)
+
+    async def request(self, method: str, url: str, params: Dict = None, headers: Dict = None):
+        """Make single request, raises TransportError on connection failure"""
+        return await self._with_policy(
+            method, url, functools.partial(self._request, method, url, params=params, headers=headers))
+
+    async def get(self, url: str, params: Dict = None, headers: Dict = None):
+        return await self.request("GET", url, params=params, headers=headers)
+
+    async def head(self, url: str, params: Dict = None, headers: Dict = None):
+        return await self.request("HEAD", url, params=params, headers=headers)
+
+    async def stream(self, url: str, consume: Callable[[bytes], bool], headers: Dict = None):
+        """
+        GET with response body read in chunks, passed to 'consume' until it returns True.
+        Body is read only from successful (200) response, and it is never buffered whole.
+        Returns the response, raises TransportError on connection failure.
+        Stream is not retried, as part of the body may have been consumed already.
+        """
+        return await self._with_policy(
+            "GET", url, functools.partial(self._stream, url, consume, headers=headers), retry=False)
+
+    @abstractmethod
+    async def _request(self, method: str, url: str, params: Dict = None, headers: Dict = None):
+        pass
+
+    @abstractmethod
+    async def _stream(self, url: str, consume: Callable[[bytes], bool], headers: Dict = None):
+        pass
+
+    async def aclose(self):
+        """Release connections bound to the running event loop, transport is still usable afterwards"""
+
+    @abstractmethod
+    def close(self):
+        pass
+
+
+class RequestsTransport(HttpTransport):
+    """
+    Blocking 'requests' session calls executed in thread pool.
+    Amount of requests in flight is limited by the size of the pool.
+    """
+    name = BACKEND_REQUESTS
+
+    def __init__(self, session: requests.Session, max_connections: int, scheduler: RateLimitScheduler = None,
+                 policy: HttpPolicy = None):
+        super().__init__(max_connections, scheduler, policy)
+        self.session: requests.Session = session
+        self.executor = ThreadPoolExecutor(max_workers=max_connections)
+
+    async def _request(self, method: str, url: str, params: Dict = None, headers: Dict = None):
+        loop = asyncio.get_event_loop()
+        # HEAD is not redirected by requests.head() either
+        call = functools.partial(self.session.request, method, url, params=params, headers=headers,
+                                 allow_redirects=method != "HEAD", timeout=self.policy.timeout)
+        try:
+            return await loop.run_in_executor(self.executor, call)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            raise TransportError(e) from e
+
+    def _stream_blocking(self, url: str, consume: Callable[[bytes], bool], headers: Dict = None):
+        resp = self.session.get(url, headers=headers, stream=True, timeout=self.policy.timeout)
+        try:
+            if resp.status_code == 200:
+                for chunk in resp.iter_content(STREAM_CHUNK_SIZE):
+                    if consume(chunk):
+                        break
+        finally:
+            resp.close()
+        return resp
+
+    async def _stream(self, url: str, consume: Callable[[bytes], bool], headers: Dict = None):
+        loop = asyncio.get_event_loop()
+        call = functools.partial(self._stream_blocking, url, consume, headers=headers)
+        try:
+            return await loop.run_in_executor(self.executor, call)
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+            raise TransportError(e) from e
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+
+class HttpxTransport(HttpTransport):
+    """
+    Asynchronous 'httpx' client running on the event loop. Uses HTTP/2 when
+    'h2' package is installed and registry offers it, multiplexing requests over
+    few connections.
+    """
+    name = BACKEND_HTTPX
+
+    def __init__(self, max_connections: int, scheduler: RateLimitScheduler = None, policy: HttpPolicy = None):
+        super().__init__(max_connections, scheduler, policy)
+        self.http2: bool = importlib.util.find_spec("h2") is not None
+        self._client: Union["httpx.AsyncClient", None] = None
+        self._loop: Union[asyncio.AbstractEventLoop, None] = None
+
+    @property
+    def client(self) -> "httpx.AsyncClient":
+        """Client is bound to the event loop, new one is made if loop has changed"""
+        loop = asyncio.get_event_loop()
+        if self._client is None or self._loop is not loop:
+            self._close_client()
+            self._client = httpx.AsyncClient(
+                http2=self.http2,
+                limits=httpx.Limits(max_connections=self.max_connections),
+                timeout=httpx.Timeout(self.policy.read_timeout, connect=self.policy.connect_timeout),
+            )
+            self._loop = loop
+        return self._client
+
+    async def _request(self, method: str, url: str, params: Dict = None, headers: Dict = None):
+        try:
+            return await self.client.request(method, url, params=params, headers=headers,
+                                             follow_redirects=method != "HEAD")
+        except httpx.TransportError as e:
+            raise TransportError(e) from e
+
+    async def _stream(self, url: str, consume: Callable[[bytes], bool], headers: Dict = None):
+        try:
+            async with self.client.stream("GET", url, headers=headers, follow_redirects=True) as resp:
+                if resp.status_code == 200:
+                    async for chunk in resp.aiter_bytes(STREAM_CHUNK_SIZE):
+                        if consume(chunk):
+                            break
+            return resp
+        except httpx.TransportError as e:
+            raise TransportError(e) from e
+
+    def _close_client(self):
+        """Close client and its pooled connections on the event loop the client was used on"""
+        client, loop = self._client, self._loop
+        self._client = None
+        self._loop = None
+        if client is None or client.is_closed:
+            return
+        if loop is None or loop.is_closed():
+            self.logger.debug("Event loop of HTTP client is closed, its connections can not be closed.")
+        elif loop.is_running():
+            asyncio.run_coroutine_threadsafe(client.aclose(), loop)
+        else:
+            try:
+                loop.run_until_complete(loop.create_task(client.aclose()))
+            except RuntimeError:
+                # Another loop is running in this thread, closed when the loop of the client runs again
+                pass
+
+    async def aclose(self):
+        client = self._client
+        self._client = None
+        self._loop = None
+        if client is not None:
+            await client.aclose()
+
+    def close(self):
+        self._close_client()
+
+
+def create_transport(backend: str, session: requests.Session, max_connections: int,
+                     max_workers: int, scheduler: RateLimitScheduler = None,
+                     policy: HttpPolicy = None) -> HttpTransport:
+    """
+    Create transport by backend name. Falls back to 'requests' if 'httpx' is not installed.
+    Thread pool of 'requests' backend is sized by 'max_workers'.
+    """
+    logger = logging.getLogger("transport")
+    if backend == BACKEND_HTTPX:
+        if httpx is not None:
+            return HttpxTransport(max_connections, scheduler, policy)
+        logger.debug("Package 'httpx' not installed, using 'requests' for registry requests.")
+    elif backend != BACKEND_REQUESTS:
+        logger.warning(f"Unknown HTTP backend '{backend}', using '{BACKEND_REQUESTS}'.")
+    return RequestsTransport(session, max_workers, scheduler, policy)
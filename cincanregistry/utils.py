@@ -1,13 +1,22 @@
+import calendar
 import datetime
+import functools
 import pathlib
 import yaml
 from typing import List
 
+# Naive times are stored as seconds from this, as if they were UTC
+EPOCH = datetime.datetime(1970, 1, 1)
 
+
+@functools.lru_cache(maxsize=1024)
 def parse_file_time(string: str) -> datetime.datetime:
-    """Parse time from file as stored by Docker"""
+    """Parse time from file as stored by Docker, fraction and timezone are ignored"""
     s = string[0:19]
-    return datetime.datetime.strptime(s, "%Y-%m-%dT%H:%M:%S")
+    if len(s) != 19 or s[4] != "-" or s[7] != "-" or s[10] != "T" or s[13] != ":" or s[16] != ":":
+        raise ValueError(f"time data '{string}' does not match format '%Y-%m-%dT%H:%M:%S'")
+    # Same times are repeated in listings, parsing without strptime is much faster
+    return datetime.datetime(int(s[0:4]), int(s[5:7]), int(s[8:10]), int(s[11:13]), int(s[14:16]), int(s[17:19]))
 
 
 def format_time(time: datetime.datetime) -> str:
@@ -15,6 +24,17 @@ def format_time(time: datetime.datetime) -> str:
     return time.strftime("%Y-%m-%dT%H:%M:%S")
 
 
+def epoch_time(time: datetime.datetime) -> int:
+    """Time as integer seconds from epoch, as stored in database"""
+    return calendar.timegm(time.utctimetuple())
+
+
+@functools.lru_cache(maxsize=1024)
+def parse_epoch_time(seconds: int) -> datetime.datetime:
+    """Naive time from integer seconds from epoch, as stored in database"""
+    return EPOCH + datetime.timedelta(seconds=seconds)
+
+
 def split_tool_tag(tag: str) -> (str, str):
     """Split tool tag into tool name and tool version"""
     tag_split = tag.split(":", maxsplit=2)
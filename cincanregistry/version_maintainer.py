@@ -1,7 +1,7 @@
 import asyncio
+import functools
 import json
 import logging
-import queue
 from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Dict, Tuple, List
@@ -10,7 +10,8 @@ from cincanregistry.models.tool_info import ToolInfo
 from cincanregistry.models.version_info import VersionInfo, VersionType
 from .checkers import classmap, UpstreamChecker, NO_VERSION
 from .configuration import Configuration
-from .database import ToolDatabase
+from .database import ConnectionPool, DatabaseWriter, ToolDatabase
+from .http_policy import HttpPolicy
 from .utils import read_index_file
 
 UPSTREAM_TAG = "upstream"
@@ -26,11 +27,16 @@ class VersionMaintainer:
             configuration: Configuration,
             db: ToolDatabase,
             force_refresh: bool = False,
+            http_policy: HttpPolicy = None,
     ):
         self.config = configuration
         self.db = db
+        # Read connections of worker threads, opened once per thread
+        self.db_pool = ConnectionPool(self.config)
         self.logger = logging.getLogger("versions")
         self.tokens = self.config.tokens
+        # Timeouts, retries and circuit breakers shared by all upstream checkers
+        self.http_policy: HttpPolicy = http_policy or HttpPolicy.from_configuration(self.config)
         # Use local 'tools' path if provided instead of database
         self.meta_files_location = self.config.tools_repo_path
         self.meta_filename = self.config.meta_filename
@@ -45,7 +51,8 @@ class VersionMaintainer:
             )
         self.force_refresh = force_refresh
         self.tool_dirs = []
-        self.cache_write_queue = queue.Queue()
+        # Upstream versions are written by single thread while checks are running
+        self.db_writer: DatabaseWriter = None
 
     def _get_upstreams_local_metafile(self, tool_name: str) -> List[Dict]:
         """Read local metafile from cloned https://gitlab.com/CinCan/tools """
@@ -60,11 +67,7 @@ class VersionMaintainer:
     def _set_single_tool_upstream_versions(self, tool: ToolInfo, in_thread=False):
         """Update upstream information of given tool"""
 
-        if in_thread:
-            # New db connection inside thread
-            db = ToolDatabase(self.config)
-        else:
-            db = self.db
+        db = self.db_pool.get() if in_thread else self.db
 
         if not self.meta_files_location:
             # Expect list or single object in "upstreams" value
@@ -87,22 +90,21 @@ class VersionMaintainer:
             token_provider = upstream_info.get("token_provider") or provider
             token = self.tokens.get(token_provider) if self.tokens else ""
             # Don't use cached version if was not found last time - instead try to fetch again
+            # Cached version is read only if updated within cache lifetime
             if cache_d and not self.force_refresh and cache_d.version != NO_VERSION:
-                now = datetime.now()
-                if now - timedelta(hours=self.config.cache_lifetime) <= cache_d.updated <= now:
-                    cache_d.source = classmap.get(provider)(upstream_info, token=token)
-                    cache_d.updated = now
-                    tool.versions.append(cache_d)
-                    self.logger.debug(
-                        f"Using cached upstream version info for tool {tool.name:<{40}}"
-                    )
-                    continue
+                cache_d.source = classmap.get(provider)(upstream_info, token=token, policy=self.http_policy)
+                cache_d.updated = datetime.now()
+                tool.versions.append(cache_d)
+                self.logger.debug(
+                    f"Using cached upstream version info for tool {tool.name:<{40}}"
+                )
+                continue
 
             self.logger.info(
                 f"Fetching origin version information from provider {upstream_info.get('provider')}"
                 f" for tool {tool.name:<{40}}"
             )
-            upstream_info = classmap.get(provider)(upstream_info, token=token)
+            upstream_info = classmap.get(provider)(upstream_info, token=token, policy=self.http_policy)
             updated = datetime.now()
             ver_obj = VersionInfo(
                 upstream_info.get_version(),
@@ -112,42 +114,32 @@ class VersionMaintainer:
                 updated,
                 origin=upstream_info.origin,
             )
-            self.cache_write_queue.put((tool, ver_obj))
+            self.db_writer.put(functools.partial(self._write_upstream_version_data, tool, ver_obj))
             tool.versions.append(ver_obj)
 
     def _read_checker_cache(self, tool_name: str, provider: str, db: ToolDatabase = None) -> VersionInfo:
-        """Read version data of tool by provider from db"""
+        """Read latest version data of tool by provider from db, if updated within cache lifetime"""
         if not db:
             db = self.db
-        version = db.get_versions_by_tool(tool_name, [VersionType.UPSTREAM], provider=provider.lower(), latest=True)
+        version = db.get_versions_by_tool(tool_name, [VersionType.UPSTREAM], provider=provider.lower(), latest=True,
+                                          max_age=timedelta(hours=self.config.cache_lifetime))
         return version
 
-    def _write_upstream_version_data(self, tool: ToolInfo, data: VersionInfo, as_transaction: bool = True):
-        """Cache data of single provider of single tool"""
-        if as_transaction:
-            with self.db.transaction():
-                self.db.insert_version_info(tool, data)
-        else:
-            self.db.insert_version_info(tool, data)
-
-    def _write_cache_queue_into_db(self):
-        """Unable to write from multiple threads, write from here at once"""
-        # Rollback if any item from queue fails
-        with self.db.transaction():
-            while not self.cache_write_queue.empty():
-                tool, version = self.cache_write_queue.get()
-                self._write_upstream_version_data(tool, version, False)
+    @staticmethod
+    def _write_upstream_version_data(tool: ToolInfo, data: VersionInfo, db: ToolDatabase):
+        """Cache data of single provider of single tool, in the writer thread"""
+        db.insert_version_info(tool, data)
 
     def get_versions_single_tool(
             self, tool_name: str, local_tool: ToolInfo, remote_tool: ToolInfo
     ) -> Tuple[ToolInfo, ToolInfo]:
 
-        if remote_tool:
-            self._set_single_tool_upstream_versions(remote_tool)
-        else:
-            self._set_single_tool_upstream_versions(local_tool)
-        # Write changes of upstream versions into db at once
-        self._write_cache_queue_into_db()
+        # Changes of upstream versions are committed when leaving
+        with DatabaseWriter(self.config) as self.db_writer:
+            if remote_tool:
+                self._set_single_tool_upstream_versions(remote_tool)
+            else:
+                self._set_single_tool_upstream_versions(local_tool)
 
         return local_tool, remote_tool
 
@@ -156,27 +148,33 @@ class VersionMaintainer:
         Checks for available versions in upstream
         """
         tasks = []
-        with ThreadPoolExecutor(max_workers=self.config.max_workers) as executor:
-            for t in tools:
-                # Basename is needed - version check works with different registries
-                tool = tools.get(t)
-                loop = asyncio.get_event_loop()
-                tasks.append(
-                    loop.run_in_executor(
-                        executor,
-                        self._set_single_tool_upstream_versions,
-                        *(tool, True),
-                    )
-                )
-            if tasks:
-                for _ in await asyncio.gather(*tasks):
-                    pass
-                # Sqlite is not good when multi-thread writing - use queue
-                self._write_cache_queue_into_db()
-            else:
-                self.logger.warning(
-                    "No known methods to get updates for any of the local tools."
-                )
+        try:
+            # Sqlite is not good when multi-thread writing - single writer commits versions while checking
+            # Queued versions are committed in the executor when leaving, not blocking the event loop
+            async with DatabaseWriter(self.config) as self.db_writer:
+                with ThreadPoolExecutor(max_workers=self.config.max_workers) as executor:
+                    for t in tools:
+                        # Basename is needed - version check works with different registries
+                        tool = tools.get(t)
+                        loop = asyncio.get_event_loop()
+                        tasks.append(
+                            loop.run_in_executor(
+                                executor,
+                                self._set_single_tool_upstream_versions,
+                                *(tool, True),
+                            )
+                        )
+                    if tasks:
+                        await asyncio.gather(*tasks)
+                        if self.http_policy.summary():
+                            self.logger.info(self.http_policy.summary())
+                    else:
+                        self.logger.warning(
+                            "No known methods to get updates for any of the local tools."
+                        )
+        finally:
+            # Worker threads are finished
+            self.db_pool.close()
         return tools
 
     async def list_versions_single(
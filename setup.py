@@ -17,6 +17,7 @@ setup(
     url="https://gitlab.com/cincan/cincan-registry",
     packages=find_packages(),
     install_requires=["docker>=4.4.1", "python-gitlab>=2.7.1", "pyyaml", "requests"],
+    extras_require={"http2": ["httpx[http2]>=0.20"]},
     classifiers=[
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: MIT License",
@@ -0,0 +1,241 @@
+"""
+Benchmarks of the remote refresh pipeline: RemoteRegistry.update_tools_in_parallel (through get_tools)
+and ToolRegistry.list_versions, against replayed responses of synthetic namespace of the stand-in registry.
+
+Every case runs in a fresh process with empty database, first 'cold' (everything fetched) and then
+'warm' (listing only, nothing changed). Reported are wall time, requests, bytes of response bodies,
+peak RSS of the process and time spent in SQLite write transactions.
+
+Run from the repository root, e.g.
+
+    python -m tests.benchmarks.refresh                       # 50, 500 and 5000 tools, compared to baseline
+    python -m tests.benchmarks.refresh --tools 500 --save    # update baseline of given cases
+
+Requests and bytes are deterministic and must match the baseline exactly. Times and memory depend on the
+machine, increase by more than 'tolerance' is reported as regression.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import pathlib
+import resource
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import Dict, List
+
+from cincanregistry.configuration import Configuration, Remotes
+from cincanregistry.database import ToolDatabase
+from cincanregistry.remotes import DockerHubRegistry, QuayRegistry
+from cincanregistry.stand_in import SyntheticNamespace
+from cincanregistry.toolregistry import ToolRegistry
+from cincanregistry.transport import BACKEND_HTTPX, BACKEND_REQUESTS
+from .replay import Replay
+
+SCALES = (50, 500, 5000)
+SCENARIOS = ("update_tools", "list_versions")
+REGISTRIES = {"dockerhub": Remotes.DOCKERHUB, "quay": Remotes.QUAY}
+BASELINE = pathlib.Path(__file__).parent / "baseline.json"
+TAGS = 5
+# Relative increase of wall time, peak RSS or SQLite write time reported as regression
+TOLERANCE = 0.5
+# Metrics compared to baseline, exact ones must not change at all
+EXACT_METRICS = ("requests", "bytes")
+MEASURED_METRICS = ("wall_time", "peak_rss_mb", "db_write_time")
+
+
+class WriteTimer:
+    """Accumulates time spent inside ToolDatabase.transaction() blocks of every database instance"""
+
+    def __init__(self):
+        self.elapsed: float = 0.0
+        self.transactions: int = 0
+
+    @contextmanager
+    def installed(self):
+        original = ToolDatabase.transaction
+        timer = self
+
+        @contextmanager
+        def timed(db):
+            start = time.perf_counter()
+            try:
+                with original(db):
+                    yield
+            finally:
+                timer.elapsed += time.perf_counter() - start
+                timer.transactions += 1
+
+        ToolDatabase.transaction = timed
+        try:
+            yield self
+        finally:
+            ToolDatabase.transaction = original
+
+
+def _peak_rss_mb() -> float:
+    # Kilobytes on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _configuration(workdir: pathlib.Path, registry: str, backend: str, url: str) -> Configuration:
+    config = Configuration(config_path=workdir / "registry.yaml")
+    config.tool_db = workdir / "tools.sqlite"
+    config.blob_cache = workdir / "blobs"
+    config.token_cache = workdir / "tokens.json"
+    config.registry = REGISTRIES[registry]
+    config.registry_url = url
+    config.http_backend = backend
+    return config
+
+
+async def _update_tools(config: Configuration, replay: Replay):
+    remote = DockerHubRegistry(configuration=config) if config.registry == Remotes.DOCKERHUB \
+        else QuayRegistry(configuration=config)
+    replay.install(remote)
+    try:
+        return await remote.get_tools()
+    finally:
+        await replay.uninstall(remote)
+
+
+async def _list_versions(config: Configuration, replay: Replay):
+    reg = ToolRegistry(configuration=config, default_remote=config.registry, silent=True)
+    replay.install(reg.remote_registry)
+    try:
+        return await reg.list_versions()
+    finally:
+        await replay.uninstall(reg.remote_registry)
+
+
+def run_case(registry: str, backend: str, scenario: str, tools: int, tags: int = TAGS,
+             latency: float = 0.0) -> List[Dict]:
+    """Cold and warm run of single case, results as rows. Intended to be run in own process."""
+    run = _update_tools if scenario == "update_tools" else _list_versions
+    replay = Replay.unbound(SyntheticNamespace(tools=tools, tags=tags), latency)
+    rows = []
+    logging.disable(logging.WARNING)
+    try:
+        with tempfile.TemporaryDirectory() as tmp, WriteTimer().installed() as timer:
+            config = _configuration(pathlib.Path(tmp), registry, backend, replay.url)
+            for state in ("cold", "warm"):
+                requests_before, bytes_before = sum(replay.requests.values()), replay.bytes
+                written_before = timer.elapsed
+                loop = asyncio.new_event_loop()
+                asyncio.set_event_loop(loop)
+                start = time.perf_counter()
+                try:
+                    result = loop.run_until_complete(run(config, replay))
+                finally:
+                    loop.close()
+                wall = time.perf_counter() - start
+                if len(result) != tools:
+                    raise RuntimeError(f"Expected {tools} tools, got {len(result)}")
+                rows.append({
+                    "registry": registry, "backend": backend, "scenario": scenario, "tools": tools, "state": state,
+                    "wall_time": round(wall, 3),
+                    "requests": sum(replay.requests.values()) - requests_before,
+                    "bytes": replay.bytes - bytes_before,
+                    "peak_rss_mb": _peak_rss_mb(),
+                    "db_write_time": round(timer.elapsed - written_before, 3),
+                })
+    finally:
+        logging.disable(logging.NOTSET)
+    return rows
+
+
+def case_key(row: Dict) -> str:
+    return f"{row['registry']}/{row['backend']}/{row['scenario']}/{row['tools']}/{row['state']}"
+
+
+def compare(rows: List[Dict], baseline: Dict[str, Dict], tolerance: float = TOLERANCE) -> List[str]:
+    """Regressions of rows compared to baseline, as text"""
+    regressions = []
+    for row in rows:
+        base = baseline.get(case_key(row))
+        if not base:
+            continue
+        for metric in EXACT_METRICS:
+            if row[metric] != base[metric]:
+                regressions.append(f"{case_key(row)}: {metric} {base[metric]} -> {row[metric]}")
+        for metric in MEASURED_METRICS:
+            # Small absolute values are mostly noise
+            if row[metric] > base[metric] * (1 + tolerance) and row[metric] - base[metric] > 0.05:
+                regressions.append(f"{case_key(row)}: {metric} {base[metric]} -> {row[metric]}")
+    return regressions
+
+
+HEADER = f"{'case':<44} {'wall s':>8} {'requests':>9} {'bytes':>11} {'rss MB':>7} {'db s':>7} {'base s':>7}"
+
+
+def format_row(row: Dict, baseline: Dict[str, Dict]) -> str:
+    base = baseline.get(case_key(row), {}).get("wall_time", "-")
+    return f"{case_key(row):<44} {row['wall_time']:>8.3f} {row['requests']:>9} {row['bytes']:>11} " \
+           f"{row['peak_rss_mb']:>7.1f} {row['db_write_time']:>7.3f} {base:>7}"
+
+
+def load_baseline(path: pathlib.Path = BASELINE) -> Dict[str, Dict]:
+    if not path.is_file():
+        return {}
+    with path.open("r") as f:
+        return json.load(f)
+
+
+def save_baseline(rows: List[Dict], path: pathlib.Path = BASELINE):
+    baseline = load_baseline(path)
+    for row in rows:
+        baseline[case_key(row)] = {k: row[k] for k in EXACT_METRICS + MEASURED_METRICS}
+    with path.open("w") as f:
+        json.dump(dict(sorted(baseline.items())), f, indent=2)
+        f.write("\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark refresh of remote tools against replayed registry.")
+    parser.add_argument("--tools", type=int, nargs="+", default=list(SCALES), help="Namespace sizes.")
+    parser.add_argument("--tags", type=int, default=TAGS, help="Version tags of each tool.")
+    parser.add_argument("--registry", choices=sorted(REGISTRIES), nargs="+", default=["dockerhub", "quay"])
+    parser.add_argument("--backend", choices=[BACKEND_HTTPX, BACKEND_REQUESTS], nargs="+",
+                        default=[BACKEND_HTTPX, BACKEND_REQUESTS])
+    parser.add_argument("--scenario", choices=SCENARIOS, nargs="+", default=list(SCENARIOS))
+    parser.add_argument("--latency", type=float, default=0.0, help="Latency of every request, in seconds.")
+    parser.add_argument("--save", action="store_true", help="Store results as baseline.")
+    parser.add_argument("--baseline", type=pathlib.Path, default=BASELINE)
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    args = parser.parse_args()
+
+    baseline = load_baseline(args.baseline)
+    rows = []
+    print(HEADER)
+    print("-" * len(HEADER))
+    # Spawned process for every case, peak RSS is not carried over from earlier cases
+    context = multiprocessing.get_context("spawn")
+    for tools in args.tools:
+        for registry in args.registry:
+            for backend in args.backend:
+                for scenario in args.scenario:
+                    with context.Pool(1) as pool:
+                        case_rows = pool.apply(run_case, (registry, backend, scenario, tools, args.tags,
+                                                          args.latency))
+                    for row in case_rows:
+                        print(format_row(row, baseline), flush=True)
+                    rows.extend(case_rows)
+    if args.save:
+        save_baseline(rows, args.baseline)
+        print(f"Baseline saved into {args.baseline}")
+        return
+    # Latency and namespace shape change the results, comparing makes sense only with defaults
+    if args.tags != TAGS or args.latency:
+        return
+    regressions = compare(rows, baseline, args.tolerance)
+    for r in regressions:
+        print(f"Regression: {r}")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
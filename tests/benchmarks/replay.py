@@ -0,0 +1,101 @@
+"""
+Replayed HTTP transport for benchmarks: responses of the stand-in registry are served in-process,
+without sockets, to either backend of the remote registry.
+"""
+import asyncio
+import io
+import threading
+import time
+from collections import Counter
+from urllib.parse import parse_qs
+
+import httpx
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+from cincanregistry.remotes._remote_registry import RemoteRegistry
+from cincanregistry.stand_in import StandInRegistry
+from cincanregistry.transport import HttpxTransport, RequestsTransport
+
+# Not resolved nor connected, every request is answered by the replay
+REPLAY_HOST = "stand-in.test"
+
+
+class Replay:
+    """
+    Answers requests with StandInRegistry.respond(), counting requests by endpoint kind and
+    bytes of response bodies. 'latency' seconds are waited for every request, asynchronously
+    for httpx and in the worker thread for requests.
+    """
+
+    def __init__(self, server: StandInRegistry, latency: float = 0.0):
+        self.server: StandInRegistry = server
+        self.latency: float = latency
+        self.requests: Counter = Counter()
+        self.bytes: int = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def unbound(cls, namespace, latency: float = 0.0) -> "Replay":
+        return cls(StandInRegistry(namespace, host=REPLAY_HOST, port=80, bind=False), latency)
+
+    @property
+    def url(self) -> str:
+        return self.server.url
+
+    def respond(self, method: str, path: str, query: str, headers):
+        kind, status, response_headers, body = self.server.respond(method, path, parse_qs(query), headers)
+        if method == "HEAD":
+            response_headers.setdefault("Content-Length", str(len(body)))
+            body = b""
+        with self._lock:
+            self.requests[kind] += 1
+            self.bytes += len(body)
+        return status, response_headers, body
+
+    async def handle_httpx(self, request: httpx.Request) -> httpx.Response:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        status, headers, body = self.respond(request.method, request.url.path, request.url.query.decode(),
+                                             request.headers)
+        return httpx.Response(status, headers=headers, content=body)
+
+    def install(self, registry: RemoteRegistry):
+        """Route requests of the registry transport into this replay, must be called on the running loop"""
+        transport = registry.transport
+        if isinstance(transport, HttpxTransport):
+            transport._loop = asyncio.get_event_loop()
+            transport._client = httpx.AsyncClient(transport=httpx.MockTransport(self.handle_httpx))
+        elif isinstance(transport, RequestsTransport):
+            transport.session.mount("http://", ReplayAdapter(self))
+
+    @staticmethod
+    async def uninstall(registry: RemoteRegistry):
+        """Close the replaying client before its event loop is closed"""
+        await registry.transport.aclose()
+
+
+class ReplayAdapter(BaseAdapter):
+    """Requests adapter answering from Replay"""
+
+    def __init__(self, replay: Replay):
+        super().__init__()
+        self.replay: Replay = replay
+
+    def send(self, request, **kwargs):
+        if self.replay.latency:
+            time.sleep(self.replay.latency)
+        path, _, query = request.path_url.partition("?")
+        status, headers, body = self.replay.respond(request.method, path, query, request.headers)
+        resp = requests.Response()
+        resp.status_code = status
+        resp.headers = CaseInsensitiveDict(headers)
+        resp.raw = io.BytesIO(body)
+        resp.url = request.url
+        resp.request = request
+        resp.encoding = "utf-8"
+        return resp
+
+    def close(self):
+        pass
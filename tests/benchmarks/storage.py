@@ -0,0 +1,110 @@
+"""
+Benchmarks of bulk insert and load of the tool database with different SQLite connection profiles.
+
+Synthetic tools with remote versions are inserted at once in single transaction and tool by tool, each
+in own transaction as tools are updated from registry, and then loaded (all tools and tools by tag).
+Profile 'sqlite' is the state before the connection profile was applied on every open: defaults of
+SQLite, rollback journal and full synchronous commits.
+
+Run from the repository root, e.g.
+
+    python -m tests.benchmarks.storage                         # 5000 tools, both profiles
+    python -m tests.benchmarks.storage --tools 500 --profile configured
+"""
+import argparse
+import datetime
+import pathlib
+import tempfile
+import time
+from typing import Dict, List
+
+from cincanregistry import ToolInfo, VersionInfo, VersionType
+from cincanregistry.configuration import Configuration
+from cincanregistry.database import ToolDatabase
+
+LOCATION = "Quay"
+TAGS = 5
+PROFILES = {
+    "sqlite": {"db_journal_mode": "delete", "db_synchronous": "full", "db_mmap_size": 0, "db_cache_size": -2000,
+               "db_temp_store": "default"},
+    # Defaults of Configuration
+    "configured": {},
+}
+OPERATIONS = ("insert_bulk", "insert_per_tool", "load", "load_tag")
+
+
+def synthetic_tools(tools: int, tags: int = TAGS) -> List[ToolInfo]:
+    """Tools with remote versions, latest version has 'latest' tag"""
+    start = datetime.datetime(2021, 1, 1)
+    result = []
+    for i in range(tools):
+        tool = ToolInfo(f"cincan/tool-{i}", start + datetime.timedelta(minutes=i), LOCATION, description=f"Tool {i}")
+        tool.versions = [VersionInfo(f"1.{j}", VersionType.REMOTE, LOCATION,
+                                     {f"1.{j}", "latest"} if j == tags - 1 else {f"1.{j}"},
+                                     start + datetime.timedelta(minutes=i, seconds=j), size=1000 * (j + 1))
+                         for j in range(tags)]
+        result.append(tool)
+    return result
+
+
+def _database(workdir: pathlib.Path, name: str, profile: Dict) -> ToolDatabase:
+    config = Configuration(config_path=workdir / "registry.yaml")
+    config.tool_db = workdir / f"{name}.sqlite"
+    for k, v in profile.items():
+        setattr(config, k, v)
+    return ToolDatabase(config)
+
+
+def run_case(profile: str, tools: int, tags: int = TAGS) -> Dict:
+    """Seconds of each operation with the profile"""
+    data = synthetic_tools(tools, tags)
+    row = {"profile": profile, "tools": tools}
+    with tempfile.TemporaryDirectory() as tmp:
+        db = _database(pathlib.Path(tmp), "bulk", PROFILES[profile])
+        start = time.perf_counter()
+        with db.transaction():
+            db.insert_tool_info(data)
+        row["insert_bulk"] = time.perf_counter() - start
+
+        per_tool = _database(pathlib.Path(tmp), "per_tool", PROFILES[profile])
+        start = time.perf_counter()
+        for tool in data:
+            with per_tool.transaction():
+                per_tool.insert_tool_info(tool)
+        row["insert_per_tool"] = time.perf_counter() - start
+        per_tool.close()
+
+        start = time.perf_counter()
+        loaded = db.get_tools(LOCATION, [VersionType.REMOTE])
+        row["load"] = time.perf_counter() - start
+        start = time.perf_counter()
+        tagged = db.get_tools(LOCATION, [VersionType.REMOTE], tag="latest")
+        row["load_tag"] = time.perf_counter() - start
+        db.close()
+    if len(loaded) != tools or len(tagged) != tools:
+        raise RuntimeError(f"Expected {tools} tools, got {len(loaded)} and {len(tagged)} by tag")
+    return row
+
+
+HEADER = f"{'profile':<12} {'tools':>6} " + " ".join(f"{o + ' s':>17}" for o in OPERATIONS)
+
+
+def format_row(row: Dict) -> str:
+    return f"{row['profile']:<12} {row['tools']:>6} " + " ".join(f"{row[o]:>17.3f}" for o in OPERATIONS)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark bulk insert and load of the tool database.")
+    parser.add_argument("--tools", type=int, nargs="+", default=[5000], help="Amounts of tools.")
+    parser.add_argument("--tags", type=int, default=TAGS, help="Versions of each tool.")
+    parser.add_argument("--profile", choices=sorted(PROFILES), nargs="+", default=list(PROFILES))
+    args = parser.parse_args()
+    print(HEADER)
+    print("-" * len(HEADER))
+    for tools in args.tools:
+        for profile in args.profile:
+            print(format_row(run_case(profile, tools, args.tags)), flush=True)
+
+
+if __name__ == "__main__":
+    main()
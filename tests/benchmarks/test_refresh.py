@@ -0,0 +1,32 @@
+import pytest
+
+from .refresh import case_key, compare, load_baseline, run_case, save_baseline
+
+
+@pytest.mark.parametrize("registry,backend,scenario", [
+    ("dockerhub", "httpx", "update_tools"),
+    ("quay", "requests", "list_versions"),
+])
+def test_run_case(registry, backend, scenario):
+    cold, warm = run_case(registry, backend, scenario, tools=10, tags=2)
+    # Ping, token, listing, tags of each tool, 2 manifests and 2 configs each, and shared meta layer
+    assert cold["requests"] == 3 + 10 + 10 * 4 + 1
+    assert cold["bytes"] > 0 and cold["peak_rss_mb"] > 0
+    # Only the listing again, nothing is written. Times are not compared, they vary with the load of the host
+    assert warm["requests"] == 2
+    assert warm["bytes"] < cold["bytes"]
+
+
+def test_baseline(tmp_path):
+    row = {"registry": "quay", "backend": "httpx", "scenario": "update_tools", "tools": 50, "state": "cold",
+           "wall_time": 1.0, "requests": 556, "bytes": 1000, "peak_rss_mb": 50.0, "db_write_time": 0.01}
+    path = tmp_path / "baseline.json"
+    save_baseline([row], path)
+    assert load_baseline(path) == {case_key(row): {"requests": 556, "bytes": 1000, "wall_time": 1.0,
+                                                   "peak_rss_mb": 50.0, "db_write_time": 0.01}}
+    baseline = load_baseline(path)
+    assert compare([dict(row, wall_time=1.4, db_write_time=0.05)], baseline) == []
+    assert compare([dict(row, wall_time=1.6, requests=557)], baseline) == [
+        "quay/httpx/update_tools/50/cold: requests 556 -> 557",
+        "quay/httpx/update_tools/50/cold: wall_time 1.0 -> 1.6",
+    ]
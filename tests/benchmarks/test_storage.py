@@ -0,0 +1,10 @@
+import pytest
+
+from .storage import OPERATIONS, PROFILES, run_case
+
+
+@pytest.mark.parametrize("profile", sorted(PROFILES))
+def test_run_case(profile):
+    row = run_case(profile, tools=20, tags=2)
+    assert row["profile"] == profile and row["tools"] == 20
+    assert all(row[o] > 0 for o in OPERATIONS)
@@ -1,7 +1,10 @@
 from cincanregistry.configuration import Configuration
+from cincanregistry.transport import HttpxTransport
+import asyncio
 import pathlib
 import shutil
 
+import httpx
 import pytest
 
 
@@ -12,9 +15,53 @@ def config(tmp_path):
     conf = Configuration(config_path=config_path)
     db_path = tmp_path / "test_db.sqlite"
     conf.tool_db = db_path
+    conf.blob_cache = tmp_path / "blobs"
+    conf.token_cache = tmp_path / "tokens.json"
     yield conf
 
 
+@pytest.fixture(scope="function")
+def loop():
+    """Fresh event loop for running coroutines of the test"""
+    event_loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(event_loop)
+    yield event_loop
+    event_loop.close()
+
+
+@pytest.fixture(scope="function")
+def mock_transport(loop):
+    """
+    Route requests of registry (or its httpx transport) into handler function, bypassing network.
+    Client is bound to the event loop of the test, and closed before the loop.
+    """
+    clients = []
+
+    def install(target, handler) -> HttpxTransport:
+        transport = getattr(target, "transport", target)
+        transport._loop = loop
+        transport._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        clients.append(transport._client)
+        return transport
+
+    yield install
+    for client in clients:
+        loop.run_until_complete(client.aclose())
+
+
+@pytest.fixture(scope="function")
+def patch_transport(mocker):
+    """Make every request of the registry transport return given response"""
+
+    def patch(reg, response):
+        async def fake_request(*args, **kwargs):
+            return response
+
+        mocker.patch.object(reg.transport, "request", side_effect=fake_request)
+
+    return patch
+
+
 @pytest.fixture(scope="session", autouse=True)
 def delete_temporary_files(request, tmp_path_factory):
     """Cleanup a testing directory once we are finished."""
@@ -12,8 +12,15 @@
 #     checker = GitHubChecker()
 
 #     return
+import base64
+import hashlib
+import io
+import json
+import os
+import tarfile
 import docker
-from datetime import datetime
+import httpx
+from datetime import datetime, timezone
 from unittest import mock
 from cincanregistry.checkers import UpstreamChecker
 from cincanregistry import VersionType
@@ -274,3 +281,154 @@ GITLAB_FAKE_META_DICT = {
     "last_commit_id": "356d07c779bd09482ddf2d4078b81fabc97e2f2d",
     "content": "ewogICJ1cHN0cmVhbXMiOiBbCiAgICB7CiAgICAgICJ1cmkiOiAiaHR0cHM6Ly9naXRodWIuY29tL3JhZGFyZW9yZy9yYWRhcmUyLyIsCiAgICAgICJyZXBvc2l0b3J5IjogInJhZGFyZW9yZyIsCiAgICAgICJ0b29sIjogInJhZGFyZTIiLAogICAgICAicHJvdmlkZXIiOiAiR2l0SHViIiwKICAgICAgIm1ldGhvZCI6ICJyZWxlYXNlIiwKICAgICAgIm9yaWdpbiI6IHRydWUsCiAgICAgICJkb2NrZXJfb3JpZ2luIjogdHJ1ZQogICAgfQogIF0KfQo=",
 }
+
+
+class FakeRegistryV2:
+    """
+    Minimal in-memory Docker Registry HTTP API V2 for httpx.MockTransport.
+    Tags are mapped into image versions, images with same version share manifest and config.
+    Quay and Docker Hub API listings of 'repositories' (all sharing the tags) are included, paginated by
+    'quay_page_size' and 'hub_page_size'. Quay listings have ETag validators.
+    """
+
+    def __init__(self, tags: dict, meta_file: dict = None, name: str = "test", padding: int = 0):
+        self.name = name
+        self.repositories = [name]
+        self.hub_page_size = 100
+        self.quay_page_size = 100
+        self.blobs = {}
+        self.manifests = {}
+        self.tags = {}
+        self.requests = []
+        self.last_modified = 1590000000
+        meta = json.dumps(meta_file or {"upstreams": []}).encode()
+        buf = io.BytesIO()
+        with tarfile.open(fileobj=buf, mode="w:gz") as tar:
+            if padding:
+                # Incompressible file before meta file
+                info = tarfile.TarInfo("padding")
+                info.size = padding
+                tar.addfile(info, io.BytesIO(os.urandom(padding)))
+            info = tarfile.TarInfo("meta.json")
+            info.size = len(meta)
+            tar.addfile(info, io.BytesIO(meta))
+        self.meta_layer = self._add(self.blobs, buf.getvalue())
+        for tag, version in tags.items():
+            self.set_tag(tag, version)
+
+    @staticmethod
+    def _add(store: dict, data: bytes) -> str:
+        digest = f"sha256:{hashlib.sha256(data).hexdigest()}"
+        store[digest] = data
+        return digest
+
+    def _image(self, version: str, platform: str = "linux/amd64") -> str:
+        """Add image manifest with config, returns digest of manifest"""
+        os_name, architecture, *variant = platform.split("/")
+        config = {"created": "2020-05-23T19:43:14Z", "architecture": architecture, "os": os_name,
+                  "rootfs": {"type": "layers"}, "config": {"Env": [f"TOOL_VERSION={version}"]}}
+        if variant:
+            config["variant"] = variant[0]
+        config = json.dumps(config).encode()
+        config_digest = self._add(self.blobs, config)
+        manifest = json.dumps({
+            "schemaVersion": 2,
+            "mediaType": "application/vnd.docker.distribution.manifest.v2+json",
+            "config": {"mediaType": "application/vnd.docker.container.image.v1+json", "size": len(config),
+                       "digest": config_digest},
+            "layers": [{"mediaType": "application/vnd.docker.image.rootfs.diff.tar.gzip",
+                        "size": len(self.blobs[self.meta_layer]), "digest": self.meta_layer}],
+        }).encode()
+        return self._add(self.manifests, manifest)
+
+    def set_tag(self, tag: str, version: str, platforms: dict = None):
+        """
+        Point tag into image of given version. With platforms, as platform: version,
+        tag points into manifest list of those images.
+        """
+        if not platforms:
+            self.tags[tag] = self._image(version)
+        else:
+            entries = []
+            for platform, platform_version in platforms.items():
+                os_name, architecture, *variant = platform.split("/")
+                digest = self._image(platform_version, platform)
+                entry = {"mediaType": "application/vnd.docker.distribution.manifest.v2+json",
+                         "size": len(self.manifests[digest]), "digest": digest,
+                         "platform": {"architecture": architecture, "os": os_name}}
+                if variant:
+                    entry["platform"]["variant"] = variant[0]
+                entries.append(entry)
+            manifest_list = json.dumps({
+                "schemaVersion": 2,
+                "mediaType": "application/vnd.docker.distribution.manifest.list.v2+json",
+                "manifests": entries,
+            }).encode()
+            self.tags[tag] = self._add(self.manifests, manifest_list)
+        self.last_modified += 1
+
+    def _listing(self, request, content: dict):
+        """JSON response with ETag, 304 if matches with If-None-Match"""
+        body = json.dumps(content).encode()
+        etag = f'"{hashlib.sha256(body).hexdigest()[:16]}"'
+        if request.headers.get("If-None-Match") == etag:
+            return httpx.Response(304, headers={"ETag": etag})
+        return httpx.Response(200, content=body, headers={"ETag": etag, "Content-Type": "application/json"})
+
+    def _hub_page(self, request, results: list):
+        """Page of Docker Hub listing, 'next' is set when more pages remain"""
+        size = min(int(request.url.params.get("page_size", 10)), self.hub_page_size)
+        page = int(request.url.params.get("page", 1))
+        more = page * size < len(results)
+        return httpx.Response(200, json={
+            "count": len(results),
+            "next": str(request.url.copy_merge_params({"page": page + 1})) if more else None,
+            "results": results[(page - 1) * size:page * size],
+        })
+
+    def handler(self, request):
+        self.requests.append((request.method, request.url.path))
+        path = request.url.path
+        if path == "/v2/repositories/cincan/":
+            updated = datetime.fromtimestamp(self.last_modified, timezone.utc).isoformat()
+            return self._hub_page(request, [{"namespace": "cincan", "name": r, "last_updated": updated,
+                                             "description": ""} for r in self.repositories])
+        if path.startswith("/v2/repositories/cincan/") and path.endswith("/tags"):
+            updated = datetime.fromtimestamp(self.last_modified, timezone.utc).isoformat()
+            return self._hub_page(request, [{"name": t, "digest": d, "last_updated": updated}
+                                            for t, d in self.tags.items()])
+        if path == "/api/v1/repository":
+            start = int(request.url.params.get("next_page", 0))
+            end = start + self.quay_page_size
+            content = {"repositories": [
+                {"namespace": "cincan", "name": r, "last_modified": self.last_modified, "description": ""}
+                for r in self.repositories[start:end]
+            ]}
+            if end < len(self.repositories):
+                content["next_page"] = str(end)
+            return self._listing(request, content)
+        if path.startswith("/api/v1/repository/cincan/") and path.split("/")[-1] in self.repositories:
+            return self._listing(request, {"tags": {
+                t: {"name": t, "manifest_digest": d, "last_modified": self.last_modified} for t, d in self.tags.items()
+            }})
+        if path == "/v2/":
+            return httpx.Response(401, headers={"www-authenticate": 'Bearer realm="https://fake/token",service="fake"'})
+        if path == "/token":
+            # Unsigned JWT granting all requested scopes
+            access = [{"type": "repository", "name": scope.split(":")[1], "actions": ["pull"]}
+                      for scope in request.url.params.get_list("scope")]
+            payload = base64.urlsafe_b64encode(json.dumps({"access": access}).encode()).decode().rstrip("=")
+            return httpx.Response(200, json={"token": f"e30.{payload}.", "expires_in": 300})
+        if "/manifests/" in path:
+            reference = path.split("/manifests/")[1]
+            digest = self.tags.get(reference, reference)
+            if digest not in self.manifests:
+                return httpx.Response(404, json={"errors": []})
+            body = self.manifests[digest] if request.method == "GET" else b""
+            return httpx.Response(200, content=body, headers={"Docker-Content-Digest": digest})
+        if "/blobs/" in path:
+            return httpx.Response(200, content=self.blobs[path.split("/blobs/")[1]])
+        return httpx.Response(404, json={"errors": []})
+
+    def count(self, method: str, part: str) -> int:
+        return len([r for r in self.requests if r[0] == method and part in r[1]])
@@ -0,0 +1,55 @@
+import hashlib
+import os
+
+from cincanregistry.blob_cache import BlobCache
+
+
+def _digest(data: bytes) -> str:
+    return f"sha256:{hashlib.sha256(data).hexdigest()}"
+
+
+def test_put_and_get(tmp_path):
+    cache = BlobCache(tmp_path / "blobs", 1000)
+    data = b'{"architecture": "amd64"}'
+    digest = _digest(data)
+    assert cache.get(digest) is None
+    assert cache.put(digest, data)
+    assert (tmp_path / "blobs" / "sha256" / digest[7:9] / digest[7:]).is_file()
+    assert cache.get(digest) == data
+    assert (cache.hits, cache.misses) == (1, 1)
+    # Content must match the digest
+    assert not cache.put(_digest(b"other"), data)
+    # Only sha256 digests are supported
+    assert not cache.put("md5:abcd", data)
+    assert cache.get("sha256:../../etc/passwd") is None
+
+
+def test_corrupted_blob_removed(tmp_path, caplog):
+    cache = BlobCache(tmp_path / "blobs", 1000)
+    data = b"layer"
+    digest = _digest(data)
+    cache.put(digest, data)
+    path = tmp_path / "blobs" / "sha256" / digest[7:9] / digest[7:]
+    path.write_bytes(b"tampered")
+    assert cache.get(digest) is None
+    assert not path.exists()
+    logs = [l.message for l in caplog.records]
+    assert logs == [f"Cached blob {digest} is corrupted, removing it."]
+
+
+def test_lru_eviction(tmp_path):
+    cache = BlobCache(tmp_path / "blobs", 250)
+    blobs = [bytes([i]) * 100 for i in range(3)]
+    digests = [_digest(b) for b in blobs]
+    cache.put(digests[0], blobs[0])
+    cache.put(digests[1], blobs[1])
+    # Mark first as older, then use it, second becomes least recently used
+    for d, t in zip(digests[:2], (1000, 2000)):
+        os.utime(str(tmp_path / "blobs" / "sha256" / d[7:9] / d[7:]), (t, t))
+    assert cache.get(digests[0]) == blobs[0]
+    cache.put(digests[2], blobs[2])
+    assert cache.get(digests[1]) is None
+    assert cache.get(digests[0]) == blobs[0]
+    assert cache.get(digests[2]) == blobs[2]
+    # Larger than whole cache is not stored
+    assert not cache.put(_digest(b"x" * 300), b"x" * 300)
@@ -1,15 +1,21 @@
 import logging
 import pathlib
+import re
 import shutil
 import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
-from datetime import datetime
+from datetime import datetime, timedelta
 
 import pytest
 
 from cincanregistry import VersionInfo, ToolInfo, VersionType
-from cincanregistry.checkers import UpstreamChecker
-from cincanregistry.database import ToolDatabase
+from cincanregistry.checkers import UpstreamChecker, classmap
+from cincanregistry import database
+from cincanregistry.database import SCHEMA_VERSION, ConnectionPool, DatabaseWriter, ToolDatabase
+from cincanregistry.remotes._remote_registry import PendingWrites, RemoteRegistry
+from cincanregistry.utils import epoch_time, parse_epoch_time
 from .fake_instances import (
     FAKE_VERSION_INFO_NO_CHECKER,
     FAKE_VERSION_INFO_WITH_CHECKER,
@@ -56,6 +62,23 @@ def test_configure(config, caplog):
     assert config.tool_db.is_file()
 
 
+def test_connection_profile(config, caplog):
+    """Settings are applied when existing database is opened, invalid values are skipped"""
+    ToolDatabase(config).close()
+    config.db_synchronous = "off"
+    config.db_cache_size = -4096
+    config.db_temp_store = "memory; DROP TABLE tools"
+    test_db = ToolDatabase(config)
+    values = {}
+    for pragma in ("foreign_keys", "journal_mode", "synchronous", "cache_size", "temp_store", "busy_timeout"):
+        test_db.execute(f"PRAGMA {pragma}")
+        values[pragma] = test_db.cursor.fetchone()[0]
+    assert values == {"foreign_keys": 1, "journal_mode": "wal", "synchronous": 0, "cache_size": -4096,
+                      "temp_store": 0, "busy_timeout": 5000}
+    assert "Invalid value 'memory; DROP TABLE tools' for database setting 'temp_store', using default." in \
+           [r.message for r in caplog.records]
+
+
 def test_db_tool_data_insert(config, caplog):
     caplog.set_level(logging.DEBUG)
     test_db = ToolDatabase(config)
@@ -157,6 +180,19 @@ def test_get_tool_by_name_and_version_type(base_db, caplog):
     assert versions[0].version_type == VersionType.REMOTE
 
 
+def test_delete_remote_versions(base_db):
+    name, location = FAKE_TOOL_INFO.get("name"), FAKE_TOOL_INFO.get("location")
+    with base_db.transaction():
+        base_db.delete_remote_versions(name, location, ["0.9"])
+    assert len(base_db.get_versions_by_tool(name)) == 2
+    with base_db.transaction():
+        base_db.delete_remote_versions(name, location, ["1.0"])
+    # Only remote version of the tool is removed
+    versions = base_db.get_versions_by_tool(name)
+    assert [v.version_type for v in versions] == [VersionType.UPSTREAM]
+    assert len(base_db.get_versions_by_tool(FAKE_TOOL_INFO2.get("name"))) == 2
+
+
 def test_get_tool_by_remote(base_db, caplog):
     caplog.set_level(logging.DEBUG)
     tmp_tool = {
@@ -265,6 +301,285 @@ def test_failed_constraints_meta_data(caplog, base_db):
         assert len(tools[0].versions) == 2
 
 
+def test_bulk_load_tools(config):
+    """Tools, versions and their meta information are loaded with constant amount of queries"""
+    test_db = ToolDatabase(config)
+    with test_db.transaction():
+        for i in range(20):
+            tool = ToolInfo(f"tool_{i}", datetime(2020, 3, 13, 13, 37), "test_location")
+            conf = dict(FAKE_CHECKER_CONF, tool=tool.name, provider="GitHub")
+            test_db.insert_tool_info(tool)
+            test_db.insert_meta_info(tool.name, tool.location, conf)
+            checker = classmap["github"](conf, version="1.1")
+            test_db.insert_version_info(tool, VersionInfo("1.1", VersionType.UPSTREAM, checker, set()))
+            test_db.insert_version_info(tool, [VersionInfo(f"1.{v}", VersionType.REMOTE, "test_location", {"latest"})
+                                               for v in range(3)])
+    statements = []
+    test_db.db_conn.set_trace_callback(statements.append)
+    tools = test_db.get_tools(filter_by=[VersionType.REMOTE, VersionType.UPSTREAM])
+    test_db.db_conn.set_trace_callback(None)
+    assert len(statements) == 3
+    assert len(tools) == 20
+    for t in tools:
+        assert len(t.versions) == 4
+        upstream = [v for v in t.versions if v.version_type == VersionType.UPSTREAM]
+        assert isinstance(upstream[0].source, UpstreamChecker) and upstream[0].source.tool == t.name
+        # Same as loaded one by one
+        assert sorted((v.version, v.version_type.value, str(v.source)) for v in t.versions) == \
+               sorted((v.version, v.version_type.value, str(v.source)) for v in test_db.get_versions_by_tool(
+                   t.name, [VersionType.REMOTE, VersionType.UPSTREAM]))
+    statements.clear()
+    test_db.db_conn.set_trace_callback(statements.append)
+    assert len(test_db.get_single_tool("tool_3").versions) == 4
+    assert len(statements) == 3
+
+
+def test_bulk_meta_ids(config):
+    """Upstream versions of many tools are linked into their meta data with single query"""
+    test_db = ToolDatabase(config)
+    tools = []
+    with test_db.transaction():
+        for i in range(5):
+            tool = ToolInfo(f"tool_{i}", datetime(2020, 3, 13, 13, 37), "test_location")
+            test_db.insert_tool_info(tool)
+            for provider in ("GitHub", "GitLab"):
+                conf = dict(FAKE_CHECKER_CONF, tool=tool.name, provider=provider)
+                test_db.insert_meta_info(tool.name, tool.location, conf)
+                tool.versions.append(VersionInfo(f"1.{i}", VersionType.UPSTREAM,
+                                                 classmap[provider.lower()](conf, version=f"1.{i}"), set()))
+            tool.versions.append(VersionInfo(f"1.{i}", VersionType.REMOTE, "test_location", {"latest"}))
+            tools.append(tool)
+    statements = []
+    test_db.db_conn.set_trace_callback(statements.append)
+    with test_db.transaction():
+        test_db.insert_tool_info(tools)
+    test_db.db_conn.set_trace_callback(None)
+    assert len([s for s in statements if "FROM metadata" in s]) == 1
+    rows = test_db.db_conn.execute("SELECT v.tool_id, v.source, m.tool, m.provider FROM version_data v "
+                                   "LEFT JOIN metadata m ON m.meta_id = v.meta_id "
+                                   "WHERE v.version_type = 'upstream'").fetchall()
+    assert len(rows) == 10
+    assert all(r["tool_id"] == r["tool"] and r["source"] == r["provider"].lower() for r in rows)
+    # Remote versions have no meta data, tool without meta data has no meta ids
+    assert not test_db.db_conn.execute("SELECT COUNT(*) FROM version_data WHERE version_type = 'remote' "
+                                       "AND meta_id IS NOT NULL").fetchone()[0]
+    assert not test_db.get_meta_ids(["no_tool"])
+    meta_ids = test_db.get_meta_ids(["tool_1", "tool_1"])
+    assert meta_ids[("tool_1", "tool_1", "GitLab")] == test_db.get_meta_id("tool_1", tools[1].versions[1].source)
+    # Meta file written again on next refresh keeps the meta ids and the linked versions
+    meta_ids = test_db.get_meta_ids([t.name for t in tools])
+    writes = PendingWrites()
+    writes.meta_data = [(t.name, t.location, {"upstreams": [dict(FAKE_CHECKER_CONF, tool=t.name, provider=p)
+                                                             for p in ("GitHub", "GitLab")]}) for t in tools]
+    with test_db.transaction():
+        RemoteRegistry._write_pending(writes, test_db)
+    assert test_db.get_meta_ids([t.name for t in tools]) == meta_ids
+    assert test_db.db_conn.execute("SELECT COUNT(*) FROM version_data v JOIN metadata m ON m.meta_id = v.meta_id "
+                                   "WHERE v.version_type = 'upstream'").fetchone()[0] == 10
+
+
+def test_migrate(config, caplog):
+    """Database made before schema versions is upgraded when opened"""
+    caplog.set_level(logging.DEBUG)
+    test_db = ToolDatabase(config)
+    assert test_db.schema_version() == SCHEMA_VERSION
+    for name in ("idx_tools_location", "idx_version_data_type", "idx_metadata_checker", "idx_metadata_provider",
+                 "idx_tag_changes_tool"):
+        test_db.execute(f"DROP INDEX {name}")
+    test_db.execute("PRAGMA user_version = 0")
+    del test_db
+    test_db = ToolDatabase(config)
+    assert f"Database schema upgraded into version {SCHEMA_VERSION}." in [r.message for r in caplog.records]
+    assert test_db.schema_version() == SCHEMA_VERSION
+    test_db.execute("SELECT count(*) FROM sqlite_master WHERE type = 'index' AND name LIKE 'idx_%'")
+    assert test_db.cursor.fetchone()[0] == 6
+    # Newer schema is left as it is
+    test_db.execute(f"PRAGMA user_version = {SCHEMA_VERSION + 1}")
+    del test_db
+    assert ToolDatabase(config).schema_version() == SCHEMA_VERSION + 1
+
+
+def test_migrate_epoch_timestamps(config):
+    """Times stored as ISO8601 text are converted into epoch seconds"""
+    conn = sqlite3.connect(str(config.tool_db))
+    for statement in (database.c_tool, database.c_metadata, database.c_version_data, database.c_tag_digests,
+                      database.c_validators, database.c_tag_changes, database.c_tag_platforms):
+        conn.execute(re.sub(r"(updated|created|changed) INTEGER", r"\1 TEXT", statement))
+    conn.execute("INSERT INTO tools VALUES ('tool', '2020-03-13T13:37:00', 'location', '')")
+    conn.execute("INSERT INTO version_data(tool_id, tool_location, version, version_type, source, tags, updated, "
+                 "origin, created) VALUES ('tool', 'location', '1.0', 'remote', 'no_checker_case', 'latest', "
+                 "'2021-03-03T13:37:00', 0, '2021-03-04T00:00:00')")
+    conn.commit()
+    conn.close()
+    test_db = ToolDatabase(config)
+    assert test_db.schema_version() == SCHEMA_VERSION
+    tool = test_db.get_single_tool("tool")
+    assert tool.updated == datetime(2020, 3, 13, 13, 37)
+    assert tool.versions[0].updated == datetime(2021, 3, 3, 13, 37)
+    test_db.execute("SELECT typeof(updated), created FROM version_data")
+    assert tuple(test_db.cursor.fetchone()) == ("integer", epoch_time(datetime(2021, 3, 4)))
+    test_db.execute("PRAGMA table_info(tag_changes)")
+    assert [r["type"] for r in test_db.cursor.fetchall() if r["name"] == "changed"] == ["INTEGER"]
+    assert test_db.get_version_by_tag("tool", "latest").version == "1.0"
+    assert parse_epoch_time(epoch_time(datetime(1999, 12, 31, 23, 59, 59))) == datetime(1999, 12, 31, 23, 59, 59)
+
+
+def test_versions_by_age(base_db):
+    """Versions and tools are filtered by time in query"""
+    version = VersionInfo(**FAKE_VERSION_INFO_NO_CHECKER)
+    version.updated = datetime.now() - timedelta(minutes=30)
+    with base_db.transaction():
+        base_db.insert_version_info(ToolInfo(**FAKE_TOOL_INFO), version)
+    name = FAKE_TOOL_INFO.get("name")
+    assert base_db.get_versions_by_tool(name, latest=True, max_age=timedelta(hours=1)).version == version.version
+    assert base_db.get_versions_by_tool(name, latest=True, max_age=timedelta(minutes=10)) is None
+    assert [t.name for t in base_db.get_tools(by_time=FAKE_TOOL_INFO.get("updated"))] == [name]
+
+
+def test_explain_queries(base_db):
+    """Hot queries use indexes"""
+    plans = base_db.explain_queries()
+    assert "get_versions_by_tool (latest by provider)" in plans and "get_meta_id #2" in plans
+    for description, plan in plans.items():
+        assert plan and not [d for d in plan if d.startswith("SCAN")], description
+
+
+def test_version_tags(config):
+    """Tools and versions are queried by tag, tags follow replaced and deleted versions"""
+    test_db = ToolDatabase(config)
+    tool = ToolInfo(**FAKE_TOOL_INFO)
+    tool2 = ToolInfo(**FAKE_TOOL_INFO2)
+
+    def version(number: str, tags: set, day: int) -> VersionInfo:
+        return VersionInfo(number, VersionType.REMOTE, "no_checker_case", tags, datetime(2021, 3, day), size=1)
+
+    tool.versions = [version("1.0", {"latest", "1"}, 2), version("0.9", {"stable"}, 1)]
+    tool2.versions = [version("2.0", {"dev"}, 1)]
+    with test_db.transaction():
+        test_db.insert_tool_info([tool, tool2])
+    assert test_db.get_tools_with_tag("latest") == ["test_tool"]
+    assert test_db.get_tools_with_tag("latest", "test_location_two") == []
+    assert test_db.get_tools_with_tag("latest", version_type=[VersionType.LOCAL]) == []
+    assert test_db.get_version_by_tag("test_tool", "stable", "test_location").version == "0.9"
+    assert test_db.get_version_by_tag("test_tool", "dev") is None
+    tools = test_db.get_tools(filter_by=[VersionType.REMOTE], tag="dev")
+    assert [t.name for t in tools] == ["test_tool_two"] and len(tools[0].versions) == 1
+    # Tag moved into replaced version, tags of deleted version are deleted as well
+    with test_db.transaction():
+        test_db.insert_version_info(tool, version("0.9", {"stable", "latest"}, 3))
+        test_db.delete_remote_versions("test_tool", "test_location", ["0.9"])
+    assert test_db.get_version_by_tag("test_tool", "latest").version == "0.9"
+    tags = [("dev", "2.0"), ("latest", "0.9"), ("stable", "0.9")]
+    s_tags = "SELECT tag, version FROM version_tags JOIN version_data ON id = version_id ORDER BY tag"
+    test_db.execute(s_tags)
+    assert [tuple(r) for r in test_db.cursor.fetchall()] == tags
+    # Tags of existing versions are split from the comma separated column on upgrade
+    test_db.execute("DROP TABLE version_tags")
+    test_db.execute("PRAGMA user_version = 1")
+    del test_db
+    test_db = ToolDatabase(config)
+    test_db.execute(s_tags)
+    assert [tuple(r) for r in test_db.cursor.fetchall()] == tags
+
+
+def test_retention(config):
+    """Old upstream versions, versions of removed tags and old tag changes are deleted, file is compacted"""
+    test_db = ToolDatabase(config)
+    tool = ToolInfo(**FAKE_TOOL_INFO)
+    now = datetime.now()
+
+    def version(number: str, version_type: VersionType, source: str, tags: set, age: timedelta) -> VersionInfo:
+        return VersionInfo(number, version_type, source, tags, now - age, size=1)
+
+    tool.versions = [version(f"0.{i}", VersionType.UPSTREAM, "github", {"upstream"}, timedelta(hours=i))
+                     for i in range(300)]
+    tool.versions += [version("1.0", VersionType.UPSTREAM, "pypi", {"upstream"}, timedelta(days=1)),
+                      version("2.0", VersionType.REMOTE, "remote", {"latest", "2"}, timedelta(days=1)),
+                      version("1.5", VersionType.REMOTE, "remote", {"1.5"}, timedelta(days=50)),
+                      version("1.0", VersionType.REMOTE, "remote", {"1.0", "old"}, timedelta(days=100))]
+    with test_db.transaction():
+        test_db.insert_tool_info(tool)
+        test_db.insert_tag_digests(tool.name, tool.location, {"latest": "sha256:a", "2": "sha256:a"})
+        test_db.insert_tag_changes(tool.name, tool.location, [("1.5", "removed", ""), ("1.0", "removed", ""),
+                                                              ("old", "moved", "sha256:b")])
+        # Removed long ago, and change older than retention
+        test_db.execute("UPDATE tag_changes SET changed = ? WHERE tag = '1.0'", (epoch_time(now - timedelta(days=40)),))
+        test_db.execute("UPDATE tag_changes SET changed = ? WHERE tag = 'old'", (epoch_time(now - timedelta(days=400)),))
+        test_db.execute("UPDATE version_data SET created = ? WHERE version = '1.5'",
+                        (epoch_time(now - timedelta(days=50)),))
+    report = test_db.apply_retention()
+    assert report[:3] == (290, 1, 1)
+    assert report.reclaimed_bytes > 0
+    versions = test_db.get_versions_by_tool(tool.name)
+    assert sorted(v.version for v in versions if v.source == "github") == sorted(f"0.{i}" for i in range(10))
+    # Removed recently, kept until retention time
+    assert sorted(v.version for v in versions if v.version_type == VersionType.REMOTE) == ["1.5", "2.0"]
+    assert [c[0] for c in test_db.get_tag_changes(tool.name, tool.location)] == ["1.5", "1.0"]
+    test_db.execute("PRAGMA auto_vacuum")
+    assert test_db.cursor.fetchone()[0] == 2
+    assert test_db.apply_retention() == (0, 0, 0, 0)
+
+
+def test_connection_pool(base_db, config, mocker):
+    """Worker threads open single read connection each, schema is checked once"""
+    create_tables = mocker.spy(ToolDatabase, "create_tables_if_not_exist")
+    pool = ConnectionPool(config)
+
+    def read(tool_name):
+        db = pool.get()
+        assert db is pool.get()
+        return db, db.get_single_tool(tool_name).name
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        results = list(executor.map(read, ["test_tool"] * 20))
+    assert [name for _, name in results] == ["test_tool"] * 20
+    assert 1 <= len({id(db) for db, _ in results}) == len(pool.connections) <= 2
+    assert create_tables.call_count == 1
+    with pytest.raises(sqlite3.OperationalError):
+        pool.get().execute("DELETE FROM tools")
+    pool.close()
+    assert not pool.connections and all(db.db_conn is None for db, _ in results)
+
+
+def test_database_writer(config, caplog):
+    """Writes are committed in batches by count and by time, failed write is rolled back alone"""
+    config.db_write_batch = 3
+    config.db_write_interval = 60
+    db = ToolDatabase(config)
+    tools = [ToolInfo(f"tool{i}", datetime.now(), "remote") for i in range(8)]
+
+    def stored(expected: int) -> bool:
+        # Committed by the writer thread, without flush
+        deadline = time.monotonic() + 5
+        while len(db.get_tools()) < expected and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return len(db.get_tools()) == expected
+
+    writer = DatabaseWriter(config)
+    for t in tools[:7]:
+        writer.put(lambda d, tool=t: d.insert_tool_info(tool))
+    assert stored(6)
+    assert writer.commits == 2
+    # Rest of the batch waits for interval or flush
+    writer.flush()
+    assert len(db.get_tools()) == 7 and writer.commits == 3
+
+    writer.put(lambda d: d.insert_meta_info("missing", "remote", FAKE_CHECKER_CONF))
+    writer.put(lambda d: d.insert_tool_info(tools[7]))
+    with pytest.raises(sqlite3.IntegrityError):
+        writer.flush()
+    assert len(db.get_tools()) == 8 and not db.get_meta_information("missing")
+    assert "Failed to write into database" in caplog.text
+    writer.flush()
+
+    writer.interval = 0.05
+    writer.put(lambda d: d.insert_tool_info(ToolInfo("tool8", datetime.now(), "remote")))
+    assert stored(9)
+    writer.close()
+    with pytest.raises(RuntimeError):
+        writer.put(lambda d: None)
+
+
 def test_invalid_types():
     # TODO add tests with invalid data type inserts, handle them gracefully on the code
     pass
@@ -0,0 +1,161 @@
+import httpx
+import pytest
+import requests
+from requests.adapters import BaseAdapter
+
+from cincanregistry.http_policy import BREAKER_CLOSED, BREAKER_HALF_OPEN, BREAKER_OPEN, CircuitBreaker, \
+    CircuitOpenError, HttpPolicy, PolicySession
+from cincanregistry.transport import HttpxTransport, TransportError
+
+
+class FakeAdapter(BaseAdapter):
+    """Returns given status codes in order, None raises connection error"""
+
+    def __init__(self, statuses):
+        super().__init__()
+        self.statuses = list(statuses)
+        self.sent = []
+
+    def send(self, request, **kwargs):
+        self.sent.append((request.method, kwargs.get("timeout")))
+        status = self.statuses.pop(0)
+        if status is None:
+            raise requests.ConnectionError("refused")
+        resp = requests.Response()
+        resp.status_code = status
+        resp.request = request
+        return resp
+
+    def close(self):
+        pass
+
+
+class RedirectLoopAdapter(FakeAdapter):
+    """Fails every request with other than connection error"""
+
+    def send(self, request, **kwargs):
+        raise requests.TooManyRedirects("loop")
+
+
+def _session(policy, statuses):
+    session = PolicySession(policy)
+    adapter = FakeAdapter(statuses)
+    session.mount("https://", adapter)
+    return session, adapter
+
+
+def test_circuit_breaker(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr("cincanregistry.http_policy.time.monotonic", lambda: now[0])
+    breaker = CircuitBreaker(threshold=2, reset_timeout=30)
+    breaker.failure()
+    assert breaker.state == BREAKER_CLOSED and breaker.allow()
+    breaker.failure()
+    assert breaker.state == BREAKER_OPEN and not breaker.allow()
+    now[0] += 30
+    # Single trial request after reset timeout
+    assert breaker.allow() and breaker.state == BREAKER_HALF_OPEN
+    assert not breaker.allow()
+    breaker.failure()
+    assert breaker.state == BREAKER_OPEN and breaker.opened == 2
+    now[0] += 30
+    assert breaker.allow()
+    breaker.success()
+    assert breaker.state == BREAKER_CLOSED and breaker.allow()
+
+
+def test_session_retries_idempotent(monkeypatch):
+    monkeypatch.setattr("cincanregistry.http_policy.time.sleep", lambda s: None)
+    policy = HttpPolicy(connect_timeout=2, read_timeout=5, retries=2)
+    session, adapter = _session(policy, [None, 503, 200])
+    assert session.get("https://api.test/tags").status_code == 200
+    assert adapter.sent == [("GET", (2, 5))] * 3
+    assert policy.retry_counts == {"api.test": 2}
+    # Retries are limited
+    session, adapter = _session(policy, [502, 502, 502, 200])
+    assert session.get("https://api.test/tags").status_code == 502
+    assert len(adapter.sent) == 3
+    # Not retried: client errors and non-idempotent methods
+    session, adapter = _session(policy, [404, 503, 200])
+    assert session.get("https://api.test/tags").status_code == 404
+    assert session.post("https://api.test/login").status_code == 503
+    assert len(adapter.sent) == 2
+    assert "api.test: 4 retries" in policy.summary()
+
+
+def test_session_fails_fast(monkeypatch):
+    monkeypatch.setattr("cincanregistry.http_policy.time.sleep", lambda s: None)
+    policy = HttpPolicy(retries=5, breaker_threshold=3)
+    session, adapter = _session(policy, [None] * 10)
+    with pytest.raises(requests.ConnectionError):
+        session.get("https://down.test/")
+    # Retrying stops when breaker opens
+    assert len(adapter.sent) == 3
+    with pytest.raises(CircuitOpenError):
+        session.get("https://down.test/other")
+    assert len(adapter.sent) == 3
+    # Other hosts are not affected
+    session.mount("https://up.test", FakeAdapter([200]))
+    assert session.get("https://up.test/").status_code == 200
+    assert policy.summary() == "Failed requests: down.test: 2 retries, breaker open (opened 1 times), " \
+                               "1 requests rejected."
+
+
+def test_transport_policy(loop, monkeypatch, mock_transport):
+    async def no_sleep(delay):
+        pass
+
+    monkeypatch.setattr("cincanregistry.transport.asyncio.sleep", no_sleep)
+    statuses = [500, 200, 500, 500]
+
+    def handler(request):
+        status = statuses.pop(0)
+        if status is None:
+            raise httpx.ConnectError("refused")
+        return httpx.Response(status, content=b"body")
+
+    policy = HttpPolicy(retries=1, breaker_threshold=2)
+    transport = mock_transport(HttpxTransport(10, policy=policy), handler)
+
+    async def run():
+        assert (await transport.get("https://registry.test/v2/")).status_code == 200
+        # Stream is not retried, second failure opens the breaker
+        assert (await transport.stream("https://registry.test/blob", lambda c: True)).status_code == 500
+        assert (await transport.head("https://registry.test/v2/")).status_code == 500
+        with pytest.raises(TransportError):
+            await transport.get("https://registry.test/v2/")
+
+    loop.run_until_complete(run())
+    assert transport.request_count == 4
+    assert policy.breakers["registry.test"].state == BREAKER_OPEN
+
+
+def test_abandoned_trial(loop, monkeypatch, mock_transport):
+    """Trial request of half-open breaker failing without outcome from the host lets next request try again"""
+    now = [100.0]
+    monkeypatch.setattr("cincanregistry.http_policy.time.monotonic", lambda: now[0])
+    policy = HttpPolicy(retries=0, breaker_threshold=1, breaker_reset=30)
+    transport = mock_transport(HttpxTransport(10, policy=policy),
+                               lambda request: httpx.Response(200, content=b"body"))
+
+    def broken(chunk):
+        raise ValueError("broken chunk")
+
+    async def run():
+        policy.record("registry.test", None)
+        now[0] += 30
+        with pytest.raises(ValueError):
+            await transport.stream("https://registry.test/blob", broken)
+        assert (await transport.get("https://registry.test/v2/")).status_code == 200
+
+    loop.run_until_complete(run())
+    assert policy.breakers["registry.test"].state == BREAKER_CLOSED
+    # Same for the session of upstream checkers
+    policy.record("api.test", None)
+    now[0] += 30
+    session = PolicySession(policy)
+    session.mount("https://", RedirectLoopAdapter([]))
+    with pytest.raises(requests.TooManyRedirects):
+        session.get("https://api.test/tags")
+    session.mount("https://", FakeAdapter([200]))
+    assert session.get("https://api.test/tags").status_code == 200
@@ -110,3 +110,34 @@ def test_config_reference():
     EXAMPLE_MANIFEST["config"]["digest"] = "not-starting-with-sha256"
     with pytest.raises(ValueError):
         ConfigReference(EXAMPLE_MANIFEST.get("config"))
+
+
+
+def test_manifest_list():
+    manifest = ManifestV2({
+        "schemaVersion": 2,
+        "mediaType": "application/vnd.docker.distribution.manifest.list.v2+json",
+        "manifests": [
+            {"mediaType": "application/vnd.docker.distribution.manifest.v2+json", "size": 7143,
+             "digest": "sha256:e692418e4cbaf90ca69d05a66403747baa33ee08806650b51fab815ad7fc331f",
+             "platform": {"architecture": "arm64", "os": "linux", "variant": "v8"}},
+            {"mediaType": "application/vnd.oci.image.manifest.v1+json", "size": 566,
+             "digest": "sha256:5b0bcabd1ed22e9fb1310cf6c2dec7cdef19f0ad69efa1f392e94a4333501270",
+             "platform": {"architecture": "unknown", "os": "unknown"}},
+        ]
+    })
+    assert manifest.is_list
+    assert [m.platform for m in manifest.manifests] == ["linux/arm64/v8", "unknown/unknown"]
+    assert [m.is_image for m in manifest.manifests] == [True, False]
+    image = {
+        "schemaVersion": 2,
+        "mediaType": ManifestV2.OCI_MANIFEST_MIME,
+        "config": {"mediaType": "application/vnd.oci.image.config.v1+json", "size": 5802,
+                   "digest": "sha256:7cc538b3587d8bbc0ad3fb0cbb2cdae9f7f562f26066f847a1b69964fcb71108"},
+        "layers": [],
+    }
+    assert not ManifestV2(image).is_list
+    # OCI index without media type
+    index = ManifestV2({"schemaVersion": 2, "manifests": []})
+    assert index.is_list and index.mediaType == ManifestV2.OCI_INDEX_MIME
+    assert ManifestV2(image).config.mediaType == "application/vnd.oci.image.config.v1+json"
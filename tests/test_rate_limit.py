@@ -0,0 +1,69 @@
+import asyncio
+from email.utils import format_datetime
+from datetime import datetime, timedelta, timezone
+
+import httpx
+
+from cincanregistry.rate_limit import RateLimitScheduler, parse_limit_header, parse_retry_after
+from cincanregistry.transport import HttpxTransport
+
+
+def test_parse_headers():
+    assert parse_limit_header("76;w=21600") == 76
+    assert parse_limit_header("100") == 100
+    assert parse_limit_header("many") is None
+    assert parse_retry_after("5") == 5
+    assert parse_retry_after("") is None
+    later = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=30), usegmt=True)
+    assert 25 < parse_retry_after(later) <= 30
+
+
+def test_retry_on_too_many_requests(loop, caplog, mock_transport):
+    scheduler = RateLimitScheduler(max_wait=1, max_retries=2)
+    responses = [httpx.Response(429, headers={"Retry-After": "0.05"}), httpx.Response(200)]
+
+    async def run(transport):
+        return await transport.get("https://registry.test/v2/")
+
+    transport = mock_transport(HttpxTransport(10, scheduler), lambda r: responses.pop(0))
+    assert loop.run_until_complete(run(transport)).status_code == 200
+    assert transport.request_count == 2
+    budget = scheduler.hosts["registry.test"]
+    assert (budget.requests, budget.throttled) == (2, 1)
+    assert 0.04 < scheduler.waited < 0.1
+    # Too long wait is not attempted
+    transport = mock_transport(HttpxTransport(10, scheduler),
+                               lambda r: httpx.Response(429, headers={"Retry-After": "3600"}))
+    assert loop.run_until_complete(run(transport)).status_code == 429
+    # Without Retry-After, exponential backoff starting from one second
+    transport = mock_transport(HttpxTransport(10, RateLimitScheduler(max_wait=0.5)), lambda r: httpx.Response(429))
+    assert loop.run_until_complete(run(transport)).status_code == 429
+    assert transport.request_count == 1
+    assert caplog.records[-1].message == "Rate limit of registry.test exceeded, retry after 1 seconds not attempted."
+    assert transport.scheduler.summary() == "Made 1 requests (registry.test: 1), rate limited 1 times, waited 0.0 seconds."
+
+
+def test_concurrency_follows_budget(loop, mock_transport):
+    scheduler = RateLimitScheduler()
+    running = []
+    max_running = []
+
+    async def handler(request):
+        running.append(request)
+        max_running.append(len(running))
+        await asyncio.sleep(0.01)
+        running.remove(request)
+        return httpx.Response(200, headers={"RateLimit-Remaining": "4;w=21600", "RateLimit-Limit": "100;w=21600"})
+
+    transport = mock_transport(HttpxTransport(10, scheduler), handler)
+
+    async def run():
+        await transport.get("https://registry.test/v2/")
+        await asyncio.gather(*[transport.get("https://registry.test/v2/") for _ in range(10)])
+
+    loop.run_until_complete(run())
+    # Half of the remaining budget is used at once
+    assert max(max_running) == 2
+    assert scheduler.allowed("registry.test", 10) == 2
+    assert scheduler.allowed("other.test", 10) == 10
+    assert scheduler.summary() == "Made 11 requests (registry.test: 11 (budget used 0, remaining 4/100))."
@@ -1,12 +1,17 @@
+import asyncio
+import httpx
 import pytest
 import logging
 import datetime
+import threading
 from unittest import mock
-from cincanregistry import ToolInfo
-from cincanregistry.remotes import DockerHubRegistry
+from cincanregistry import ToolInfo, VersionInfo, VersionType
+from cincanregistry.checkers import classmap
+from cincanregistry.remotes import DockerHubRegistry, QuayRegistry
 from cincanregistry.models.manifest import ConfigReference, LayerObject
 from cincanregistry.utils import parse_file_time
-from .fake_instances import FAKE_DOCKER_REGISTRY_ERROR, FAKE_MANIFEST, TEST_REPOSITORY
+from .fake_instances import FAKE_CHECKER_CONF, FAKE_DOCKER_REGISTRY_ERROR, FAKE_MANIFEST, TEST_REPOSITORY, \
+    FakeRegistryV2
 
 
 def test_docker_registry_api_error(mocker, caplog, config):
@@ -27,21 +32,21 @@ def test_docker_registry_api_error(mocker, caplog, config):
 
 
 @pytest.mark.external_api
-def test_get_service_token(mocker, config):
+def test_get_service_token(patch_transport, config, loop):
     reg = DockerHubRegistry(configuration=config)
-    assert reg._get_registry_service_token(TEST_REPOSITORY)
+    assert loop.run_until_complete(reg._get_registry_service_token(TEST_REPOSITORY))
     ret = mock.Mock(ok=True)
     ret.status_code = 404
     ret.json.return_value = FAKE_DOCKER_REGISTRY_ERROR
-    mocker.patch.object(reg.session, "get", return_value=ret, autospec=True)
-    assert not reg._get_registry_service_token(TEST_REPOSITORY)
+    patch_transport(reg, ret)
+    assert not loop.run_until_complete(reg._get_registry_service_token(TEST_REPOSITORY))
 
 
 @pytest.mark.external_api
-def test_fetch_manifest(mocker, config):
+def test_fetch_manifest(patch_transport, config, loop):
     reg = DockerHubRegistry(configuration=config)
     # Test against real API
-    manifest = reg.fetch_manifest(TEST_REPOSITORY, "dev")
+    manifest = loop.run_until_complete(reg.fetch_manifest(TEST_REPOSITORY, "dev"))
     assert manifest.schemaVersion == 2
     assert manifest.mediaType == "application/vnd.docker.distribution.manifest.v2+json"
     assert isinstance(manifest.config, ConfigReference)
@@ -49,8 +54,8 @@ def test_fetch_manifest(mocker, config):
     ret = mock.Mock(ok=True)
     ret.status_code = 404
     ret.json.return_value = FAKE_DOCKER_REGISTRY_ERROR
-    mocker.patch.object(reg.session, "get", return_value=ret, autospec=True)
-    assert not reg.fetch_manifest(TEST_REPOSITORY, "dev")
+    patch_transport(reg, ret)
+    assert not loop.run_until_complete(reg.fetch_manifest(TEST_REPOSITORY, "dev"))
 
 
 @pytest.mark.external_api
@@ -97,11 +102,11 @@ def test_get_version_from_manifest(mocker, caplog, config):
 
 
 @pytest.mark.external_api
-def test_fetch_tags(mocker, caplog, config):
+def test_fetch_tags(patch_transport, caplog, config, loop):
     reg = DockerHubRegistry(configuration=config)
     caplog.set_level(logging.INFO)
     tool_info = ToolInfo(TEST_REPOSITORY, datetime.datetime.now(), "remote")
-    reg.fetch_tags(tool_info, update_cache=False)
+    loop.run_until_complete(reg.fetch_tags(tool_info, update_cache=False))
     assert tool_info.name == TEST_REPOSITORY
     assert len(tool_info.versions) == 1
     assert tool_info.versions[0].version == "1.0"
@@ -116,10 +121,444 @@ def test_fetch_tags(mocker, caplog, config):
     ret = mock.Mock(ok=True)
     ret.status_code = 404
     ret.content = "Not Found"
-    mocker.patch.object(reg.session, "get", return_value=ret, autospec=True)
+    patch_transport(reg, ret)
     tool_info = ToolInfo(TEST_REPOSITORY, datetime.datetime.now(), "remote")
-    reg.fetch_tags(tool_info, update_cache=False)
+    loop.run_until_complete(reg.fetch_tags(tool_info, update_cache=False))
     logs = [l.message for l in caplog.records]
     assert logs == [
         "Error when getting tags for tool cincan/test: Not Found"
     ]
+
+
+def test_update_versions_from_manifest_by_tags(mocker, config, loop):
+    """Tags are fetched concurrently under the cap, merged by version in the order of tags"""
+    config.max_tag_requests = 2
+    reg = DockerHubRegistry(configuration=config)
+    # Version of the tag, missing manifest for 'broken'
+    versions = {"latest": "1.1", "1.1": "1.1", "1.0": "1.0"}
+    running = []
+    max_running = []
+
+    async def fake_token(name):
+        return "token"
+
+    async def fake_manifest(name, tag, token):
+        running.append(tag)
+        max_running.append(len(running))
+        await asyncio.sleep(0.01)
+        running.remove(tag)
+        if tag not in versions:
+            return None
+        manifest = mock.Mock(is_list=False)
+        manifest.layers = [mock.Mock(size=10), mock.Mock(size=20)]
+        manifest.config.digest = tag
+        return manifest
+
+    async def fake_config(name, digest, token):
+        conf = mock.Mock()
+        conf.created = "2020-05-23T19:43:14.106177342Z"
+        conf.config = {"Env": [f"TOOL_VERSION={versions.get(digest)}"]}
+        return conf
+
+    mocker.patch.object(reg, "_get_registry_service_token", side_effect=fake_token)
+    mocker.patch.object(reg, "fetch_manifest", side_effect=fake_manifest)
+    mocker.patch.object(reg, "fetch_image_config", side_effect=fake_config)
+    # No meta file download
+    config.tag = "nonexistent"
+
+    available = loop.run_until_complete(
+        reg.update_versions_from_manifest_by_tags(TEST_REPOSITORY, ["latest", "1.1", "broken", "1.0"])
+    )
+    assert max(max_running) == 2
+    assert [v.version for v in available] == ["1.1", "1.0"]
+    assert available[0].tags == {"latest", "1.1"}
+    assert available[1].tags == {"1.0"}
+    assert available[0].size == "30 bytes"
+    assert available[0].updated == parse_file_time("2020-05-23T19:43:14")
+
+
+def test_skip_unchanged_tags_by_digest(config, loop, mock_transport):
+    """Only tags with changed manifest digest are fetched, once per digest"""
+    fake = FakeRegistryV2({"latest": "1.1", "1.1": "1.1", "1.0": "1.0"})
+    reg = DockerHubRegistry(configuration=config)
+    mock_transport(reg, fake.handler)
+    tags = ["latest", "1.1", "1.0"]
+
+    def update() -> list:
+        fake.requests.clear()
+        available = loop.run_until_complete(
+            reg.update_versions_from_manifest_by_tags(TEST_REPOSITORY, tags, tool_id="test"))
+        reg.update_cache({"test": ToolInfo("test", datetime.datetime.now(), reg.registry_name, versions=available)})
+        return available
+
+    available = update()
+    assert fake.count("HEAD", "/manifests/") == 3
+    # 'latest' and '1.1' share the manifest
+    assert fake.count("GET", "/manifests/") == 2
+    assert [(v.version, v.tags) for v in available] == [("1.1", {"latest", "1.1"}), ("1.0", {"1.0"})]
+    assert reg.db.get_tag_digests("test", reg.registry_name) == fake.tags
+
+    available = update()
+    assert fake.count("HEAD", "/manifests/") == 3
+    assert fake.count("GET", "/manifests/") == 0
+    assert fake.count("GET", "/blobs/") == 0
+    assert [(v.version, v.tags) for v in available] == [("1.1", {"latest", "1.1"}), ("1.0", {"1.0"})]
+
+    fake.set_tag("latest", "1.2")
+    available = update()
+    assert fake.count("GET", "/manifests/") == 1
+    assert [(v.version, v.tags) for v in available] == [("1.2", {"latest"}), ("1.1", {"1.1"}), ("1.0", {"1.0"})]
+
+    # Forced refresh ignores stored digests
+    reg.force_refresh = True
+    update()
+    assert fake.count("GET", "/manifests/") == 3
+
+
+def test_skip_broken_tags(config, loop, caplog, mock_transport):
+    """Tags with malformed manifest or failed connection are logged and skipped, other tags are kept"""
+    fake = FakeRegistryV2({"latest": "1.1", "1.1": "1.1", "1.0": "1.0", "0.9": "0.9"})
+    reg = DockerHubRegistry(configuration=config)
+    reg.http_policy.retries = 0
+    handler = fake.handler
+
+    def broken_handler(request):
+        if request.url.path.endswith("/manifests/1.0"):
+            return httpx.Response(200, json={"schemaVersion": 1})
+        if request.url.path.endswith("/manifests/0.9"):
+            raise httpx.ConnectError("reset", request=request)
+        return handler(request)
+
+    mock_transport(reg, broken_handler)
+    available = loop.run_until_complete(
+        reg.update_versions_from_manifest_by_tags(TEST_REPOSITORY, ["latest", "1.1", "1.0", "0.9"]))
+    assert [(v.version, v.tags) for v in available] == [("1.1", {"latest", "1.1"})]
+    messages = [r.message for r in caplog.records]
+    assert any("Invalid manifest" in m and "tag 1.0" in m for m in messages)
+    assert any("Unable to get manifest" in m and "tag 0.9" in m for m in messages)
+
+
+def test_token_cache(config, loop, mock_transport):
+    """Tokens are requested for multiple scopes at once, shared and reused from cache"""
+    config.max_token_scopes = 2
+    fake = FakeRegistryV2({})
+    repos = ["cincan/a", "cincan/b", "cincan/c"]
+
+    reg = DockerHubRegistry(configuration=config)
+    mock_transport(reg, fake.handler)
+    loop.run_until_complete(reg.prefetch_tokens(repos))
+    assert fake.count("GET", "/token") == 2
+    tokens = loop.run_until_complete(asyncio.gather(*[reg._get_registry_service_token(r) for r in repos]))
+    assert fake.count("GET", "/token") == 2
+    assert tokens[0] == tokens[1] != tokens[2]
+    # Concurrent calls for uncached repository share single request
+    tokens = loop.run_until_complete(
+        asyncio.gather(*[reg._get_registry_service_token("cincan/d") for _ in range(3)]))
+    assert fake.count("GET", "/token") == 3
+    assert len(set(tokens)) == 1 and tokens[0]
+    # Next run uses tokens stored on disk
+    reg = DockerHubRegistry(configuration=config)
+    mock_transport(reg, fake.handler)
+    fake.requests.clear()
+    loop.run_until_complete(reg.prefetch_tokens(repos + ["cincan/d"]))
+    loop.run_until_complete(reg._get_registry_service_token("cincan/a"))
+    assert fake.count("GET", "/token") == 0
+
+
+def test_conditional_listing_requests(config, loop, mock_transport):
+    """Listings are requested with stored ETag, 304 uses cached tools"""
+    fake = FakeRegistryV2({"latest": "1.1", "1.0": "1.0"})
+    reg = QuayRegistry(configuration=config)
+    mock_transport(reg, fake.handler)
+
+    def run(coro_function):
+        fake.requests.clear()
+        return loop.run_until_complete(coro_function())
+
+    tools = run(lambda: reg.get_tools())
+    assert sorted(v.version for v in tools["test"].versions) == ["1.0", "1.1"]
+    assert fake.count("GET", "/manifests/") == 2
+    # Nothing changed, only listing is requested
+    tools = run(lambda: reg.get_tools())
+    assert [r for r in fake.requests if r[1] != "/v2/"] == [("GET", "/api/v1/repository")]
+    assert sorted(v.version for v in tools["test"].versions) == ["1.0", "1.1"]
+    # Filtered by tag in the database
+    assert list(run(lambda: reg.get_tools(defined_tag="1.0"))) == ["test"]
+    assert run(lambda: reg.get_tools(defined_tag="missing")) == {}
+    tool = ToolInfo("test", tools["test"].updated, reg.registry_name)
+    run(lambda: reg.fetch_tags(tool, update_cache=True))
+    assert fake.count("HEAD", "/manifests/") == 0
+    assert sorted(v.version for v in tool.versions) == ["1.0", "1.1"]
+    # Changed tag modifies the listings
+    fake.set_tag("latest", "1.2")
+    tools = run(lambda: reg.get_tools())
+    assert fake.count("GET", "/api/v1/repository/cincan/test") == 1
+    assert fake.count("GET", "/manifests/") == 1
+    assert "1.2" in [v.version for v in tools["test"].versions]
+    # Forced refresh does not use validators
+    run(lambda: reg.get_tools(force_update=True))
+    assert fake.count("GET", "/api/v1/repository/cincan/test") == 1
+    assert fake.count("GET", "/manifests/") == 2
+
+
+def test_fetch_meta_file(config, loop, caplog, mock_transport):
+    """Metafile is read from streamed layer, download stops at the metafile or at the byte cap"""
+    fake = FakeRegistryV2({"latest": "1.0"}, meta_file={"upstreams": [{"uri": "test"}]}, padding=200000)
+    reg = DockerHubRegistry(configuration=config)
+    layer = LayerObject({"mediaType": "application/vnd.docker.image.rootfs.diff.tar.gzip",
+                         "size": len(fake.blobs[fake.meta_layer]), "digest": fake.meta_layer})
+
+    mock_transport(reg, fake.handler)
+
+    def fetch():
+        return loop.run_until_complete(reg.fetch_meta_file(TEST_REPOSITORY, layer))
+
+    assert fetch() == {"upstreams": [{"uri": "test"}]}
+    # Large layer is not cached
+    assert reg.blob_cache.get(fake.meta_layer) is None
+    config.meta_layer_max_size = 100000
+    assert fetch() is None
+    config.meta_max_size = 10
+    config.meta_layer_max_size = 1000000
+    caplog.set_level(logging.ERROR)
+    assert fetch() is None
+    assert caplog.records[-1].message == \
+        f"Meta.json from {TEST_REPOSITORY} Docker image is larger than 0.01KB, not used."
+
+
+def test_fetch_blob_once(config, loop, mock_transport):
+    """Concurrent requests of the same blob share single download"""
+    fake = FakeRegistryV2({"latest": "1.0"})
+    reg = DockerHubRegistry(configuration=config)
+    mock_transport(reg, fake.handler)
+
+    blobs = loop.run_until_complete(
+        asyncio.gather(*[reg.fetch_blob(TEST_REPOSITORY, fake.meta_layer, "token") for _ in range(5)]))
+    assert blobs == [fake.blobs[fake.meta_layer]] * 5
+    assert fake.count("GET", "/blobs/") == 1
+    assert not reg._pending_blobs
+
+
+def test_tag_reconciliation(config, loop, mock_transport):
+    """Digests from listing are compared with stored tags, only changes are fetched and stored"""
+    fake = FakeRegistryV2({"latest": "1.1", "1.1": "1.1", "1.0": "1.0", "0.9": "0.9"})
+    reg = QuayRegistry(configuration=config)
+    mock_transport(reg, fake.handler)
+
+    def run():
+        fake.requests.clear()
+        return loop.run_until_complete(reg.get_tools())
+
+    tools = run()
+    # Digests are known from the listing
+    assert fake.count("HEAD", "/manifests/") == 0
+    assert fake.count("GET", "/manifests/") == 3
+    assert sorted(v.version for v in tools["test"].versions) == ["0.9", "1.0", "1.1"]
+    assert sorted((t, c) for t, c, _, _ in reg.db.get_tag_changes("test", reg.registry_name)) == [
+        ("0.9", "added"), ("1.0", "added"), ("1.1", "added"), ("latest", "added")]
+
+    fake.set_tag("latest", "1.2")
+    fake.set_tag("1.2", "1.2")
+    del fake.tags["0.9"]
+    tools = run()
+    # Moved and added tag share the manifest
+    assert fake.count("GET", "/manifests/") == 1
+    assert sorted((v.version, tuple(sorted(v.tags))) for v in tools["test"].versions) == [
+        ("1.0", ("1.0",)), ("1.1", ("1.1",)), ("1.2", ("1.2", "latest"))]
+    assert reg.db.get_tag_digests("test", reg.registry_name) == fake.tags
+    changes = reg.db.get_tag_changes("test", reg.registry_name)[4:]
+    assert sorted((t, c, d) for t, c, d, _ in changes) == [
+        ("0.9", "removed", ""), ("1.2", "added", fake.tags["1.2"]), ("latest", "moved", fake.tags["latest"])]
+
+
+def test_multi_platform_tags(config, loop, mock_transport):
+    """Platforms of manifest list are resolved, configs fetched once per digest, all platforms stored"""
+    fake = FakeRegistryV2({})
+    fake.set_tag("latest", "", platforms={"linux/amd64": "1.1", "linux/arm64/v8": "1.1-arm"})
+    fake.set_tag("1.1", "1.1")
+    reg = QuayRegistry(configuration=config)
+    mock_transport(reg, fake.handler)
+
+    def run():
+        fake.requests.clear()
+        return loop.run_until_complete(reg.get_tools(force_update=True))
+
+    tools = run()
+    assert [(v.version, v.tags) for v in tools["test"].versions] == [("1.1", {"latest", "1.1"})]
+    # Manifest list, two platforms and single image
+    assert fake.count("GET", "/manifests/") == 4
+    # Config of amd64 image is shared by both tags, meta file only from 'latest'
+    assert fake.count("GET", "/blobs/") == 3
+    platforms = reg.db.get_tag_platforms("test", reg.registry_name)
+    assert [(p["platform"], p["version"]) for p in platforms["latest"]] == [
+        ("linux/amd64", "1.1"), ("linux/arm64/v8", "1.1-arm")]
+    assert [(p["platform"], p["digest"]) for p in platforms["1.1"]] == [("linux/amd64", fake.tags["1.1"])]
+    assert platforms["latest"][0]["digest"] == fake.tags["1.1"]
+
+    config.platform = "linux/arm64/v8"
+    tools = run()
+    assert sorted(v.version for v in tools["test"].versions) == ["1.1", "1.1-arm"]
+
+
+def test_paginated_hub_listing(config, loop, mock_transport):
+    """Remaining pages of Docker Hub listings are fetched concurrently, tools are fetched page by page"""
+    fake = FakeRegistryV2({f"1.{i}": f"1.{i}" for i in range(5)})
+    fake.repositories = [f"tool{i}" for i in range(5)]
+    fake.hub_page_size = 2
+    reg = DockerHubRegistry(configuration=config)
+    mock_transport(reg, fake.handler)
+
+    def run(coro_function):
+        fake.requests.clear()
+        return loop.run_until_complete(coro_function())
+
+    tools = run(lambda: reg.get_tools())
+    assert sorted(tools) == [f"cincan/tool{i}" for i in range(5)]
+    assert fake.count("GET", "/v2/repositories/cincan/") == 3 + 5 * 3
+    assert fake.count("GET", "/v2/repositories/cincan/tool4/tags") == 3
+    assert sorted(v.version for v in tools["cincan/tool4"].versions) == [f"1.{i}" for i in range(5)]
+
+    # Failed page leaves tags of the tool untouched
+    handler = fake.handler
+
+    def failing_handler(request):
+        if request.url.params.get("page") == "3":
+            return httpx.Response(502)
+        return handler(request)
+
+    mock_transport(reg, failing_handler)
+    reg.http_policy.retries = 0
+    fake.set_tag("1.0", "2.0")
+    tool = ToolInfo("cincan/tool0", datetime.datetime.now(), reg.registry_name)
+    run(lambda: reg.fetch_tags(tool, update_cache=True))
+    assert not tool.versions
+    stored = reg.read_remote_versions_from_db("cincan/tool0")
+    assert sorted(v.version for v in stored.versions) == [f"1.{i}" for i in range(5)]
+
+
+def test_pipelined_quay_listing(config, loop, mock_transport):
+    """Tags of tools are fetched while later pages of Quay listing are still requested"""
+    fake = FakeRegistryV2({"latest": "1.0"})
+    fake.repositories = [f"tool{i}" for i in range(5)]
+    fake.quay_page_size = 2
+    reg = QuayRegistry(configuration=config)
+    first_tags = asyncio.Event()
+
+    async def handler(request):
+        if request.url.path == "/api/v1/repository/cincan/tool0":
+            first_tags.set()
+        elif request.url.params.get("next_page") == "2":
+            # Second page is answered only after tags of the first page are requested
+            await asyncio.wait_for(first_tags.wait(), 1)
+        return fake.handler(request)
+
+    mock_transport(reg, handler)
+    tools = loop.run_until_complete(reg.get_tools())
+    assert sorted(tools) == [f"tool{i}" for i in range(5)]
+    assert fake.count("GET", "/api/v1/repository") == 3 + 5
+    assert all(t.versions[0].version == "1.0" for t in tools.values())
+
+
+def test_hub_meta_data(config, loop, mock_transport):
+    """Meta data of Docker Hub tool is stored for the tool with its namespace"""
+    fake = FakeRegistryV2({"latest": "1.0"}, meta_file={"upstreams": [FAKE_CHECKER_CONF]})
+    fake.repositories = ["tool"]
+    reg = DockerHubRegistry(configuration=config)
+    mock_transport(reg, fake.handler)
+
+    tools = loop.run_until_complete(reg.get_tools())
+    assert [v.version for v in tools["cincan/tool"].versions] == ["1.0"]
+    meta_data = reg.db.get_meta_information("cincan/tool", FAKE_CHECKER_CONF["provider"])
+    assert [m.get("uri") for m in meta_data] == [FAKE_CHECKER_CONF["uri"]]
+
+
+def test_refresh_keeps_upstream_versions(config, loop, mock_transport):
+    """Meta data written again on refresh keeps its id, upstream versions referring to it are not deleted"""
+    conf = dict(FAKE_CHECKER_CONF, provider="GitHub")
+    fake = FakeRegistryV2({"latest": "1.0"}, meta_file={"upstreams": [conf]})
+    fake.repositories = ["tool"]
+    reg = DockerHubRegistry(configuration=config)
+    mock_transport(reg, fake.handler)
+
+    loop.run_until_complete(reg.get_tools())
+    tool = reg.db.get_single_tool("cincan/tool")
+    meta_id = reg.db.get_meta_id(tool.name, classmap["github"](conf))
+    with reg.db.transaction():
+        reg.db.insert_version_info(tool, VersionInfo("9.9", VersionType.UPSTREAM, classmap["github"](conf), set()))
+
+    loop.run_until_complete(reg.get_tools(force_update=True))
+    assert reg.db.get_meta_id(tool.name, classmap["github"](conf)) == meta_id
+    upstream = reg.db.get_versions_by_tool(tool.name, [VersionType.UPSTREAM])
+    assert [v.version for v in upstream] == ["9.9"]
+
+
+def test_interrupted_refresh(config, loop, mock_transport):
+    """Tools are committed as soon as fetched, interrupted update is continued by fetching only the rest"""
+    config.db_write_batch = 1
+    fake = FakeRegistryV2({"latest": "1.0"})
+    fake.repositories = [f"tool{i}" for i in range(5)]
+    reg = QuayRegistry(configuration=config)
+    fetch_tags = reg.fetch_tags
+    fetched = []
+
+    async def interrupted(tool, update_cache=False):
+        if tool.name == "tool4":
+            while len(fetched) < 4:
+                await asyncio.sleep(0.01)
+            raise RuntimeError("interrupted")
+        await fetch_tags(tool, update_cache)
+        fetched.append(tool.name)
+
+    mock_transport(reg, fake.handler)
+    reg.fetch_tags = interrupted
+    with pytest.raises(RuntimeError):
+        loop.run_until_complete(reg.get_tools())
+    stored = reg.read_remote_versions_from_db()
+    assert sorted(stored) == [f"tool{i}" for i in range(4)]
+    assert all(t.versions[0].version == "1.0" for t in stored.values())
+
+    reg.fetch_tags = fetch_tags
+    fake.requests.clear()
+    tools = loop.run_until_complete(reg.get_tools())
+    assert sorted(tools) == [f"tool{i}" for i in range(5)]
+    # Listing was not stored as valid, but only the missing tool is fetched
+    assert fake.count("GET", "/api/v1/repository/cincan/") == 1
+    assert fake.count("GET", "/api/v1/repository/cincan/tool4") == 1
+
+
+def test_slow_writes_do_not_block_fetching(config, loop, mock_transport):
+    """Full write queue does not block the event loop, other tools are fetched while the writer is stuck"""
+    config.db_write_batch = 1
+    fake = FakeRegistryV2({"latest": "1.0"})
+    fake.repositories = [f"tool{i}" for i in range(8)]
+    reg = QuayRegistry(configuration=config)
+    mock_transport(reg, fake.handler)
+    release = threading.Event()
+    released = []
+    write_tool = reg._write_tool
+    fetch_tags = reg.fetch_tags
+    fetched = []
+
+    def slow_write(tool, writes, db):
+        # Slow disk or busy database, released by the test when all tools are fetched
+        released.append(release.wait(2))
+        write_tool(tool, writes, db)
+
+    async def staggered(tool, update_cache=False):
+        await asyncio.sleep(0.01 * int(tool.name[len("tool"):]))
+        await fetch_tags(tool, update_cache)
+        fetched.append(tool.name)
+
+    async def run():
+        update = asyncio.ensure_future(reg.get_tools())
+        while len(fetched) < len(fake.repositories):
+            await asyncio.sleep(0.01)
+        release.set()
+        return await update
+
+    reg._write_tool = slow_write
+    reg.fetch_tags = staggered
+    tools = loop.run_until_complete(run())
+    assert sorted(tools) == [f"tool{i}" for i in range(8)]
+    # Writer was not timed out waiting for the blocked event loop
+    assert released and all(released)
@@ -0,0 +1,155 @@
+import copy
+import gzip
+from datetime import datetime
+
+import pytest
+
+from cincanregistry import ToolInfo, VersionInfo, VersionType
+from cincanregistry.database import ToolDatabase
+from cincanregistry.snapshot import SnapshotError, digest, export_snapshot, import_snapshot, read_rows, read_snapshot
+from .fake_instances import FAKE_CHECKER_CONF, FAKE_VERSION_INFO_WITH_CHECKER
+
+LOCATION = "Quay"
+
+
+def _database(config, name: str) -> ToolDatabase:
+    conf = copy.copy(config)
+    conf.tool_db = config.tool_db.with_name(f"{name}.sqlite")
+    return ToolDatabase(conf)
+
+
+def _populate(db: ToolDatabase):
+    """Tool with remote versions, tags and upstream version linked into meta data"""
+    tool = ToolInfo("test_tool", datetime(2021, 1, 1), LOCATION, description="Test tool")
+    tool.versions = [
+        VersionInfo("1.0", VersionType.REMOTE, LOCATION, {"latest", "1.0", "stable"}, datetime(2021, 1, 1), size=100),
+        VersionInfo("0.9", VersionType.REMOTE, LOCATION, {"0.9"}, datetime(2020, 1, 1), size=90),
+    ]
+    with db.transaction():
+        db.insert_tool_info(tool)
+        db.insert_meta_info(tool.name, LOCATION, FAKE_CHECKER_CONF)
+        db.insert_version_info(tool, VersionInfo(**FAKE_VERSION_INFO_WITH_CHECKER))
+        db.insert_tag_digests(tool.name, LOCATION, {"latest": "sha256:a", "1.0": "sha256:a", "0.9": "sha256:b"})
+        db.insert_tag_changes(tool.name, LOCATION, [("latest", "added", "sha256:a")])
+        db.insert_tag_platforms(tool.name, LOCATION, {"latest": [("linux/amd64", "sha256:c", "1.0",
+                                                                 datetime(2021, 1, 1), 100)]})
+        db.insert_validators("https://quay.io/api/v1/repository", LOCATION, "etag", "")
+
+
+def test_snapshot(config, tmp_path):
+    """Same content gives the same bytes, import gives the same content"""
+    db = _database(config, "source")
+    _populate(db)
+    report = export_snapshot(db, tmp_path / "first.gz")
+    assert report.rows == 1 + 1 + 3 + 3 + 1 + 1 and not report.deleted
+    # Order of comma separated tags depends on the writer
+    db.execute("UPDATE version_data SET tags = 'stable,latest,1.0' WHERE version = '1.0'")
+    assert export_snapshot(db, tmp_path / "second.gz") == report
+    assert (tmp_path / "first.gz").read_bytes() == (tmp_path / "second.gz").read_bytes()
+    rows = read_snapshot(tmp_path / "first.gz")
+    assert digest(rows) == report.digest
+    upstream = next(r for r in rows["version_data"] if r[3] == "upstream")
+    assert upstream[:4] == ("test_tool", LOCATION, "1.1", "upstream")
+    # Meta data by its unique columns instead of id
+    assert upstream[-4:] == ("https://test.uri", "test_repository", "test_tool", "test_provider")
+    assert not any("http_validators" in t or "version_tags" in t for t in rows)
+
+    local = _database(config, "local")
+    with local.transaction():
+        local.insert_validators("https://quay.io/api/v1/repository", LOCATION, "old", "")
+    assert import_snapshot(local, tmp_path / "first.gz") == report
+    assert digest(read_rows(local)) == report.digest
+    assert local.get_tools_with_tag("stable", LOCATION) == ["test_tool"]
+    # Upstream version is linked into the meta data of the local database
+    assert local.db_conn.execute("SELECT m.uri FROM version_data v JOIN metadata m ON m.meta_id = v.meta_id "
+                                 "WHERE v.version_type = 'upstream'").fetchone()[0] == "https://test.uri"
+    # Listing is checked again on next update
+    assert not local.get_validators("https://quay.io/api/v1/repository", LOCATION)
+
+
+def test_delta(config, tmp_path):
+    """Delta has only the changes, and is applied only on its base"""
+    db = _database(config, "source")
+    _populate(db)
+    base = export_snapshot(db, tmp_path / "snapshot.gz")
+    local = _database(config, "local")
+    import_snapshot(local, tmp_path / "snapshot.gz")
+
+    with db.transaction():
+        db.insert_tool_info(ToolInfo("test_tool", datetime(2021, 2, 1), LOCATION, description="Changed"))
+        db.delete_remote_versions("test_tool", LOCATION, ["0.9"])
+        db.delete_tag_digests("test_tool", LOCATION, ["0.9"])
+        db.insert_tag_changes("test_tool", LOCATION, [("0.9", "removed", "")])
+    report = export_snapshot(db, tmp_path / "delta.gz", since=tmp_path / "snapshot.gz")
+    assert report.rows == 2 and report.deleted == 2
+    with gzip.open(tmp_path / "delta.gz", "rt") as f:
+        assert len(f.readlines()) == 1 + 4
+
+    assert import_snapshot(local, tmp_path / "delta.gz") == report
+    assert digest(read_rows(local)) == digest(read_rows(db)) == report.digest
+    assert local.get_tools_with_tag("stable", LOCATION) == []
+    # Database is not at the base of delta anymore
+    with pytest.raises(SnapshotError):
+        import_snapshot(local, tmp_path / "delta.gz")
+    assert import_snapshot(local, tmp_path / "delta.gz", force=True).digest == report.digest
+    # Delta is not a base of another delta
+    with pytest.raises(SnapshotError):
+        export_snapshot(db, tmp_path / "delta2.gz", since=tmp_path / "delta.gz")
+    assert base.digest != report.digest
+
+
+def test_identical_tag_changes(config, tmp_path):
+    """Identical rows of tag change history are all kept in snapshot and delta"""
+    db = _database(config, "source")
+    _populate(db)
+    export_snapshot(db, tmp_path / "snapshot.gz")
+    local = _database(config, "local")
+    import_snapshot(local, tmp_path / "snapshot.gz")
+    with db.transaction():
+        db.insert_tag_changes("test_tool", LOCATION, [("0.9", "removed", "")] * 2)
+    report = export_snapshot(db, tmp_path / "delta.gz", since=tmp_path / "snapshot.gz")
+    assert report.rows == 2
+    import_snapshot(local, tmp_path / "delta.gz")
+    assert [c[:2] for c in local.get_tag_changes("test_tool", LOCATION)].count(("0.9", "removed")) == 2
+
+
+def test_local_tag_changes(config, tmp_path):
+    """Tag changes recorded by the importing database are kept, ids of the rows are local"""
+    db = _database(config, "source")
+    _populate(db)
+    export_snapshot(db, tmp_path / "snapshot.gz")
+    local = _database(config, "local")
+    import_snapshot(local, tmp_path / "snapshot.gz")
+    # Same change seen by both at the same time
+    for d, changes in ((local, [("1.0", "moved", "sha256:d")]),
+                       (db, [("0.9", "removed", ""), ("1.0", "moved", "sha256:d")])):
+        with d.transaction():
+            d.insert_tag_changes("test_tool", LOCATION, changes)
+            d.execute("UPDATE tag_changes SET changed = 1612137600 WHERE tag != 'latest'")
+    export_snapshot(db, tmp_path / "delta.gz", since=tmp_path / "snapshot.gz")
+    with gzip.open(tmp_path / "delta.gz", "rt") as f:
+        assert not any('"id"' in line for line in f)
+    for _ in range(2):
+        import_snapshot(local, tmp_path / "delta.gz", force=True)
+        # Same change recorded by both is not duplicated, applying delta again adds nothing
+        assert [c[:3] for c in local.get_tag_changes("test_tool", LOCATION)] == [
+            ("latest", "added", "sha256:a"), ("1.0", "moved", "sha256:d"), ("0.9", "removed", "")]
+    assert digest(read_rows(local)) == digest(read_rows(db))
+
+
+def test_invalid_snapshot(config, tmp_path):
+    db = _database(config, "source")
+    _populate(db)
+    export_snapshot(db, tmp_path / "snapshot.gz")
+    data = (tmp_path / "snapshot.gz").read_bytes()
+    (tmp_path / "truncated.gz").write_bytes(data[:len(data) // 2])
+    (tmp_path / "plain.gz").write_bytes(b"not compressed")
+    for name in ("truncated.gz", "plain.gz", "missing.gz"):
+        with pytest.raises(SnapshotError):
+            import_snapshot(db, tmp_path / name)
+    with gzip.open(tmp_path / "snapshot.gz", "rt") as f:
+        lines = f.readlines()
+    with gzip.open(tmp_path / "modified.gz", "wt") as f:
+        f.writelines(lines[:-1] + [lines[-1].replace("sha256", "sha512")])
+    with pytest.raises(SnapshotError, match="digest"):
+        import_snapshot(_database(config, "local"), tmp_path / "modified.gz")
@@ -0,0 +1,66 @@
+import json
+import time
+
+import pytest
+
+from cincanregistry.remotes import DockerHubRegistry, QuayRegistry
+from cincanregistry.stand_in import Faults, StandInRegistry, SyntheticNamespace
+
+
+@pytest.fixture(scope="function")
+def server():
+    with StandInRegistry(SyntheticNamespace(tools=12, tags=3)) as stand_in:
+        yield stand_in
+
+
+@pytest.mark.parametrize("registry_class", [DockerHubRegistry, QuayRegistry])
+def test_refresh_against_stand_in(registry_class, server, config, loop):
+    config.registry_url = server.url
+    reg = registry_class(configuration=config)
+    tools = loop.run_until_complete(reg.get_tools())
+    assert len(tools) == 12
+    for tool in tools.values():
+        assert sorted(v.version for v in tool.versions) == ["1.0", "1.1", "1.2"]
+        assert tool.versions[0].tags
+    # Listing spans single page, 'latest' shares manifest with '1.2'
+    assert server.requests["manifest"] == 12 * 3
+    assert server.requests["hub_tags" if registry_class is DockerHubRegistry else "quay_tags"] == 12
+    assert server.bytes_sent > 0
+
+    # Only changed tool is fetched again, new tag and moved 'latest' share the manifest
+    server.namespace.release("tool-00003", "2.0", int(time.time()) + 60)
+    server.requests.clear()
+    tools = loop.run_until_complete(reg.get_tools())
+    name = "cincan/tool-00003" if registry_class is DockerHubRegistry else "tool-00003"
+    assert "2.0" in [v.version for v in tools[name].versions]
+    assert server.requests["manifest"] == 1
+
+
+def test_token_handshake(server):
+    status, headers, _ = server.respond("GET", "/v2/", {}, {})[1:]
+    assert status == 401
+    assert headers["WWW-Authenticate"] == f'Bearer realm="{server.url}/token",service="stand-in"'
+    # Manifests require token granting the repository
+    path = "/v2/cincan/tool-00001/manifests/latest"
+    assert server.respond("GET", path, {}, {})[1] == 401
+    token = json.loads(server.respond("GET", "/token", {"scope": ["repository:cincan/tool-00002:pull"]}, {})[3])
+    assert server.respond("GET", path, {}, {"Authorization": f"Bearer {token['token']}"})[1] == 401
+    token = json.loads(server.respond("GET", "/token", {"scope": ["repository:cincan/tool-00001:pull"]}, {})[3])
+    kind, status, headers, body = server.respond("GET", path, {}, {"Authorization": f"Bearer {token['token']}"})
+    assert (kind, status) == ("manifest", 200)
+    assert headers["Docker-Content-Digest"] == server.namespace.repository("tool-00001").tags["latest"]
+    assert server.respond("GET", "/v2/cincan/tool-00012/manifests/latest", {}, {})[1] == 404
+
+
+def test_injected_faults():
+    server = StandInRegistry(SyntheticNamespace(tools=1), Faults(error_rate=1.0, rate_limit=2, rate_limit_window=30))
+    try:
+        for remaining in ("1;w=30", "0;w=30"):
+            status, headers, _ = server.respond("GET", "/api/v1/repository", {"namespace": ["cincan"]}, {})[1:]
+            assert status == 503
+            assert headers["RateLimit-Remaining"] == remaining
+        status, headers, _ = server.respond("GET", "/api/v1/repository", {"namespace": ["cincan"]}, {})[1:]
+        assert status == 429
+        assert 29 <= int(headers["Retry-After"]) <= 30
+    finally:
+        server.server_close()
@@ -0,0 +1,69 @@
+import io
+import tarfile
+
+import pytest
+
+from cincanregistry.tar_stream import TarMemberExtractor
+
+
+def _tar(members, tar_format=tarfile.GNU_FORMAT, mode="w:gz") -> bytes:
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode=mode, format=tar_format) as tar:
+        for name, data in members:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return buf.getvalue()
+
+
+def _feed(extractor: TarMemberExtractor, blob: bytes, chunk_size: int) -> int:
+    """Feed blob in chunks, returns amount of bytes fed"""
+    for i in range(0, len(blob), chunk_size):
+        if extractor.feed(blob[i:i + chunk_size]):
+            return i + chunk_size
+    return len(blob)
+
+
+@pytest.mark.parametrize("tar_format", [tarfile.GNU_FORMAT, tarfile.PAX_FORMAT, tarfile.USTAR_FORMAT])
+@pytest.mark.parametrize("mode", ["w:gz", "w"])
+@pytest.mark.parametrize("chunk_size", [1, 7, 512, 100000])
+def test_extract_member(tar_format, mode, chunk_size):
+    blob = _tar([("bin/tool", b"x" * 3000), ("meta.json", b'{"upstreams": []}')], tar_format, mode)
+    extractor = TarMemberExtractor("meta.json", 100)
+    _feed(extractor, blob, chunk_size)
+    assert extractor.done
+    assert extractor.content == b'{"upstreams": []}'
+    assert not extractor.too_large
+
+
+@pytest.mark.parametrize("tar_format", [tarfile.GNU_FORMAT, tarfile.PAX_FORMAT])
+def test_long_names(tar_format):
+    # Name longer than 100 characters is stored in GNU long name or pax header
+    blob = _tar([(f"{'a' * 150}/meta.json", b"{}"), ("meta.json", b"[]")], tar_format)
+    extractor = TarMemberExtractor("meta.json", 100)
+    _feed(extractor, blob, 100)
+    assert extractor.content == b"{}"
+    extractor = TarMemberExtractor("meta.json", 100)
+    _feed(extractor, _tar([(f"{'a' * 150}/other", b"{}"), ("meta.json", b"[]")], tar_format), 100)
+    assert extractor.content == b"[]"
+
+
+def test_stops_early():
+    blob = _tar([("meta.json", b"{}"), ("data", bytes(range(256)) * 1000)], mode="w")
+    extractor = TarMemberExtractor("meta.json", 100)
+    assert _feed(extractor, blob, 1024) == 1024
+    # Member larger than maximum is not read
+    extractor = TarMemberExtractor("data", 100)
+    assert _feed(extractor, blob, 512) == 1536
+    assert extractor.too_large and extractor.content is None
+    # Not found, finished by end of archive
+    extractor = TarMemberExtractor("other", 100)
+    _feed(extractor, blob, 512)
+    assert extractor.done and extractor.content is None
+
+
+def test_invalid_stream():
+    with pytest.raises(tarfile.TarError):
+        TarMemberExtractor("meta.json", 100).feed(b"\x1f\x8b" + b"garbage" * 100)
+    with pytest.raises(tarfile.TarError):
+        TarMemberExtractor("meta.json", 100).feed(b"garbage" * 100)
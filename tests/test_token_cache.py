@@ -0,0 +1,47 @@
+import base64
+import json
+import time
+
+from cincanregistry.token_cache import TokenCache, granted_repositories
+
+
+def _jwt(claims: dict) -> str:
+    payload = base64.urlsafe_b64encode(json.dumps(claims).encode()).decode().rstrip("=")
+    return f"e30.{payload}.signature"
+
+
+def test_put_and_get(tmp_path):
+    location = tmp_path / "tokens.json"
+    cache = TokenCache(location)
+    assert cache.get("registry", "repository:cincan/test:pull") is None
+    cache.put("registry", ["repository:cincan/test:pull", "repository:cincan/other:pull"], "token", 300)
+    assert cache.get("registry", "repository:cincan/test:pull") == "token"
+    assert cache.get("registry", "repository:cincan/other:pull") == "token"
+    assert cache.get("other-registry", "repository:cincan/test:pull") is None
+    # Stored on disk for next runs
+    assert TokenCache(location).get("registry", "repository:cincan/test:pull") == "token"
+    # Tokens about to expire are not used, and expired are dropped on save
+    cache.put("registry", ["repository:cincan/short:pull"], "short", 5)
+    assert cache.get("registry", "repository:cincan/short:pull") is None
+    cache._tokens["registry repository:cincan/short:pull"]["expires"] = time.time() - 1
+    cache.put("registry", ["repository:cincan/test:pull"], "new", 300)
+    assert set(json.loads(location.read_text())) == {"registry repository:cincan/test:pull",
+                                                     "registry repository:cincan/other:pull"}
+
+
+def test_corrupted_cache_file(tmp_path, caplog):
+    location = tmp_path / "tokens.json"
+    location.write_text("{not json")
+    cache = TokenCache(location)
+    assert cache.get("registry", "repository:cincan/test:pull") is None
+    assert caplog.records[0].message.startswith(f"Unable to read token cache {location}")
+    cache.put("registry", ["repository:cincan/test:pull"], "token", 300)
+    assert TokenCache(location).get("registry", "repository:cincan/test:pull") == "token"
+
+
+def test_granted_repositories():
+    token = _jwt({"access": [{"type": "repository", "name": "cincan/test", "actions": ["pull"]},
+                             {"type": "repository", "name": "cincan/other", "actions": []}]})
+    assert granted_repositories(token) == {"cincan/test"}
+    assert granted_repositories("opaque-token") is None
+    assert granted_repositories(_jwt({"sub": "anonymous"})) is None
@@ -8,7 +8,7 @@ from cincanregistry.configuration import Configuration
 from cincanregistry.toolregistry import ToolRegistry
 
 
-def test_create_registry(mocker, caplog, config):
+def test_create_registry(mocker, caplog, config, loop):
     caplog.set_level(logging.DEBUG)
     # Ignore possible configuration file in local filesystem
     mocker.patch("builtins.open", side_effect=IOError())
@@ -16,7 +16,7 @@ def test_create_registry(mocker, caplog, config):
 
     logging.getLogger("docker").setLevel(logging.WARNING)
     reg = ToolRegistry(default_remote=Remotes.DOCKERHUB, configuration=config)
-    reg.remote_registry._set_auth_and_service_location()
+    loop.run_until_complete(reg.remote_registry._set_auth_and_service_location())
     assert reg.logger
     if reg.local_registry._is_docker_running():
         assert reg.local_registry.client
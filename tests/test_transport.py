@@ -0,0 +1,133 @@
+import asyncio
+import logging
+from unittest import mock
+
+import httpx
+import pytest
+import requests
+
+from cincanregistry.http_policy import HttpPolicy
+from cincanregistry.transport import (
+    create_transport,
+    HttpxTransport,
+    RequestsTransport,
+    TransportError,
+)
+
+
+def test_create_transport(caplog):
+    session = requests.Session()
+    caplog.set_level(logging.WARNING)
+    transport = create_transport("httpx", session, 100, 30)
+    assert isinstance(transport, HttpxTransport)
+    assert transport.max_connections == 100
+    transport = create_transport("requests", session, 100, 30)
+    assert isinstance(transport, RequestsTransport)
+    # Thread pool is sized by max workers
+    assert transport.max_connections == 30
+    transport = create_transport("curl", session, 100, 30)
+    assert isinstance(transport, RequestsTransport)
+    logs = [l.message for l in caplog.records]
+    assert logs == ["Unknown HTTP backend 'curl', using 'requests'."]
+
+
+def test_requests_transport(loop):
+    session = mock.Mock(spec=requests.Session)
+    resp = mock.Mock(status_code=200)
+    session.request.return_value = resp
+    transport = RequestsTransport(session, 2, policy=HttpPolicy(backoff_max=0))
+    assert loop.run_until_complete(transport.get("https://test.uri", params={"a": 1})) is resp
+    session.request.assert_called_with("GET", "https://test.uri", params={"a": 1}, headers=None,
+                                       allow_redirects=True, timeout=(10, 30))
+    loop.run_until_complete(transport.head("https://test.uri"))
+    session.request.assert_called_with("HEAD", "https://test.uri", params=None, headers=None,
+                                       allow_redirects=False, timeout=(10, 30))
+    assert transport.request_count == 2
+    session.request.side_effect = requests.ConnectionError("refused")
+    with pytest.raises(TransportError):
+        loop.run_until_complete(transport.get("https://test.uri"))
+    # Connection failure of GET is retried
+    assert session.request.call_count == 2 + 4
+    transport.close()
+
+
+def test_httpx_transport(loop, mock_transport):
+    def handler(request: httpx.Request):
+        if request.url.host == "down.test.uri":
+            raise httpx.ConnectError("refused", request=request)
+        return httpx.Response(200, json={"path": request.url.path, "accept": request.headers.get("Accept")})
+
+    # Connection failure is not retried
+    transport = mock_transport(HttpxTransport(10, policy=HttpPolicy(retries=0)), handler)
+
+    async def run():
+        resp = await transport.get("https://test.uri/v2/", headers={"Accept": "application/json"})
+        with pytest.raises(TransportError):
+            await transport.get("https://down.test.uri/v2/")
+        return resp
+
+    resp = loop.run_until_complete(run())
+    assert resp.status_code == 200
+    assert resp.json() == {"path": "/v2/", "accept": "application/json"}
+    assert transport.request_count == 2
+
+
+def test_httpx_transport_close(loop):
+    """Client is closed on its event loop, also when replaced by client of another loop"""
+    transport = HttpxTransport(10)
+
+    async def run():
+        return transport.client
+
+    client = loop.run_until_complete(run())
+    transport.close()
+    assert client.is_closed and transport._client is None
+
+    client = loop.run_until_complete(run())
+    loop.run_until_complete(transport.aclose())
+    assert client.is_closed
+
+    client = loop.run_until_complete(run())
+    other_loop = asyncio.new_event_loop()
+    try:
+        assert other_loop.run_until_complete(run()) is not client
+        # Closed when its own loop runs again
+        loop.run_until_complete(asyncio.sleep(0))
+        assert client.is_closed
+        transport.close()
+    finally:
+        other_loop.close()
+
+
+def test_stream(loop, mock_transport):
+    chunks = []
+
+    def consume(chunk: bytes) -> bool:
+        chunks.append(chunk)
+        return len(chunks) == 2
+
+    session = mock.Mock(spec=requests.Session)
+    resp = mock.Mock(status_code=200)
+    resp.iter_content.return_value = iter([b"a", b"b", b"c"])
+    session.get.return_value = resp
+    transport = RequestsTransport(session, 2)
+    assert loop.run_until_complete(transport.stream("https://test.uri/blob", consume)) is resp
+    session.get.assert_called_with("https://test.uri/blob", headers=None, stream=True, timeout=(10, 30))
+    assert chunks == [b"a", b"b"]
+    resp.close.assert_called_once()
+    transport.close()
+
+    chunks.clear()
+    transport = mock_transport(HttpxTransport(10), lambda r: httpx.Response(
+        200 if r.url.path == "/blob" else 404, content=b"x" * 100000))
+
+    async def run():
+        resp = await transport.stream("https://test.uri/blob", consume)
+        assert resp.status_code == 200
+        resp = await transport.stream("https://test.uri/missing", consume)
+        assert resp.status_code == 404
+
+    loop.run_until_complete(run())
+    # Only two chunks read, nothing from unsuccessful response
+    assert len(chunks) == 2 and len(chunks[0]) < 100000
+    assert transport.request_count == 2
@@ -1,3 +1,9 @@
+import asyncio
+import threading
+from datetime import datetime
+
+from cincanregistry import ToolInfo
+from cincanregistry.database import ToolDatabase
 from cincanregistry.gitlab_utils import GitLabUtils
 from cincanregistry.version_maintainer import VersionMaintainer
 from cincanregistry.configuration import Configuration
@@ -8,3 +14,32 @@ def test_cache_metafile_by_path():
     path = pathlib.Path("testt/meta.json")
     gl_client = GitLabUtils(namespace="cincan", project="tools")
     # ver_man = VersionMaintainer(config)
+
+
+def test_upstream_writes_do_not_block_loop(config, loop):
+    """Upstream versions queued by the checks are committed without blocking the event loop"""
+    maintainer = VersionMaintainer(config, ToolDatabase(config))
+    release = threading.Event()
+    released = []
+    checked = []
+
+    def slow_write(db):
+        # Slow disk or busy database, released by the event loop
+        released.append(release.wait(2))
+
+    def check(tool, in_thread=False):
+        maintainer.db_writer.put(slow_write)
+        checked.append(tool.name)
+
+    async def run():
+        check_versions = asyncio.ensure_future(maintainer.check_upstream_versions({"tool": tool}))
+        while not checked:
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.05)
+        release.set()
+        return await check_versions
+
+    tool = ToolInfo("tool", datetime.now(), "remote")
+    maintainer._set_single_tool_upstream_versions = check
+    assert loop.run_until_complete(run()) == {"tool": tool}
+    assert released == [True]